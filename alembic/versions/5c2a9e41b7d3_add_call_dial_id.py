@@ -0,0 +1,28 @@
+"""add call dial_id, to write logged calls once
+
+Revision ID: 5c2a9e41b7d3
+Revises: 0dde2debce11
+Create Date: 2026-10-18 10:12:41.209118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2a9e41b7d3'
+down_revision = '0dde2debce11'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('calls', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dial_id', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_calls_dial_id'), ['dial_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('calls', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_calls_dial_id'))
+        batch_op.drop_column('dial_id')
@@ -0,0 +1,34 @@
+"""blocklist ip_network ranges, and IPv6 addresses
+
+Revision ID: 8e3f1d27c6a4
+Revises: 5c2a9e41b7d3
+Create Date: 2026-10-18 11:40:05.512730
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e3f1d27c6a4'
+down_revision = '5c2a9e41b7d3'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('admin_blocklist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ip_network', sa.String(length=43), nullable=True))
+        batch_op.alter_column('ip_address',
+               existing_type=sa.String(length=16),
+               type_=sa.String(length=45),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('admin_blocklist', schema=None) as batch_op:
+        batch_op.alter_column('ip_address',
+               existing_type=sa.String(length=45),
+               type_=sa.String(length=16),
+               existing_nullable=True)
+        batch_op.drop_column('ip_network')
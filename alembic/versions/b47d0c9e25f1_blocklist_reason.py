@@ -0,0 +1,26 @@
+"""blocklist reason, for automatic blocks
+
+Revision ID: b47d0c9e25f1
+Revises: 8e3f1d27c6a4
+Create Date: 2026-10-18 13:02:37.864113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b47d0c9e25f1'
+down_revision = '8e3f1d27c6a4'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('admin_blocklist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reason', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('admin_blocklist', schema=None) as batch_op:
+        batch_op.drop_column('reason')
@@ -0,0 +1,276 @@
+"""
+Compiled blocklist for the call hot path.
+
+Active Blocklist rows are indexed once per process, by exact IP address, phone hash and
+E.164 number, with IP ranges in a radix tree, and rebuilt when the version in the shared
+cache changes. Saving a Blocklist row bumps the version. Expiry times are kept in a heap,
+so expired blocks drop out as the clock passes them. Hits are counted in the shared cache,
+and added to the table by a scheduled job, so checking a caller never writes to the database.
+"""
+import hashlib
+import heapq
+import ipaddress
+import threading
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+import pytz
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import func
+from sqlalchemy_utils.types import phone_number
+
+from ..extensions import db, cache, rq
+
+from .models import Blocklist
+
+BLOCKLIST_VERSION_KEY = 'admin:blocklist:version'
+BLOCKLIST_HITS_KEY = 'admin:blocklist:hits:{block_id}'
+BLOCKLIST_FLUSH_KEY = 'admin:blocklist:flush'  # set while a hits flush is scheduled
+
+_compiled = None
+_compiled_lock = threading.Lock()
+
+
+def parse_ip(value):
+    """
+    Returns tuple (normalized string, ip_address or None if it doesn't parse)
+    IPv4 addresses mapped into IPv6 are matched as IPv4
+    """
+    try:
+        address = ipaddress.ip_address(value.strip())
+    except ValueError:
+        return (value, None)
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return (str(address), address)
+
+
+class NetworkTree(object):
+    """
+    Binary radix tree of IPv4 and IPv6 networks, for longest prefix matching.
+    A lookup walks at most one node per address bit, however many networks are stored.
+    Nodes are lists of [zero child, one child, values].
+    """
+
+    def __init__(self):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+
+    def _walk(self, network, create=False):
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                if not create:
+                    return None
+                node[bit] = [None, None, None]
+            node = node[bit]
+        return node
+
+    def insert(self, network, value):
+        node = self._walk(network, create=True)
+        if node[2] is None:
+            node[2] = set()
+        node[2].add(value)
+
+    def remove(self, network, value):
+        node = self._walk(network)
+        if node is not None and node[2]:
+            node[2].discard(value)
+
+    def longest_match(self, address):
+        """Values of the most specific network containing address, or an empty set"""
+        node = self._roots[address.version]
+        best = node[2]
+        bits = int(address)
+        width = address.max_prefixlen
+        for i in range(width):
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2]:
+                best = node[2]
+        return best or set()
+
+
+def expires_at(block):
+    """Expiry of a block as a unix timestamp, or None if it never expires"""
+    if not block.expires:
+        return None
+    timestamp = block.timestamp
+    if timestamp.tzinfo is None:
+        # sqlite doesn't store timezones in the database
+        timestamp = timestamp.replace(tzinfo=pytz.utc)
+    return (timestamp + block.expires).timestamp()
+
+
+class CompiledBlocklist(object):
+    """Hash indexes of the active blocks at one version"""
+
+    def __init__(self, blocks, version):
+        self.version = version
+        self.ips = {}
+        self.phone_hashes = {}
+        self.numbers = {}
+        self.networks = NetworkTree()
+        self.has_networks = False
+        self._indexed = {}
+        self._expiry = []
+        self._lock = threading.Lock()
+
+        now = time.time()
+        for block in blocks:
+            expiry = expires_at(block)
+            if expiry is not None and expiry < now:
+                continue
+            # match the first field set, like Blocklist.match
+            if block.ip_address:
+                self._add(self.ips, parse_ip(block.ip_address)[0], block.id)
+            elif block.ip_network:
+                try:
+                    network = ipaddress.ip_network(block.ip_network.strip(), strict=False)
+                except ValueError:
+                    # saved outside the admin form, which validates ranges
+                    current_app.logger.error('Skipping blocklist %s with invalid ip_network %r' % (block.id, block.ip_network))
+                    continue
+                self.networks.insert(network, block.id)
+                self._indexed[block.id] = lambda network=network, block_id=block.id: self.networks.remove(network, block_id)
+                self.has_networks = True
+            elif block.phone_hash:
+                self._add(self.phone_hashes, block.phone_hash, block.id)
+            elif block.phone_number:
+                self._add(self.numbers, block.phone_number.e164, block.id)
+            else:
+                continue
+            if expiry is not None:
+                self._expiry.append((expiry, block.id))
+        heapq.heapify(self._expiry)
+
+    def _add(self, index, value, block_id):
+        index.setdefault(value, set()).add(block_id)
+        self._indexed[block_id] = lambda: self._discard(index, value, block_id)
+
+    def _discard(self, index, value, block_id):
+        ids = index[value] - set([block_id])
+        if ids:
+            index[value] = ids
+        else:
+            del index[value]
+
+    def _expire(self, now):
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < now:
+                (expiry, block_id) = heapq.heappop(self._expiry)
+                remove = self._indexed.pop(block_id)
+                remove()
+
+    def __len__(self):
+        return len(self._indexed)
+
+    def match(self, user_phone, user_ip, user_country='US'):
+        """Returns the set of active block ids matching a caller"""
+        if self._expiry and self._expiry[0][0] < time.time():
+            self._expire(time.time())
+
+        matched = set()
+        if user_ip and (self.ips or self.has_networks):
+            (user_ip, address) = parse_ip(user_ip)
+            matched.update(self.ips.get(user_ip, ()))
+            if address is not None and self.has_networks:
+                matched.update(self.networks.longest_match(address))
+        if isinstance(user_phone, str) and self.phone_hashes:
+            phone_hash = hashlib.sha256(user_phone.encode('ascii')).hexdigest()
+            matched.update(self.phone_hashes.get(phone_hash, ()))
+        if user_phone and self.numbers:
+            if isinstance(user_phone, phone_number.PhoneNumber):
+                e164 = user_phone.e164
+            else:
+                try:
+                    e164 = phone_number.PhoneNumber(user_phone, user_country).e164
+                except phone_number.phonenumbers.NumberParseException:
+                    e164 = None
+            matched.update(self.numbers.get(e164, ()))
+        return matched
+
+
+def get_blocklist_version():
+    """Current blocklist version, initialized if the shared cache doesn't have one"""
+    version = cache.get(BLOCKLIST_VERSION_KEY)
+    if not version:
+        cache.add(BLOCKLIST_VERSION_KEY, uuid4().hex)
+        version = cache.get(BLOCKLIST_VERSION_KEY)
+    return version
+
+
+def get_compiled_blocklist():
+    """The compiled blocklist for this process, rebuilt if the version has changed"""
+    global _compiled
+    version = get_blocklist_version()
+    compiled = _compiled
+    if compiled is not None and compiled.version == version:
+        return compiled
+
+    with _compiled_lock:
+        if _compiled is None or _compiled.version != version:
+            _compiled = CompiledBlocklist(Blocklist.query.all(), version)
+        return _compiled
+
+
+def invalidate_blocklist():
+    """Bump the blocklist version, so each process recompiles on its next check"""
+    cache.set(BLOCKLIST_VERSION_KEY, uuid4().hex)
+
+
+def user_blocked(user_phone, user_ip, user_country='US'):
+    """
+    Checks a caller against the compiled blocklist, and counts a hit for each matching block
+    """
+    compiled = get_compiled_blocklist()
+    if not len(compiled):
+        # exit early if no blocks active
+        return False
+
+    matched = compiled.match(user_phone, user_ip, user_country)
+    if matched:
+        count_hits(matched)
+    return bool(matched)
+
+
+def count_hits(block_ids):
+    for block_id in block_ids:
+        # INCR with redis, so concurrent hits are all counted
+        cache.cache.inc(BLOCKLIST_HITS_KEY.format(block_id=block_id))
+
+    interval = current_app.config.get('BLOCKLIST_HITS_FLUSH_INTERVAL')
+    if not interval:
+        flush_blocklist_hits()
+    elif cache.add(BLOCKLIST_FLUSH_KEY, 1, timeout=interval):
+        try:
+            flush_blocklist_hits.schedule(timedelta(seconds=interval))
+        except RedisError:
+            current_app.logger.error('Unable to schedule blocklist hits flush', exc_info=True)
+            cache.delete(BLOCKLIST_FLUSH_KEY)
+
+
+@rq.job
+def flush_blocklist_hits():
+    """Add hits counted in the shared cache to the Blocklist table"""
+    block_ids = [row.id for row in Blocklist.query.with_entities(Blocklist.id)]
+    if not block_ids:
+        return 0
+    keys = [BLOCKLIST_HITS_KEY.format(block_id=block_id) for block_id in block_ids]
+    counts = [(block_id, key, int(count)) for (block_id, key, count)
+              in zip(block_ids, keys, cache.get_many(*keys)) if count]
+
+    for (block_id, key, count) in counts:
+        Blocklist.query.filter_by(id=block_id).update(
+            {Blocklist.hits: func.coalesce(Blocklist.hits, 0) + count}, synchronize_session=False)
+    db.session.commit()
+
+    # only after the commit, so hits are never lost
+    for (block_id, key, count) in counts:
+        cache.cache.dec(key, count)
+    return sum(count for (block_id, key, count) in counts)
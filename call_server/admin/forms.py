@@ -1,25 +1,38 @@
+import ipaddress
+
 from flask_wtf import FlaskForm
 from flask_babel import gettext as _
 from wtforms import StringField, SubmitField
 from wtforms_components import TimeField
 from wtforms_alchemy import PhoneNumberField
-from wtforms.validators import Optional, IPAddress
+from wtforms.validators import Optional, IPAddress, ValidationError
 
 
 class BlocklistForm(FlaskForm):
     phone_number = PhoneNumberField(_('Phone Number'), [Optional()])
     phone_hash = StringField(_('Phone Hash'), validators=[Optional()])
-    ip_address = StringField(_('IP Address'), validators=[Optional(), IPAddress()])
+    ip_address = StringField(_('IP Address'), validators=[Optional(), IPAddress(ipv4=True, ipv6=True)])
+    ip_network = StringField(_('IP Range'), validators=[Optional()],
+                             description=_('IPv4 or IPv6 network, like 192.0.2.0/24 or 2001:db8::/32'))
     expires = TimeField(_('Expiration'), [Optional()])
     submit = SubmitField(_('Next'))
 
+    def validate_ip_network(self, field):
+        try:
+            # store in canonical form, with host bits cleared
+            field.data = str(ipaddress.ip_network(field.data.strip(), strict=False))
+        except ValueError:
+            raise ValidationError(_('Invalid IP network'))
+
     def validate(self):
         if not super(BlocklistForm, self).validate():
             return False
-        if not self.phone_number.data  and not self.phone_hash.data and not self.ip_address.data:
-            msg = 'At least one of Phone Number, Phone hash, or IP Address must be set'
+        if (not self.phone_number.data and not self.phone_hash.data
+                and not self.ip_address.data and not self.ip_network.data):
+            msg = 'At least one of Phone Number, Phone hash, IP Address or IP Range must be set'
             self.phone_number.errors.append(msg)
             self.phone_hash.errors.append(msg)
             self.ip_address.errors.append(msg)
+            self.ip_network.errors.append(msg)
             return False
         return True
\ No newline at end of file
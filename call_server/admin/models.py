@@ -1,10 +1,13 @@
 import hashlib
+import ipaddress
 from datetime import datetime
 import pytz
 
 from ..extensions import db
 from ..utils import utc_now
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession, object_session
 from sqlalchemy_utils.types import phone_number
 
 class Blocklist(db.Model):
@@ -16,13 +19,16 @@ class Blocklist(db.Model):
     expires = db.Column(db.Interval)
     phone_number = db.Column(phone_number.PhoneNumberType(), nullable=True)
     phone_hash = db.Column(db.String(64), nullable=True) # hashed phone number (optional)
-    ip_address = db.Column(db.String(16), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    ip_network = db.Column(db.String(43), nullable=True) # CIDR range, IPv4 or IPv6
     hits = db.Column(db.Integer(), default=0)
+    reason = db.Column(db.String(255), nullable=True) # set for automatic blocks
 
-    def __init__(self, phone_number=None, ip_address=None):
+    def __init__(self, phone_number=None, ip_address=None, ip_network=None):
         self.timestamp = utc_now()
         self.phone_number = phone_number
         self.ip_address = ip_address
+        self.ip_network = ip_network
 
     def __str__(self):
         if self.phone_number:
@@ -31,7 +37,8 @@ class Blocklist(db.Model):
             return self.phone_hash
         if self.ip_address:
             return  self.ip_address
-
+        if self.ip_network:
+            return self.ip_network
 
     def is_active(self):
         if self.expires:
@@ -46,8 +53,17 @@ class Blocklist(db.Model):
             return True
 
     def match(self, user_phone, user_ip, user_country='US'):
+        if self.ip_address or self.ip_network:
+            # normalized like the compiled blocklist
+            from .blocklist import parse_ip
+            (user_ip, address) = parse_ip(user_ip) if user_ip else (user_ip, None)
         if self.ip_address:
-            return self.ip_address == user_ip
+            return parse_ip(self.ip_address)[0] == user_ip
+        if self.ip_network:
+            try:
+                return address is not None and address in ipaddress.ip_network(self.ip_network.strip(), strict=False)
+            except ValueError:
+                return False
         if self.phone_hash:
             return self.phone_hash == hashlib.sha256(user_phone.encode('ascii')).hexdigest()
         if self.phone_number:
@@ -65,22 +81,24 @@ class Blocklist(db.Model):
     def user_blocked(cls, user_phone, user_ip, user_country='US'):
         """
         Takes a phone number and/or IP address, check it against blocklist
+        Hits are counted asynchronously, see admin.blocklist
         """
-        active_blocks = cls.active_blocks()
-        if not active_blocks:
-            # exit early if no blocks active
-            return False
+        from .blocklist import user_blocked
+        return user_blocked(user_phone, user_ip, user_country)
+
 
-        matched = False
-        for b in active_blocks:
-            if b.match(user_phone, user_ip, user_country):
-                if not b.phone_number:
-                    b.phone_number = user_phone
-                matched = True
-                b.hits += 1
-                db.session.add(b)
+@event.listens_for(Blocklist, 'after_insert')
+@event.listens_for(Blocklist, 'after_update')
+@event.listens_for(Blocklist, 'after_delete')
+def _blocklist_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['blocklist_changed'] = True
 
-        if matched:
-            db.session.commit()
-        return matched
 
+@event.listens_for(OrmSession, 'after_commit')
+def _recompile_blocklist(session):
+    # after the commit, so other processes can't compile the old rows at the new version
+    if session.info.pop('blocklist_changed', False):
+        from .blocklist import invalidate_blocklist
+        invalidate_blocklist()
@@ -11,7 +11,9 @@ from .models import Blocklist
 from .forms import BlocklistForm
 
 from ..campaign.models import TwilioPhoneNumber, Campaign
+from ..campaign.snapshot import invalidate_campaign_snapshot
 from ..call.models import Call
+from ..call.abuse import get_abuse_counters
 from ..sync.models import SyncCampaign
 from ..campaign.constants import STATUS_PAUSED
 from ..api.constants import API_TIMESPANS
@@ -107,6 +109,7 @@ def system():
     political_data_cache = {'US': cache.get('political_data:us'),
                             'CA': cache.get('political_data:ca')}
     blocked = Blocklist.query.order_by(Blocklist.timestamp.desc()).all()
+    abuse_counters = get_abuse_counters()
     if not political_data_cache['US']:
         flash(_("US Political Data not yet loaded. Run > flask loadpoliticaldata") , 'warning')
     return render_template('admin/system.html',
@@ -116,7 +119,9 @@ def system():
                            admin_api_key=admin_api_key,
                            crm_sync_campaigns=crm_sync_campaigns,
                            political_data_cache=political_data_cache,
-                           blocked=blocked)
+                           blocked=blocked,
+                           abuse_counters=abuse_counters,
+                           abuse_thresholds=current_app.config.get('ABUSE_THRESHOLDS'))
 
 
 @admin.route('/system/blocklist/create', methods=['GET', 'POST'])
@@ -182,11 +187,17 @@ def twilio_resync():
         TwilioPhoneNumber.number.notin_([n.phone_number for n in twilio_numbers]))
     # and remove them
     # TODO, check if delete will cascade to campaign
+    stale_campaign_ids = set()
     for num in stale_numbers.all():
         deleted_numbers.append(str(num.number))
+        stale_campaign_ids.update(c.id for c in num.campaigns)
         db.session.delete(num)
     db.session.commit()
 
+    # campaigns which lost a number need fresh call snapshots
+    for campaign_id in stale_campaign_ids:
+        invalidate_campaign_snapshot(campaign_id)
+
     if new_numbers:
         flash(_("Added Twilio Number: ") + ', '.join(new_numbers), 'success')
     if deleted_numbers:
@@ -15,6 +15,7 @@ from .constants import API_TIMESPANS
 from ..extensions import csrf, cors, rest, db, cache, talisman, CALLPOWER_CSP
 from ..campaign.models import Campaign, Target, AudioRecording
 from ..political_data.adapters import adapt_by_key, UnitedStatesData
+from ..political_data.data_cache import get_target_records
 from ..call.models import Call, Session
 from ..schedule.models import ScheduleCall
 from ..call.constants import TWILIO_CALL_STATUS
@@ -279,6 +280,47 @@ def campaign_date_calls(campaign_id):
     return jsonify({'objects': sorted_dates})
 
 
+def _adapt_call_target(political_data, campaign, target_title, target_name, target_uid):
+    """ Adapts a target without a stored record, from raw political data or the Target row """
+    # get more target_data from political_data cache
+    try:
+        target_data = political_data.cache_get(target_uid)[0]
+    except (KeyError,IndexError):
+        target_data = political_data.cache_get(target_uid)
+    except Exception as e:
+        current_app.logger.error('unable to cache_get for %s: %s' % (target_uid, e))
+        target_data = None
+
+    # use adapter to get title, name and district 
+    adapted_data = None
+    if ':' in target_uid:
+        data_adapter = adapt_by_key(target_uid)
+        try:
+            if target_data:
+                adapted_data = data_adapter.target(target_data)
+            else:
+                adapted_data = data_adapter.target({'title': target_title, 'name': target_name, 'uid': target_uid})
+        except AttributeError:
+            current_app.logger.error('unable to adapt target_data for %s: %s' % (target_uid, target_data))
+
+    elif political_data.country_code.lower() == 'us' and campaign.campaign_type == 'congress':
+        # fall back to USData, which uses bioguide
+        if not target_data:
+            try:
+                target_data = political_data.get_bioguide(target_uid)[0]
+            except Exception as e:
+                current_app.logger.error('unable to get_bioguide for %s: %s' % (target_uid, e))
+        if target_data:
+            try:
+                data_adapter = UnitedStatesData()
+                adapted_data = data_adapter.target(target_data)
+            except AttributeError:
+                current_app.logger.error('unable to adapt target_data for %s: %s' % (target_uid, target_data))
+        else:
+            current_app.logger.error('no target_data for %s' % target_uid)
+    return adapted_data
+
+
 # calls made by target
 @api.route('/campaign/<int:campaign_id>/target_calls.json', methods=['GET'])
 @api_key_or_auth_required
@@ -321,43 +363,14 @@ def campaign_target_calls(campaign_id):
     targets = defaultdict(dict)
     political_data = campaign.get_campaign_data().data_provider
 
-    for (target_title, target_name, target_uid) in query_call_targets:
-        # get more target_data from political_data cache
-        try:
-            target_data = political_data.cache_get(target_uid)[0]
-        except (KeyError,IndexError):
-            target_data = political_data.cache_get(target_uid)
-        except Exception as e:
-            current_app.logger.error('unable to cache_get for %s: %s' % (target_uid, e))
-            target_data = None
-
-        # use adapter to get title, name and district 
-        adapted_data = None
-        if ':' in target_uid:
-            data_adapter = adapt_by_key(target_uid)
-            try:
-                if target_data:
-                    adapted_data = data_adapter.target(target_data)
-                else:
-                    adapted_data = data_adapter.target({'title': target_title, 'name': target_name, 'uid': target_uid})
-            except AttributeError:
-                current_app.logger.error('unable to adapt target_data for %s: %s' % (target_uid, target_data))
+    call_targets = query_call_targets.all()
+    # adapted records stored with political data, in one fetch
+    target_records = get_target_records([target_uid for (target_title, target_name, target_uid) in call_targets])
 
-        elif political_data.country_code.lower() == 'us' and campaign.campaign_type == 'congress':
-            # fall back to USData, which uses bioguide
-            if not target_data:
-                try:
-                    target_data = political_data.get_bioguide(target_uid)[0]
-                except Exception as e:
-                    current_app.logger.error('unable to get_bioguide for %s: %s' % (target_uid, e))
-            if target_data:
-                try:
-                    data_adapter = UnitedStatesData()
-                    adapted_data = data_adapter.target(target_data)
-                except AttributeError:
-                    current_app.logger.error('unable to adapt target_data for %s: %s' % (target_uid, target_data))
-            else:
-                current_app.logger.error('no target_data for %s' % target_uid)
+    for (target_title, target_name, target_uid) in call_targets:
+        adapted_data = target_records.get(target_uid)
+        if not adapted_data:
+            adapted_data = _adapt_call_target(political_data, campaign, target_title, target_name, target_uid)
 
         if adapted_data:    
             targets[target_uid]['title'] = adapted_data.get('title')
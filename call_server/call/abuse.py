@@ -0,0 +1,166 @@
+"""
+Sliding window abuse counters for /call/create.
+
+Each request is counted by caller IP, phone number prefix, campaign and referral code,
+in redis sorted sets bucketed by ABUSE_WINDOW. The count for the last window is estimated
+from the current bucket, plus the previous bucket weighted by how much of it still overlaps.
+Counting every key costs one pipelined round trip.
+
+When an IP address or phone number prefix passes its threshold in ABUSE_THRESHOLDS, the caller
+is added to the Blocklist for ABUSE_BLOCK_DURATION, by IP address or by phone number.
+Campaign and referral counts are shared by every caller, so passing their thresholds only logs
+a warning, once per window.
+"""
+import time
+from datetime import timedelta
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from ..extensions import db, cache, rq
+
+ABUSE_DIMENSIONS = ('ip', 'phone_prefix', 'campaign', 'referral')
+BLOCKED_DIMENSIONS = ('ip', 'phone_prefix')  # counted per caller, so the caller is blocked
+ABUSE_KEY = 'call-power:abuse:{dimension}:{bucket}'
+ABUSE_ALERT_KEY = 'abuse:alert:{dimension}:{value}'  # set while a warning has been logged
+PHONE_PREFIX_HIDDEN_DIGITS = 4  # subscriber digits, leaves country, area and exchange codes
+
+
+def phone_prefix(e164):
+    """Leading digits of an E.164 number, shared by numbers from the same exchange"""
+    if not e164 or not e164.startswith('+'):
+        return None
+    return e164[:-PHONE_PREFIX_HIDDEN_DIGITS]
+
+
+def _buckets(window, now):
+    bucket = int(now // window)
+    overlap = 1 - (now % window) / float(window)
+    return (bucket, overlap)
+
+
+def count_request(values, window, connection=None, now=None):
+    """
+    Count one request for each dimension in values, a dict of dimension to value.
+    Returns dict of dimension to estimated requests in the last window, including this one.
+    """
+    values = dict((d, v) for (d, v) in values.items() if v)
+    if not values:
+        return {}
+    connection = connection or rq.connection
+    (bucket, overlap) = _buckets(window, now or time.time())
+
+    pipe = connection.pipeline(transaction=False)
+    for (dimension, value) in values.items():
+        current_key = ABUSE_KEY.format(dimension=dimension, bucket=bucket)
+        pipe.zincrby(current_key, 1, value)
+        pipe.expire(current_key, window * 2)
+        pipe.zscore(ABUSE_KEY.format(dimension=dimension, bucket=bucket - 1), value)
+    results = pipe.execute()
+
+    counts = {}
+    for (n, dimension) in enumerate(values.keys()):
+        (current, _, previous) = results[n*3:n*3+3]
+        counts[dimension] = current + (previous or 0) * overlap
+    return counts
+
+
+def check_abuse(user_ip, user_phone, campaign_id, referral_code=None, connection=None):
+    """
+    Counts a call request, and blocks the caller if their IP address or phone prefix trips a threshold.
+    user_ip should be the address our proxy saw, not one the caller can set.
+    Returns list of dimensions the caller was blocked for, empty if the request may continue.
+    Fails open if redis is unavailable.
+    """
+    config = current_app.config
+    if not config.get('ABUSE_COUNTERS'):
+        return []
+
+    values = {
+        'ip': user_ip,
+        'phone_prefix': phone_prefix(user_phone),
+        'campaign': str(campaign_id),
+        'referral': referral_code,
+    }
+    thresholds = config.get('ABUSE_THRESHOLDS', {})
+    values = dict((d, v) for (d, v) in values.items() if thresholds.get(d))
+    try:
+        counts = count_request(values, config['ABUSE_WINDOW'], connection)
+    except RedisError:
+        current_app.logger.error('Unable to count call request', exc_info=True)
+        return []
+
+    tripped = [d for d in ABUSE_DIMENSIONS if counts.get(d, 0) > thresholds.get(d)]
+    for dimension in tripped:
+        if dimension not in BLOCKED_DIMENSIONS and cache.add(
+                ABUSE_ALERT_KEY.format(dimension=dimension, value=values[dimension]), 1, timeout=config['ABUSE_WINDOW']):
+            current_app.logger.warning('Abuse counter for %s %s at %d, over %d' % (
+                dimension, values[dimension], counts[dimension], thresholds[dimension]))
+
+    blocked = [d for d in tripped if d in BLOCKED_DIMENSIONS]
+    if blocked:
+        block_caller(blocked, counts, thresholds, user_ip, user_phone)
+    return blocked
+
+
+def block_caller(tripped, counts, thresholds, user_ip, user_phone):
+    """
+    Adds Blocklist entries for the tripped dimensions, skipping any the caller is already blocked by,
+    so requests that keep coming don't each insert a row and recompile the blocklist everywhere.
+    """
+    from ..admin.models import Blocklist
+    from ..admin.blocklist import get_compiled_blocklist
+    expires = timedelta(seconds=current_app.config['ABUSE_BLOCK_DURATION'])
+    reason = 'auto: ' + ', '.join('%s %d > %d' % (d, counts[d], thresholds[d]) for d in tripped)
+    compiled = get_compiled_blocklist()
+
+    blocks = []
+    if user_ip and 'ip' in tripped and not compiled.match(None, user_ip):
+        blocks.append(Blocklist(ip_address=user_ip))
+    if user_phone and 'phone_prefix' in tripped and not compiled.match(user_phone, None):
+        blocks.append(Blocklist(phone_number=user_phone))
+    if not blocks:
+        return blocks
+
+    for block in blocks:
+        block.expires = expires
+        block.reason = reason
+    db.session.add_all(blocks)
+    db.session.commit()
+    current_app.logger.warning('Blocked caller %s (%s)' % (user_ip, reason))
+    return blocks
+
+
+def get_abuse_counters(top=10, connection=None):
+    """
+    Highest estimated counts in the last window for each dimension, for the admin system page.
+    Returns dict of dimension to list of (value, count), or None if redis is unavailable.
+    """
+    config = current_app.config
+    if not config.get('ABUSE_COUNTERS'):
+        return None
+    connection = connection or rq.connection
+    (bucket, overlap) = _buckets(config['ABUSE_WINDOW'], time.time())
+
+    try:
+        pipe = connection.pipeline(transaction=False)
+        for dimension in ABUSE_DIMENSIONS:
+            pipe.zrevrange(ABUSE_KEY.format(dimension=dimension, bucket=bucket), 0, top - 1, withscores=True)
+            pipe.zrevrange(ABUSE_KEY.format(dimension=dimension, bucket=bucket - 1), 0, top - 1, withscores=True)
+        results = pipe.execute()
+    except RedisError:
+        current_app.logger.error('Unable to read abuse counters', exc_info=True)
+        return None
+
+    counters = {}
+    for (n, dimension) in enumerate(ABUSE_DIMENSIONS):
+        counts = {}
+        (current, previous) = results[n*2:n*2+2]
+        for (value, score) in previous:
+            counts[value] = score * overlap
+        for (value, score) in current:
+            counts[value] = counts.get(value, 0) + score
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]
+        counters[dimension] = [(value.decode('utf-8') if isinstance(value, bytes) else value, int(round(count)))
+                               for (value, count) in ranked]
+    return counters
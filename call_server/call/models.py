@@ -26,6 +26,7 @@ class Call(db.Model):
 
     # twilio attributes
     call_id = db.Column(db.String(40))    # twilio call ID
+    dial_id = db.Column(db.String(64), unique=True, index=True)  # twilio dial ID, written once per call
     status = db.Column(db.String(25))     # twilio call status
     duration = db.Column(db.Integer)      # twilio call time in seconds
 
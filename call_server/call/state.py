@@ -0,0 +1,52 @@
+"""
+Server-side state for a call session, so TwiML urls only need to carry the sessionId
+and the call index. The index stays in the url, so retried webhooks are idempotent.
+
+State is kept in the shared cache (redis in production) as a compact json list,
+in the order of STATE_FIELDS, and its timeout is refreshed on every save.
+New fields are appended to STATE_FIELDS, so state saved before a deploy still loads.
+"""
+import json
+
+from ..extensions import cache
+
+CALL_STATE_KEY = 'call:state:{session_id}'
+CALL_STATE_TIMEOUT = 60*60*4  # longer than any reasonable sequence of calls
+
+STATE_FIELDS = ('campaignId', 'userPhone', 'userCountry', 'userLocation', 'userIPAddress',
+                'targetIds', 'call_index', 'scheduled', 'scheduleSkip', 'targetRowIds')
+
+
+def dump_call_state(params):
+    return json.dumps([params.get(f) for f in STATE_FIELDS], separators=(',', ':'))
+
+
+def load_call_state(data):
+    values = json.loads(data)
+    params = dict((f, None) for f in STATE_FIELDS)
+    params.update(zip(STATE_FIELDS, values))
+    params['targetIds'] = params['targetIds'] or []
+    params['targetRowIds'] = params['targetRowIds'] or []
+    params['call_index'] = params['call_index'] or 0
+    return params
+
+
+def get_call_state(session_id):
+    """Returns params dict for a call session, or None if it has expired or was never saved"""
+    if not session_id:
+        return None
+    data = cache.get(CALL_STATE_KEY.format(session_id=session_id))
+    if not data:
+        return None
+    params = load_call_state(data)
+    params['sessionId'] = session_id
+    return params
+
+
+def save_call_state(params):
+    """Store params for a call session, keyed by params['sessionId']"""
+    if not params.get('sessionId'):
+        return False
+    return cache.set(CALL_STATE_KEY.format(session_id=params['sessionId']),
+                     dump_call_state(params), timeout=CALL_STATE_TIMEOUT)
+
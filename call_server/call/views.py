@@ -8,23 +8,26 @@ from flask_jsonpify import jsonify
 from twilio.base.exceptions import TwilioRestException
 from sqlalchemy.sql import desc
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime
 
 from ..extensions import csrf, cors, db, limiter
 
 from .models import Call, Session
+from .state import get_call_state, save_call_state
+from .write_behind import log_call_event, call_event, ringing_event, session_event, dial_id
+from .abuse import check_abuse
 from .constants import TWILIO_TTS_LANGUAGES
 from ..campaign.constants import (LOCATION_POSTAL, LOCATION_DISTRICT,
     SEGMENT_BY_LOCATION, SEGMENT_BY_CUSTOM,
     TARGET_OFFICE_DISTRICT, TARGET_OFFICE_BUSY)
 from ..campaign.models import Campaign, Target
+from ..campaign.snapshot import get_campaign_snapshot, get_call_target, cache_call_targets
 from ..political_data.lookup import locate_targets, validate_location
 from ..political_data.geocode import LocationError
+from ..political_data.openstates import OpenStatesError
 from ..schedule.models import ScheduleCall
 from ..schedule.views import schedule_created, schedule_deleted
 from ..admin.models import Blocklist
 from ..admin.views import admin_phone
-from ..utils import parse_target
 
 from .decorators import abortJSON, stripANSI
 
@@ -59,6 +62,9 @@ def play_or_say(r, audio, voice='alice', lang='en-US', **kwargs):
             r.say(msg, voice=voice, language=lang)
         elif (hasattr(audio, 'file_storage') and (audio.file_storage.fp is not None)):
             r.play(audio.file_url())
+        elif (hasattr(audio, 'url') and audio.url):
+            # AudioMessage from a campaign snapshot
+            r.play(audio.url)
         elif type(audio) == str:
             try:
                 msg = pystache.render(audio, kwargs)
@@ -74,26 +80,51 @@ def play_or_say(r, audio, voice='alice', lang='en-US', **kwargs):
         current_app.logger.error(kwargs)
 
 
+def call_url(endpoint, params, **kwargs):
+    """
+    url_for a call route. Once a call session has server-side state, only the sessionId is passed,
+    with the call_index, so a webhook retried by Twilio repeats the same step.
+    Otherwise falls back to passing all params in the query string.
+    """
+    if params.get('sessionId'):
+        if params.get('call_index'):
+            kwargs['call_index'] = params['call_index']
+        return url_for(endpoint, sessionId=params['sessionId'], **kwargs)
+    else:
+        url_params = dict(params)
+        url_params.update(kwargs)
+        return url_for(endpoint, **url_params)
+
+
 def parse_params(r, inbound=False):
     """
-    Rehydrate objects from the parameter list.
+    Rehydrate objects from the call session state, or the parameter list.
     Gets invoked before each Twilio call.
     Should not edit param values.
     """
-    params = {
-        'campaignId': r.values.get('campaignId', None),
-        'scheduled': r.values.get('scheduled', None),
-        'scheduleSkip': r.values.get('scheduleSkip', None),
-        'sessionId': r.values.get('sessionId', None),
-        'targetIds': r.values.getlist('targetIds'),
-        'userPhone': r.values.get('userPhone', None),
-        'userCountry': r.values.get('userCountry', 'us'),
-        'userLocation': r.values.get('userLocation', None),
-        'userIPAddress': r.values.get('userIPAddress', None)
-    }
+    params = get_call_state(r.values.get('sessionId', None))
+    has_state = params is not None
+
+    if has_state:
+        # the call index travels in the url, not the saved state
+        params['call_index'] = int(r.values.get('call_index', 0))
+    else:
+        params = {
+            'campaignId': r.values.get('campaignId', None),
+            'scheduled': r.values.get('scheduled', None),
+            'scheduleSkip': r.values.get('scheduleSkip', None),
+            'sessionId': r.values.get('sessionId', None),
+            'targetIds': r.values.getlist('targetIds'),
+            'targetRowIds': r.values.getlist('targetRowIds', type=int),
+            'call_index': int(r.values.get('call_index', 0)),
+            'userPhone': r.values.get('userPhone', None),
+            'userCountry': r.values.get('userCountry', 'us'),
+            'userLocation': r.values.get('userLocation', None),
+            'userIPAddress': r.values.get('userIPAddress', None)
+        }
 
-    if params['userCountry']:
-        params['userCountry'] = params['userCountry'].upper()
+        if params['userCountry']:
+            params['userCountry'] = params['userCountry'].upper()
 
     if (not params['userPhone']) and not inbound:
         abort(400, 'userPhone required')
@@ -105,12 +136,17 @@ def parse_params(r, inbound=False):
     if not params['userLocation'] and r.values.get('zipcode', None):
         params['userLocation'] = r.values.get('zipcode')
 
-    # lookup campaign by ID
+    # sessions started with params in the query string keep them server-side from here on
+    if params['sessionId'] and not has_state:
+        save_call_state(params)
+
+    # lookup campaign snapshot by ID
     if params['campaignId'].isdigit():
-        campaign = Campaign.query.get(params['campaignId'])
+        campaign = get_campaign_snapshot(params['campaignId'])
     else:
         # fallback to name for legacy call-congress compatibility
-        campaign = Campaign.query.filter_by(name=params['campaignId']).first()
+        campaign_id = Campaign.query.with_entities(Campaign.id).filter_by(name=params['campaignId']).scalar()
+        campaign = get_campaign_snapshot(campaign_id) if campaign_id else None
     if not campaign:
         abort(400, 'invalid campaignId %(campaignId)s' % params)
 
@@ -133,7 +169,7 @@ def intro_wait_human(params, campaign):
 
     play_or_say(resp, campaign.audio('msg_intro'))
 
-    action = url_for("call._make_calls", **params)
+    action = call_url("call._make_calls", params)
 
     # wait for user keypress, in case we connected to voicemail
     g = Gather(num_digits=1, timeout=10, method="POST", action=action)
@@ -173,7 +209,7 @@ def location_gather(resp, params, campaign):
     Then, redirect to location_parse
     If no response, replay then hang up
     """
-    g = Gather(num_digits=5, timeout=10, method="POST", action=url_for("call.location_parse", **params))
+    g = Gather(num_digits=5, timeout=10, method="POST", action=call_url("call.location_parse", params))
     play_or_say(g, campaign.audio('msg_location'), lang=campaign.language_code)
     resp.append(g)
     # didn't get a response
@@ -185,6 +221,13 @@ def location_gather(resp, params, campaign):
     return str(resp)
 
 
+def call_target(params, i):
+    """CallTarget for the call_index i, from its Target row id saved by make_calls"""
+    row_ids = params.get('targetRowIds') or []
+    target_id = row_ids[i] if i < len(row_ids) else None
+    return get_call_target(params['targetIds'][i], target_id)
+
+
 def make_calls(params, campaign):
     """
     Connect a user to a sequence of targets.
@@ -206,7 +249,7 @@ def make_calls(params, campaign):
                 current_app.logger.info('locate_targets for %(userLocation)s in %(userCountry)s' % params)
                 params['targetIds'] = locate_targets(params['userLocation'], campaign=campaign)
                 # locate_targets will include from special target_set if specified in campaign.include_special
-            except LocationError as e:
+            except (LocationError, OpenStatesError) as e:
                 current_app.logger.error('Unable to locate_targets for %(userLocation)s in %(userCountry)s' % params)
                 params['targetIds'] = []
         else:
@@ -226,14 +269,22 @@ def make_calls(params, campaign):
     if campaign.call_maximum:
         params['targetIds'] = params['targetIds'][:campaign.call_maximum]
 
+    # materialize all targets at once, so later hops only read them
+    targets = Target.get_or_create_many(params['targetIds'], commit=False)
+    params['targetRowIds'] = [targets[key].id if key in targets else None for key in params['targetIds']]
+    cache_call_targets(targets.values())
+    db.session.commit()
+
     n_targets = len(params['targetIds'])
+    params['call_index'] = 0
+    save_call_state(params)
 
     play_or_say(resp, campaign.audio('msg_call_block_intro'),
                 n_targets=n_targets,
                 many=n_targets > 1,
                 lang=campaign.language_code)
 
-    resp.redirect(url_for('call.make_single', call_index=0, **params))
+    resp.redirect(call_url('call.make_single', params))
 
     return str(resp)
 
@@ -245,7 +296,7 @@ def schedule_prompt(params, campaign):
         abort(400)
 
     resp = VoiceResponse()
-    g = Gather(num_digits=1, timeout=3, method="POST", action=url_for("call.schedule_parse", **params))
+    g = Gather(num_digits=1, timeout=3, method="POST", action=call_url("call.schedule_parse", params))
     
     existing_schedule = ScheduleCall.query.filter_by(campaign_id=campaign.id, phone_number=params['userPhone']).first()
     if existing_schedule and existing_schedule.subscribed:
@@ -257,7 +308,8 @@ def schedule_prompt(params, campaign):
 
     # in case the timeout occurs, we need a redirect verb to ensure that the call doesn't drop
     params['scheduleSkip'] = 1
-    resp.redirect(url_for('call._make_calls', **params))
+    save_call_state(params)
+    resp.redirect(call_url('call._make_calls', params))
 
     return str(resp)
 
@@ -306,6 +358,7 @@ def incoming():
     db.session.commit()
 
     params['sessionId'] = call_session.id
+    save_call_state(params)
 
     if campaign.segment_by == SEGMENT_BY_LOCATION and campaign.locate_by in [LOCATION_POSTAL, LOCATION_DISTRICT]:
         return intro_location_gather(params, campaign)
@@ -352,9 +405,16 @@ def create():
         # press onward, but we may not be able to actually dial
         userPhone = params['userPhone']
 
-    if Blocklist.user_blocked(params['userPhone'], params['userIPAddress'], user_country=params['userCountry']):
+    # check the address ProxyFix took from our proxy as well, userIPAddress can be set by the caller
+    if (Blocklist.user_blocked(params['userPhone'], request.remote_addr, user_country=params['userCountry']) or
+            (params['userIPAddress'] and params['userIPAddress'] != request.remote_addr and
+             Blocklist.user_blocked(None, params['userIPAddress']))):
         abort(429, {'kthx': 'bai'}) # submission tripped blocklist
 
+    # count by the proxy-verified address too
+    if not admin_phone() and check_abuse(request.remote_addr, userPhone, campaign.id, request.values.get('ref')):
+        abort(429, {'kthx': 'bai'}) # submission tripped abuse counters, and is now blocked
+
     if campaign.status == 'archived':
         result = jsonify(campaign=campaign.status)
         return result
@@ -372,7 +432,7 @@ def create():
             params['targetIds'] = [t.key for t in targets_list]
         target_response = {
             'segment': 'custom',
-            'objects': [{'name': t.name, 'title': t.title, 'phone': t.number.e164} for t in targets_list if t.number]
+            'objects': [{'name': t.name, 'title': t.title, 'phone': t.number} for t in targets_list if t.number]
         }
     else:
         target_response = {
@@ -402,14 +462,15 @@ def create():
         db.session.commit()
 
         params['sessionId'] = call_session.id
+        save_call_state(params)
 
         # initiate outbound call
         call = current_app.config['TWILIO_CLIENT'].calls.create(
             to=userPhone,
             from_=from_number,
-            url=url_for('call.connection', _external=True, **params),
+            url=call_url('call.connection', params, _external=True),
             timeout=current_app.config['TWILIO_TIMEOUT'],
-            status_callback=url_for("call.status_callback", _external=True, **params),
+            status_callback=call_url("call.status_callback", params, _external=True),
             status_callback_event=['ringing','completed'],
             record=request.values.get('record', False))
 
@@ -484,9 +545,10 @@ def location_parse():
         call_session.location = location
         db.session.add(call_session)
         db.session.commit()
+    save_call_state(params)
 
     resp = VoiceResponse()
-    resp.redirect(url_for('call._make_calls', **params))
+    resp.redirect(call_url('call._make_calls', params))
     return str(resp)
 
 
@@ -528,7 +590,8 @@ def schedule_parse():
 
     # skip the schedule prompt as we start to make calls
     params['scheduleSkip'] = 1
-    resp.redirect(url_for('call._make_calls', **params))
+    save_call_state(params)
+    resp.redirect(call_url('call._make_calls', params))
     return str(resp)
 
 
@@ -555,57 +618,48 @@ def make_single():
     if not params or not campaign:
         abort(400)
 
-    i = int(request.values.get('call_index', 0))
-    params['call_index'] = i
+    i = params['call_index']
 
     try:
         target_id = params['targetIds'][i]
     except IndexError:
-        # if the url is too long, we may not get a valid parameter here
-        # reset the list
-        params['call_index'] = 0
-        params['targetIds'] = [t.key for t in campaign.target_set]
+        current_app.logger.error('call_index %s out of range for session %s' % (i, params['sessionId']))
         resp = VoiceResponse()
-        resp.redirect(url_for('call.make_single', **params))
+        resp.hangup()
         return str(resp)
 
-    (uid, prefix) = parse_target(target_id)
-    (current_target, created) = Target.get_or_create(uid, prefix)
-    if created:
-        # save Target to database
-        db.session.add(current_target)
-        db.session.commit()
+    current_target = call_target(params, i)
 
     resp = VoiceResponse()
 
-    if not current_target.number:
+    if not current_target or not current_target.number:
         play_or_say(resp, campaign.audio('msg_invalid_location'),
             lang=campaign.language_code)
         current_app.logger.error("No number found for target %s" % current_target)
         # weird, but move on to the next call
         params['call_index'] = i + 1
-        resp.redirect(url_for('call.make_single', **params))
+        resp.redirect(call_url('call.make_single', params))
         return str(resp)
 
     if current_target.offices:
         if campaign.target_offices == TARGET_OFFICE_DISTRICT:
             office = random.choice(current_target.offices)
-            target_phone = office.number
+            target_phone = (office.number, office.extension)
         elif campaign.target_offices == TARGET_OFFICE_BUSY:
             # TODO keep track of which ones we have tried
             undialed_offices = current_target.offices
             # then pick a random one
             office = random.choice(undialed_offices)
-            target_phone = office.number
+            target_phone = (office.number, office.extension)
         #elif campaign.target_offices == TARGET_OFFICE_CLOSEST:
         #   office = find_closest(current_target.offices, params['userLocation'])
         #   target_phone = office.phone
         else:
             office = None
-            target_phone = current_target.number
+            target_phone = (current_target.number, current_target.extension)
     else:
         office = None
-        target_phone = current_target.number
+        target_phone = (current_target.number, current_target.extension)
 
     if office:
         office_location = office.name
@@ -625,7 +679,7 @@ def make_single():
 
     if current_app.debug:
         current_app.logger.debug(u'Call #{}, {} ({}) from {} in call.make_single()'.format(
-            i, current_target.name, target_phone.e164, params['userPhone']))
+            i, current_target.name, target_phone[0], params['userPhone']))
 
     try:
         parsed = PhoneNumber(params['userPhone'], params['userCountry'])
@@ -640,8 +694,8 @@ def make_single():
     d = Dial(None, caller_id=userPhone,
               time_limit=current_app.config['TWILIO_TIME_LIMIT'],
               timeout=current_app.config['TWILIO_TIMEOUT'], hangup_on_star=True,
-              action=url_for('call.complete', **params))
-    d.number(target_phone.e164, sendDigits=target_phone.extension)
+              action=call_url('call.complete', params))
+    d.number(target_phone[0], sendDigits=target_phone[1])
     resp.append(d)
 
     return str(resp)
@@ -650,42 +704,39 @@ def make_single():
 @call.route('/complete', methods=call_methods)
 def complete():
     params, campaign = parse_params(request)
-    i = int(request.values.get('call_index', 0))
 
     if not params or not campaign:
         abort(400)
 
+    i = params['call_index']
+
     try:
         target_id = params['targetIds'][i]
     except IndexError:
-        # if the url is too long, we may not get a valid parameter here
-        # reset the list
-        params['call_index'] = 0
-        params['targetIds'] = [t.key for t in campaign.target_set]
+        current_app.logger.error('call_index %s out of range for session %s' % (i, params['sessionId']))
         resp = VoiceResponse()
-        resp.redirect(url_for('call.make_single', **params))
+        resp.hangup()
         return str(resp)
 
-    (uid, prefix) = parse_target(target_id)
-    (current_target, created) = Target.get_or_create(uid, prefix)
+    current_target = call_target(params, i)
     call_data = {
         'session_id': params['sessionId'],
         'campaign_id': campaign.id,
-        'target_id': current_target.id,
+        'target_id': current_target.id if current_target else None,
         'call_id': request.values.get('CallSid', None),
+        'dial_id': dial_id(request.values.get('CallSid', None), request.values.get('DialCallSid', None), i),
         'status': request.values.get('DialCallStatus', 'unknown'),
         'duration': request.values.get('DialCallDuration', 0)
     }
 
     try:
-        db.session.add(Call(**call_data))
-        db.session.commit()
+        log_call_event(call_event(**call_data))
     except SQLAlchemyError:
         current_app.logger.error('Failed to log call:', exc_info=True)
 
     resp = VoiceResponse()
 
-    if call_data['status'] == 'busy':
+    if call_data['status'] == 'busy' and current_target:
         play_or_say(resp, campaign.audio('msg_target_busy'),
             title=current_target.title,
             name=current_target.name,
@@ -706,7 +757,7 @@ def complete():
             calls_left=calls_left,
             lang=campaign.language_code)
 
-        resp.redirect(url_for('call.make_single', **params))
+        resp.redirect(call_url('call.make_single', params))
 
     return str(resp)
 
@@ -729,20 +780,15 @@ def status_callback():
 
     if request.values.get('CallStatus') == 'ringing':
         # update call_session with time interval calculated in Twilio queue
-        call_session = Session.query.get(request.values.get('sessionId'))
-        call_session.queue_delay = datetime.utcnow() - call_session.timestamp
-        db.session.add(call_session)
-        db.session.commit()
+        log_call_event(ringing_event(params['sessionId']))
 
     # CallDuration only present when call is complete
     # update call_session with status, duration
     if request.values.get('CallDuration'):
-        call_session = Session.query.get(request.values.get('sessionId'))
-        call_session.status = request.values.get('CallStatus', 'unknown')
-        call_session.duration = request.values.get('CallDuration', None)
-        call_session.close()
-        db.session.add(call_session)
-        db.session.commit()
+        log_call_event(session_event(params['sessionId'],
+                                     request.values.get('CallStatus', 'unknown'),
+                                     request.values.get('CallDuration', None)))
+        # the Dial action for the last call can arrive after this, so leave the state to expire
 
     return jsonify({
         'phoneNumber': request.values.get('To', ''),
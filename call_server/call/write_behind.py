@@ -0,0 +1,212 @@
+"""
+Write-behind logging of call outcomes from the Twilio webhooks.
+
+complete and status_callback append their events to a redis stream in one round trip,
+instead of committing inside the webhook. An rq job drains the stream in batches:
+Call rows are inserted together, skipping any dial_id already written, and Session
+updates are coalesced to one per session. Stream entries are only deleted after their
+batch commits, so every event is written at least once, and redelivery is harmless.
+A batch that fails to commit is retried one entry at a time, and entries that still fail
+are moved to a dead letter stream, so one bad event doesn't hold up the rest.
+
+Without CALL_LOG_WRITE_BEHIND, or if the stream can't be reached, events are written immediately.
+"""
+import json
+import time
+from datetime import datetime
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..extensions import db, rq
+
+from .models import Call, Session
+
+CALL_LOG_STREAM = 'call-power:call_log'
+CALL_LOG_DEAD_LETTER = 'call-power:call_log:dead'  # entries that couldn't be written
+CALL_LOG_FLUSH_KEY = 'call-power:call_log:flush'  # set while a flush job is queued
+CALL_LOG_FLUSH_TIMEOUT = 60*5  # queue another flush after this, even if one was lost
+CALL_LOG_LOCK_KEY = 'call-power:call_log:lock'
+CALL_LOG_LOCK_TIMEOUT = 60*10
+CALL_LOG_BATCH_SIZE = 500
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def dial_id(call_sid, dial_call_sid=None, call_index=None):
+    """
+    Idempotency key for a Call row.
+    The CallSid is shared by every target dialed in a session, so use the DialCallSid of
+    the outbound leg, or the CallSid and call index when Twilio doesn't send one.
+    """
+    if dial_call_sid:
+        return dial_call_sid
+    if call_sid:
+        return '%s:%s' % (call_sid, call_index or 0)
+    return None
+
+
+def call_event(session_id, campaign_id, target_id, call_id, dial_id, status, duration):
+    return {'type': 'call', 'time': time.time(),
+            'session_id': _to_int(session_id), 'campaign_id': campaign_id, 'target_id': target_id,
+            'call_id': call_id, 'dial_id': dial_id, 'status': status, 'duration': duration}
+
+
+def ringing_event(session_id):
+    return {'type': 'ringing', 'time': time.time(), 'session_id': _to_int(session_id)}
+
+
+def session_event(session_id, status, duration):
+    return {'type': 'session', 'time': time.time(),
+            'session_id': _to_int(session_id), 'status': status, 'duration': duration}
+
+
+def log_call_event(event, connection=None):
+    """
+    Append an event to the call log stream, queueing a flush job if none is pending.
+    Writes it immediately when write-behind is disabled or redis is unavailable.
+    """
+    if current_app.config.get('CALL_LOG_WRITE_BEHIND'):
+        connection = connection or rq.connection
+        try:
+            pipe = connection.pipeline(transaction=False)
+            pipe.xadd(CALL_LOG_STREAM, {'event': json.dumps(event)})
+            pipe.set(CALL_LOG_FLUSH_KEY, 1, nx=True, ex=CALL_LOG_FLUSH_TIMEOUT)
+            (entry_id, flush_needed) = pipe.execute()
+        except RedisError:
+            current_app.logger.error('Unable to append to call log, writing now', exc_info=True)
+        else:
+            if flush_needed:
+                flush_call_log.queue()
+            return entry_id
+
+    write_call_events([event])
+    return None
+
+
+def write_call_events(events):
+    """
+    Insert Calls and update Sessions for a batch of events, in one commit.
+    Returns the number of Call rows inserted.
+    """
+    calls = []
+    dial_ids = set()
+    sessions = {}
+    for event in events:
+        if event['type'] == 'call':
+            if event['dial_id']:
+                if event['dial_id'] in dial_ids:
+                    continue
+                dial_ids.add(event['dial_id'])
+            calls.append(event)
+        else:
+            sessions.setdefault(event['session_id'], []).append(event)
+
+    if dial_ids:
+        written = Call.query.with_entities(Call.dial_id).filter(Call.dial_id.in_(dial_ids))
+        dial_ids = dial_ids - set(row.dial_id for row in written)
+
+    new_calls = []
+    for event in calls:
+        if event['dial_id'] and event['dial_id'] not in dial_ids:
+            # already written by an earlier delivery
+            continue
+        call = Call(event['session_id'], event['campaign_id'], event['target_id'],
+                    call_id=event['call_id'], status=event['status'],
+                    duration=_to_int(event['duration']) or 0)
+        call.dial_id = event['dial_id']
+        call.timestamp = datetime.utcfromtimestamp(event['time'])
+        new_calls.append(call)
+    db.session.add_all(new_calls)
+
+    closed_sessions = []
+    if sessions:
+        for call_session in Session.query.filter(Session.id.in_(sessions.keys())):
+            for event in sessions[call_session.id]:
+                if event['type'] == 'ringing':
+                    # time interval calculated in Twilio queue
+                    if not call_session.queue_delay:
+                        call_session.queue_delay = datetime.utcfromtimestamp(event['time']) - call_session.timestamp
+                elif event['type'] == 'session':
+                    call_session.status = event['status']
+                    call_session.duration = _to_int(event['duration'])
+                    if call_session not in closed_sessions:
+                        closed_sessions.append(call_session)
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for call_session in closed_sessions:
+        try:
+            call_session.close()
+        except Exception:
+            # the events are committed, so a failed CRM sync shouldn't have them delivered again
+            current_app.logger.error('Unable to close call session %s' % call_session.id, exc_info=True)
+
+    return len(new_calls)
+
+
+def write_call_entries(entries, connection):
+    """
+    Write a batch of stream entries, one entry at a time if the batch fails.
+    Entries that fail on their own are moved to the dead letter stream.
+    Returns the number of Call rows inserted.
+    """
+    try:
+        return write_call_events([json.loads(fields[b'event']) for (entry_id, fields) in entries])
+    except (SQLAlchemyError, ValueError, KeyError, TypeError):
+        db.session.rollback()
+        current_app.logger.error('Unable to write call log batch, writing one entry at a time', exc_info=True)
+
+    written = 0
+    for (entry_id, fields) in entries:
+        try:
+            written += write_call_events([json.loads(fields[b'event'])])
+        except (SQLAlchemyError, ValueError, KeyError, TypeError) as e:
+            db.session.rollback()
+            current_app.logger.error('Unable to write call log entry %s, moving to %s' % (entry_id, CALL_LOG_DEAD_LETTER),
+                                     exc_info=True)
+            connection.xadd(CALL_LOG_DEAD_LETTER, {'event': fields.get(b'event', b''), 'error': str(e)[:500]})
+    return written
+
+
+@rq.job(timeout=CALL_LOG_LOCK_TIMEOUT)
+def flush_call_log(batch_size=CALL_LOG_BATCH_SIZE, connection=None):
+    """
+    Drain the call log stream into the database, one batch and commit at a time.
+    Only one flush runs at once, others return right away.
+    """
+    connection = connection or rq.connection
+    lock = connection.lock(CALL_LOG_LOCK_KEY, timeout=CALL_LOG_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # the running flush queues another if entries are left, so later events can queue their own
+        connection.delete(CALL_LOG_FLUSH_KEY)
+        return 0
+
+    written = 0
+    try:
+        # events appended from here on queue another flush
+        connection.delete(CALL_LOG_FLUSH_KEY)
+        while True:
+            entries = connection.xrange(CALL_LOG_STREAM, count=batch_size)
+            if not entries:
+                break
+            written += write_call_entries(entries, connection)
+            connection.xdel(CALL_LOG_STREAM, *[entry_id for (entry_id, fields) in entries])
+    finally:
+        lock.release()
+
+    # catch events appended after the last read, whose flush found the lock taken
+    if connection.xlen(CALL_LOG_STREAM):
+        connection.set(CALL_LOG_FLUSH_KEY, 1, ex=CALL_LOG_FLUSH_TIMEOUT)
+        flush_call_log.queue()
+    return written
@@ -1,12 +1,14 @@
+from collections import OrderedDict
 from datetime import datetime
 
 from flask import current_app, url_for
 from sqlalchemy_utils.types import phone_number, JSONType
 from flask_store.sqla import FlaskStoreType
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, event
+from sqlalchemy.orm import selectinload
 
 from ..extensions import db, cache
-from ..political_data import get_country_data, check_political_data_cache
+from ..political_data import get_country_data, check_political_data_cache, get_target_records
 from .constants import (STRING_LEN, LONG_STRING_LEN, TWILIO_SID_LENGTH, LANGUAGE_CHOICES,
                         CAMPAIGN_STATUS, STATUS_PAUSED,
                         SEGMENT_BY_CHOICES, LOCATION_CHOICES, INCLUDE_SPECIAL_CHOCIES, TARGET_OFFICE_CHOICES)
@@ -48,6 +50,9 @@ class Campaign(db.Model):
 
     embed = db.Column(JSONType)
 
+    # memoized by audio_map, not persisted
+    _audio_map = None
+
     @property
     def status(self):
         return CAMPAIGN_STATUS.get(self.status_code, '')
@@ -66,30 +71,40 @@ class Campaign(db.Model):
     def audio_or_default(self, key):
         """Convenience method for getting selected audio recordings for this campaign by key.
         Returns tuple (audio recording or default message, is default message) """
-        campaignAudio = self._audio_query().filter(
-            CampaignAudioRecording.recording.has(key=key)
-        ).first()
-
-        if campaignAudio:
-            return (campaignAudio.recording, False)
-        else:
-            # if not defined by user, return default
-            return (current_app.config.CAMPAIGN_MESSAGE_DEFAULTS.get(key), True)
+        return self.audio_map().get(key, (None, True))
+
+    def audio_map(self):
+        """Load all selected audio recordings for this campaign in one query, merged with message defaults.
+        Returns dict of key -> (audio recording or default message, is default message)
+        Memoized on the instance until it is expired by the session."""
+        if self._audio_map is None:
+            table = dict((key, (msg, True)) for (key, msg)
+                         in current_app.config.CAMPAIGN_MESSAGE_DEFAULTS.items())
+            selected = set()
+            for r in self._audio_query().options(db.joinedload(CampaignAudioRecording.recording)):
+                # first selected recording wins, if a key has more than one
+                if r.recording.key not in selected:
+                    table[r.recording.key] = (r.recording, False)
+                    selected.add(r.recording.key)
+            self._audio_map = table
+        return self._audio_map
 
     def audio_msgs(self):
         "Convenience method for getting all selected audio recordings for this campaign"
         table = {}
-        for r in self._audio_query().all():
-            if r.recording.text_to_speech:
-                table[r.recording.key] = r.recording.text_to_speech
+        for (key, (recording, is_default)) in self.audio_map().items():
+            if is_default:
+                continue
+            if recording.text_to_speech:
+                table[key] = recording.text_to_speech
             else:
-                table[r.recording.key] = r.recording.file_url()
+                table[key] = recording.file_url()
         return table
 
     def _audio_query(self):
         return CampaignAudioRecording.query.filter(
             CampaignAudioRecording.campaign_id == self.id,
-            CampaignAudioRecording.selected == True)
+            CampaignAudioRecording.selected == True).order_by(CampaignAudioRecording.id)
 
     def campaign_type_display(self):
         "Display method for this campaign's type"
@@ -194,6 +209,12 @@ class Campaign(db.Model):
         return country_data.get_campaign_type(self.campaign_type)
 
 
+@event.listens_for(Campaign, 'expire')
+def _clear_audio_map(campaign, attrs):
+    # reload selected audio after commit or refresh
+    campaign._audio_map = None
+
+
 class CampaignTarget(db.Model):
     __tablename__ = 'campaign_target_sets'
 
@@ -214,6 +235,17 @@ class CampaignPhoneNumber(db.Model):
     phone_id = db.Column(db.Integer, db.ForeignKey('campaign_phone.id'), unique=False)
 
 
+def _data_changed(current, new):
+    """Compare a column value to political data, where phone numbers are strings"""
+    if isinstance(current, phone_number.PhoneNumber) and new and not isinstance(new, phone_number.PhoneNumber):
+        try:
+            new = phone_number.PhoneNumber(new, current.region)
+        except phone_number.phonenumbers.NumberParseException:
+            return True
+        return (current.e164, current.extension) != (new.e164, new.extension)
+    return current != new
+
+
 class Target(db.Model):
     __tablename__ = 'campaign_target'
 
@@ -243,9 +275,60 @@ class Target(db.Model):
             key = uid
         t = Target.query.filter(Target.key == key) \
             .order_by(Target.id.desc()).first()
-        created = False
 
         data = check_political_data_cache(key, cache)
+        (t, created) = cls._update_from_data(t, key, data, update_offices)
+
+        if created and commit:
+            # save to db
+            db.session.commit()
+
+        return t, created
+
+    @classmethod
+    def get_or_create_many(cls, keys, update_offices=True, commit=True, cache=cache):
+        """
+        Target rows for many keys, loaded with one query for targets and one for their offices.
+        Missing or changed rows are flushed together, and committed once if commit is set.
+        Keys without a row or political data to create one from are left out.
+        Returns dict of key to Target
+        """
+        keys = [key for key in OrderedDict.fromkeys(keys) if key]
+        if not keys:
+            return {}
+
+        targets = {}
+        query = Target.query.filter(Target.key.in_(keys)) \
+            .options(selectinload(Target.offices)) \
+            .order_by(Target.id)
+        for t in query:
+            # latest row for each key, like get_or_create
+            targets[t.key] = t
+
+        records = get_target_records(keys, cache)
+        changed = False
+        for key in keys:
+            data = records.get(key) or check_political_data_cache(key, cache)
+            if key not in targets and not data.get('name'):
+                current_app.logger.error('Target.get_or_create_many has no data to create %s' % key)
+                continue
+            (targets[key], created) = cls._update_from_data(targets.get(key), key, data, update_offices)
+            changed = changed or created
+
+        if changed:
+            db.session.flush()
+            if commit:
+                db.session.commit()
+
+        return targets
+
+    @classmethod
+    def _update_from_data(cls, t, key, data, update_offices=True):
+        """
+        Create a target for key from political data, or update an existing one and its offices.
+        Returns tuple (target, changed)
+        """
+        created = False
         offices = data.pop('offices')
         if 'uid' in data:
             del data['uid']
@@ -262,21 +345,21 @@ class Target(db.Model):
                 check_attrs = ['location', 'number']
                 for a in check_attrs:
                     new_val = data.get(a)
-                    if new_val and getattr(t, a) != new_val:
+                    if new_val and _data_changed(getattr(t, a), new_val):
                         setattr(t, a, new_val)
                         created = True
         
         if offices and update_offices:
-            existing_target_office_uids = [o.uid for o in t.offices]
+            existing_target_offices = dict((o.uid, o) for o in reversed(t.offices))
             # need to check against existing offices, because the underlying data may have been updated
 
             for office in offices:
-                if office.get('uid') in existing_target_office_uids:
+                if office.get('uid') in existing_target_offices:
                     # existing office, check to update the location and type
-                    o = TargetOffice.query.filter_by(target_id=t.id, uid=office.get('uid')).first()
+                    o = existing_target_offices[office.get('uid')]
                     check_attrs = ['name', 'type', 'address', 'number']
                     for a in check_attrs:
-                        if getattr(o, a) != office.get(a):
+                        if _data_changed(getattr(o, a), office.get(a)):
                             setattr(o, a, office.get(a))
                             db.session.add(o)
                             created = True
@@ -287,10 +370,6 @@ class Target(db.Model):
                     db.session.add(o)
                     created = True
 
-        if created and commit:
-            # save to db
-            db.session.commit()
-
         return t, created
 
 
@@ -0,0 +1,252 @@
+"""
+Immutable, versioned snapshots of campaign settings for the Twilio call flow.
+
+Each TwiML webhook needs the same campaign settings, audio and targets.
+Rather than reloading them from the database on every hop, we build a snapshot
+once, keep it in the shared cache (redis in production) and in a small
+per-process LRU. The admin views bump the campaign version when they save,
+so stale snapshots are never read.
+
+Targets for a call session are materialized once in make_calls, and snapshotted
+by Target row id, so later hops read them without touching the Target table.
+"""
+from collections import namedtuple
+from uuid import uuid4
+
+from flask import current_app
+from sqlalchemy_utils.types import phone_number
+
+from ..extensions import cache
+from ..political_data import get_country_data
+from ..utils import LRUCache
+
+from .models import Campaign, Target
+
+SNAPSHOT_KEY = 'campaign:snapshot:{campaign_id}:{version}'
+SNAPSHOT_VERSION_KEY = 'campaign:version:{campaign_id}'
+SNAPSHOT_TIMEOUT = 60*60*24  # one day, rebuilt on demand after that
+SNAPSHOT_LRU_SIZE = 128
+CALL_TARGET_KEY = 'campaign:target:{target_id}'
+CALL_TARGET_TIMEOUT = 60*60*4  # same as call state
+
+_local_snapshots = LRUCache(maxsize=SNAPSHOT_LRU_SIZE)
+
+
+class AudioMessage(namedtuple('AudioMessage', ['key', 'text_to_speech', 'url'])):
+    """A selected campaign recording, reduced to what play_or_say needs"""
+    __slots__ = ()
+
+    def file_url(self):
+        return self.url
+
+    @classmethod
+    def from_recording(cls, recording):
+        url = None
+        if recording.file_storage and recording.file_storage.fp is not None:
+            url = recording.file_url()
+        return cls(recording.key, recording.text_to_speech or '', url)
+
+
+TargetSnapshot = namedtuple('TargetSnapshot', ['key', 'name', 'title', 'number', 'location'])
+
+
+
+class OfficeSnapshot(namedtuple('OfficeSnapshot', ['name', 'type', 'number', 'extension'])):
+    """A target office, reduced to what make_single needs to dial it"""
+    __slots__ = ()
+
+    @classmethod
+    def from_office(cls, office):
+        number = office.number
+        return cls(office.name, office.type,
+                   number.e164 if number else None, number.extension if number else None)
+
+
+class CallTarget(namedtuple('CallTarget', [
+        'id', 'key', 'title', 'name', 'district', 'location', 'number', 'extension', 'offices'])):
+    """A Target row and its offices, as read by make_single and complete"""
+    __slots__ = ()
+
+    @classmethod
+    def from_target(cls, target):
+        number = target.number
+        return cls(
+            id=target.id,
+            key=target.key,
+            title=target.title,
+            name=target.name,
+            district=target.district,
+            location=target.location,
+            number=number.e164 if number else None,
+            extension=number.extension if number else None,
+            offices=tuple(OfficeSnapshot.from_office(o) for o in target.offices))
+
+    def __str__(self):
+        return self.key or ''
+
+
+class CampaignSnapshot(namedtuple('CampaignSnapshot', [
+        'id', 'version', 'name', 'status',
+        'country_code', 'campaign_type', 'campaign_state', 'campaign_subtype',
+        'campaign_language', 'language_code',
+        'segment_by', 'locate_by', 'include_special',
+        'target_ordering', 'target_shuffle_chamber', 'target_offices',
+        'call_maximum', 'allow_call_in', 'allow_intl_calls', 'prompt_schedule',
+        'embed', 'target_set', 'phone_number_set', 'audio_recordings',
+        'display_targets'])):
+    """
+    Read-only stand-in for a Campaign, with the same accessors used by the call views
+    and political_data lookups. Should not be modified after it is built.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_campaign(cls, campaign, version):
+        audio_recordings = {}
+        for (key, (recording, is_default)) in campaign.audio_map().items():
+            if not is_default:
+                audio_recordings[key] = AudioMessage.from_recording(recording)
+
+        target_set = tuple(
+            TargetSnapshot(t.key, t.name, t.title, t.number.e164 if t.number else None, t.location)
+            for t in campaign.target_set)
+        phone_number_set = tuple(
+            (n.number.e164, n.number.country_code) for n in campaign.phone_number_set)
+
+        return cls(
+            id=campaign.id,
+            version=version,
+            name=campaign.name,
+            status=campaign.status,
+            country_code=campaign.country_code,
+            campaign_type=campaign.campaign_type,
+            campaign_state=campaign.campaign_state,
+            campaign_subtype=campaign.campaign_subtype,
+            campaign_language=campaign.campaign_language,
+            language_code=campaign.language_code,
+            segment_by=campaign.segment_by,
+            locate_by=campaign.locate_by,
+            include_special=campaign.include_special,
+            target_ordering=campaign.target_ordering,
+            target_shuffle_chamber=campaign.target_shuffle_chamber,
+            target_offices=campaign.target_offices,
+            call_maximum=campaign.call_maximum,
+            allow_call_in=campaign.allow_call_in,
+            allow_intl_calls=campaign.allow_intl_calls,
+            prompt_schedule=campaign.prompt_schedule,
+            embed=dict(campaign.embed or {}),
+            target_set=target_set,
+            phone_number_set=phone_number_set,
+            audio_recordings=audio_recordings,
+            display_targets=campaign.targets_display())
+
+    def __str__(self):
+        return self.name
+
+    def audio(self, key):
+        return self.audio_or_default(key)[0]
+
+    def has_audio(self, key='msg_intro'):
+        return not self.audio_or_default(key)[1]
+
+    def audio_or_default(self, key):
+        """Returns tuple (audio message or default message, is default message)"""
+        if key in self.audio_recordings:
+            return (self.audio_recordings[key], False)
+        else:
+            return (current_app.config.CAMPAIGN_MESSAGE_DEFAULTS.get(key), True)
+
+    def phone_numbers(self, region_code=None):
+        "Phone numbers for this campaign, can be limited to a specified region code (ISO-2)"
+        if region_code and not self.allow_intl_calls:
+            country_code = phone_number.phonenumbers.country_code_for_region(region_code.upper())
+            return [e164 for (e164, number_country) in self.phone_number_set if number_country == country_code]
+        else:
+            return [e164 for (e164, number_country) in self.phone_number_set]
+
+    def targets_display(self):
+        return self.display_targets
+
+    def get_country_data(self, cache=cache):
+        return get_country_data(self.country_code, cache=cache, api_cache='localmem')
+
+    def get_campaign_data(self, cache=cache):
+        country_data = self.get_country_data(cache)
+        return country_data.get_campaign_type(self.campaign_type)
+
+
+def get_campaign_version(campaign_id):
+    """
+    Returns the current version token for a campaign.
+    Initializes one if the shared cache doesn't have it, so a flushed cache can't resurrect old snapshots.
+    """
+    version_key = SNAPSHOT_VERSION_KEY.format(campaign_id=campaign_id)
+    version = cache.get(version_key)
+    if not version:
+        cache.add(version_key, uuid4().hex)
+        version = cache.get(version_key)
+    return version
+
+
+def get_campaign_snapshot(campaign_id):
+    """
+    Get a CampaignSnapshot by id, checking the process LRU, then the shared cache, then the database.
+    Returns None if the campaign does not exist.
+    """
+    campaign_id = int(campaign_id)
+    version = get_campaign_version(campaign_id)
+
+    snapshot = _local_snapshots.get(campaign_id)
+    if snapshot and snapshot.version == version:
+        return snapshot
+
+    snapshot_key = SNAPSHOT_KEY.format(campaign_id=campaign_id, version=version)
+    snapshot = cache.get(snapshot_key)
+    if not snapshot:
+        campaign = Campaign.query.get(campaign_id)
+        if not campaign:
+            return None
+        snapshot = CampaignSnapshot.from_campaign(campaign, version)
+        cache.set(snapshot_key, snapshot, timeout=SNAPSHOT_TIMEOUT)
+
+    _local_snapshots.set(campaign_id, snapshot)
+    return snapshot
+
+
+def invalidate_campaign_snapshot(campaign_id):
+    """Bump the campaign version, so the next webhook rebuilds its snapshot"""
+    campaign_id = int(campaign_id)
+    cache.set(SNAPSHOT_VERSION_KEY.format(campaign_id=campaign_id), uuid4().hex)
+    _local_snapshots.delete(campaign_id)
+
+
+def cache_call_targets(targets):
+    """
+    Snapshot Target rows for the call flow, in one shared cache write.
+    Returns dict of row id to CallTarget
+    """
+    snapshots = dict((t.id, CallTarget.from_target(t)) for t in targets)
+    if snapshots:
+        cache.set_many(dict((CALL_TARGET_KEY.format(target_id=target_id), snapshot)
+                            for (target_id, snapshot) in snapshots.items()),
+                       timeout=CALL_TARGET_TIMEOUT)
+    return snapshots
+
+
+def get_call_target(key, target_id=None):
+    """
+    Get a CallTarget by row id, checking the shared cache, then reading the database.
+    Sessions without a row id, like those started before make_calls stored them,
+    materialize the target by key instead.
+    Returns None if there is no target row.
+    """
+    if target_id:
+        snapshot = cache.get(CALL_TARGET_KEY.format(target_id=target_id))
+        if snapshot:
+            return snapshot
+        target = Target.query.get(target_id)
+    else:
+        target = Target.get_or_create_many([key]).get(key)
+    if not target:
+        return None
+    return cache_call_targets([target])[target.id]
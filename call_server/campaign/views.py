@@ -14,12 +14,15 @@ from twilio.jwt.client import ClientCapabilityToken
 
 from ..extensions import db
 from ..political_data import COUNTRY_CHOICES
+from ..political_data.data_cache import warm_political_data_cache
+from ..political_data.openstates import OpenStatesError
 from ..utils import choice_items, choice_keys, choice_values_flat, duplicate_object, parse_target, get_one_or_create
 
 from .constants import EMPTY_CHOICES, STATUS_LIVE
 from .models import (Campaign, Target, CampaignTarget,
                      AudioRecording, CampaignAudioRecording,
                      TwilioPhoneNumber)
+from .snapshot import invalidate_campaign_snapshot
 from ..call.models import Call
 from ..sync.models import SyncCampaign
 from ..sync.constants import SCHEDULE_CHOICES, SCHEDULE_HOURLY
@@ -40,6 +43,14 @@ def before_request():
     pass
 
 
+@campaign.after_request
+def after_request(response):
+    # saving any campaign form invalidates the snapshot used by the call views
+    if request.method == 'POST' and request.view_args and request.view_args.get('campaign_id'):
+        invalidate_campaign_snapshot(request.view_args['campaign_id'])
+    return response
+
+
 @campaign.route('/')
 def index():
     campaigns = Campaign.query.order_by(desc(Campaign.status_code), desc(Campaign.id)).all()
@@ -151,6 +162,12 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
                 setattr(campaign, field.name, field.data)
 
         # handle target_set nested data
+        # fetch any uncached state legislators together, instead of one request per target
+        try:
+            warm_political_data_cache([t['key'] for t in form.target_set.data if t.get('key')])
+        except OpenStatesError as e:
+            # save targets with the fields from the form, their offices are updated on a later save
+            current_app.logger.error('Unable to fetch state legislators for campaign %s: %s' % (campaign.id, e))
         target_list = []
         for target_data in form.target_set.data:
             # get key from the data fields
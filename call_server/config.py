@@ -49,12 +49,34 @@ class DefaultConfig(object):
     # limit string must match notation like "[count] [per|/] [n (optional)] [second|minute|hour|day|month|year]""
     # from https://flask-limiter.readthedocs.io/en/stable/#rate-limit-string-notation
 
+    # log calls from the twilio webhooks to a redis stream, written to the database by the rq worker
+    CALL_LOG_WRITE_BEHIND = os.environ.get('CALL_LOG_WRITE_BEHIND', '').lower() in ('true', '1')
+
+    # seconds between writes of blocklist hit counts to the database, by the rq scheduler
+    BLOCKLIST_HITS_FLUSH_INTERVAL = int(os.environ.get('BLOCKLIST_HITS_FLUSH_INTERVAL', 60))
+
+    # count call requests in redis by caller ip, phone prefix, campaign and referral code
+    # and block callers that pass a threshold within the sliding window, 0 to not count
+    ABUSE_COUNTERS = os.environ.get('ABUSE_COUNTERS', '').lower() in ('true', '1')
+    ABUSE_WINDOW = int(os.environ.get('ABUSE_WINDOW', 60*10))  # seconds
+    ABUSE_THRESHOLDS = {
+        'ip': int(os.environ.get('ABUSE_IP_THRESHOLD', 20)),
+        'phone_prefix': int(os.environ.get('ABUSE_PHONE_PREFIX_THRESHOLD', 20)),
+        # shared by every caller, so these only log a warning
+        'campaign': int(os.environ.get('ABUSE_CAMPAIGN_THRESHOLD', 0)),
+        'referral': int(os.environ.get('ABUSE_REFERRAL_THRESHOLD', 0)),
+    }
+    ABUSE_BLOCK_DURATION = int(os.environ.get('ABUSE_BLOCK_DURATION', 60*60*24))  # seconds
+
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
     GEOCODE_API_KEY = os.environ.get('GEOCODE_API_KEY')
     OPENSTATES_API_KEY = os.environ.get('OPENSTATES_API_KEY')
     if not OPENSTATES_API_KEY:
         OPENSTATES_API_KEY = os.environ.get('OPENSTATES_API_KEY')
+    # parsed by the US data provider, which falls back to the default on an invalid value
+    OPENSTATES_GEOHASH_PRECISION = os.environ.get('OPENSTATES_GEOHASH_PRECISION', 6)
+    OPENSTATES_GEOHASH_VERIFY = os.environ.get('OPENSTATES_GEOHASH_VERIFY', '')
 
     LOG_PHONE_NUMBERS = True
 
@@ -201,4 +223,7 @@ class TestingConfig(DefaultConfig):
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite://'  # keep testing db in memory
     CACHE_TYPE = 'simple'
+    CALL_LOG_WRITE_BEHIND = False
+    BLOCKLIST_HITS_FLUSH_INTERVAL = 0  # write hits immediately, without a scheduler
+    ABUSE_COUNTERS = False
     CACHE_NO_NULL_WARNING = True
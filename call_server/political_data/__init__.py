@@ -1,4 +1,12 @@
 import importlib
+import collections
+import os
+import threading
+from uuid import uuid4
+
+from flask import current_app, has_app_context
+
+from ..utils import LRUCache
 
 COUNTRY_CHOICES = [
     ('us', "United States"),
@@ -24,21 +32,72 @@ COUNTRY_DATA = {
     'uk': 'call_server.political_data.countries.eu.UKDataProvider',
 }
 
+DATA_VERSION_KEY = 'political_data:version'
+
+# settings read by providers and their clients when they are built, see provider_setting
+PROVIDER_CONFIG = [
+    'GEOCODE_PROVIDER',
+    'GEOCODE_API_KEY',
+    'OPENSTATES_API_KEY',
+    'OPENSTATES_GEOHASH_PRECISION',
+    'OPENSTATES_GEOHASH_VERIFY',
+]
+PROVIDER_REGISTRY_SIZE = 32
+
+_providers = LRUCache(maxsize=PROVIDER_REGISTRY_SIZE)
+_providers_lock = threading.Lock()
+
 class NoDataProviderError(Exception):
     def __init__(self, country_code):
         self.message = "No data provider available for country code '{}'".format(country_code)
 
 
-def load_data(cache):
-    n = 0
+def load_data(cache, force=False):
+    """
+    Loads data for all countries, writing only keys that changed since the last load unless forced
+    @return  collections.Counter of keys loaded, added, changed and removed
+    """
+    counts = collections.Counter()
     for country_code in COUNTRY_DATA.keys():
         country_data = get_country_data(country_code, cache=cache)
-        n += country_data.load_data()
-    return n
+        counts.update(country_data.load_data(force=force))
+    # bump the data version, so memoized target lookups are recomputed
+    if force or counts['added'] or counts['changed'] or counts['removed']:
+        cache.set(DATA_VERSION_KEY, uuid4().hex)
+    return counts
+
+def get_data_version(cache):
+    return cache.get(DATA_VERSION_KEY)
+
+def provider_setting(name, default=None):
+    """ A provider setting from app config, or from the environment outside an app context """
+    if has_app_context() and name in current_app.config:
+        return current_app.config[name]
+    return os.environ.get(name, default)
+
+def get_country_data(country_code, cache=None, **kwargs):
+    """
+    Returns the process-wide data provider for a country, bound to a cache backend
+    Each provider and its geocoder and API clients are built once,
+    and rebuilt on next use if their configuration changes
+    """
+    config = tuple(provider_setting(name) for name in PROVIDER_CONFIG)
+    key = (country_code.lower(), id(cache), tuple(sorted(kwargs.items())), config)
+
+    entry = _providers.get(key)
+    # the registry holds the cache, so a matching id is the same cache object
+    if entry is None or entry[0] is not cache:
+        with _providers_lock:
+            entry = _providers.get(key)
+            if entry is None or entry[0] is not cache:
+                data_provider_class = _get_data_provider_class(country_code)
+                entry = (cache, data_provider_class(cache=cache, **kwargs))
+                _providers.set(key, entry)
+    return entry[1]
 
-def get_country_data(country_code, **kwargs):
-    data_provider_class = _get_data_provider_class(country_code)
-    return data_provider_class(**kwargs)
+def reset_country_data():
+    """ Drops all registered providers, so they are rebuilt on next use """
+    _providers.clear()
 
 def _get_data_provider_class(country_code):
     country_code = country_code.lower()
@@ -62,4 +121,4 @@ def _get_data_provider_class(country_code):
 
 # import this at the end, because it depends on get_country_data above
 from .views import political_data
-from .data_cache import check_political_data_cache
+from .data_cache import check_political_data_cache, get_target_records
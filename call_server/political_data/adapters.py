@@ -2,6 +2,48 @@
 
 from collections import defaultdict
 
+# adapted target records are stored next to the raw data they come from
+# bump the version when adapter output changes, so load_data rewrites them
+TARGET_RECORD_VERSION = 1
+TARGET_RECORD_KEY = 'political_data:target:v{version}:{key}'
+TARGET_KEY_PREFIXES = ('us:bioguide', 'us_state:openstates', 'us_state:governor', 'ca:opennorth')
+
+
+def target_record_key(key):
+    return TARGET_RECORD_KEY.format(version=TARGET_RECORD_VERSION, key=key)
+
+
+def adapt_target(key, cached_obj):
+    """
+    Adapts a raw cached record to target fields, with its key and list of offices
+    @return  dict, or None for records that don't adapt
+    """
+    adapter = adapt_by_key(key)
+    adapted_key, adapter_suffix = adapter.key(key)
+    if type(cached_obj) is list:
+        if not cached_obj:
+            return None
+        cached_obj = cached_obj[0]
+    if type(cached_obj) is not dict:
+        return None
+
+    data = adapter.target(cached_obj)
+    data['key'] = adapted_key
+    data['offices'] = adapter.offices(cached_obj)
+    return data
+
+
+def with_target_records(mapping):
+    """ Adds adapted target records for any target keys in a mapping of raw records, to write in the same batch """
+    records = dict(mapping)
+    for (key, value) in mapping.items():
+        if key.startswith(TARGET_KEY_PREFIXES):
+            adapted = adapt_target(key, value)
+            if adapted:
+                records[target_record_key(key)] = adapted
+    return records
+
+
 def adapt_by_key(key):
     if key.startswith("us:bioguide"):
         return UnitedStatesData()
@@ -111,6 +153,10 @@ class UnitedStatesData(DataAdapter):
 
 
 class OpenStatesData(DataAdapter):
+    def key(self, key, split_by=None):
+        # override default key split behavior, because OCD person ids have dashes
+        return (key, '')
+
     def target(self, data):
         if data.get('leg_id'):
             return self.target_legacy(data)
@@ -0,0 +1,234 @@
+"""
+Local spatial index of state legislative district boundaries
+
+Boundary files (GeoJSON, or shapefiles with pyshp installed) are loaded with
+`flask loadpoliticaldata --state-boundaries PATH`, and compiled into a snapshot of
+district polygons with an STR-packed tree of their bounding boxes.
+A point is located by walking the tree to candidate districts, then testing each polygon exactly.
+
+Districts are identified by OCD division id, from an `ocdid` property,
+or from census TIGER fields (STATEFP and SLDUST or SLDLST).
+"""
+import json
+import math
+import os
+import threading
+from array import array
+import logging
+
+from .constants import US_STATE_FIPS
+from .snapshot import read_snapshot, write_snapshot, sources_digest
+from ..utils import ocd_field
+
+log = logging.getLogger(__name__)
+
+BOUNDARIES_INDEX = 'call_server/political_data/data/us_state_districts.snapshot'
+# snapshots are built from arbitrary files, so the digest only identifies the index format
+BOUNDARIES_DIGEST = sources_digest([], salt='state district boundaries 1')
+STR_NODE_CAPACITY = 16
+
+OCD_DIVISION = 'ocd-division/country:us/state:{state}/{type}:{district}'
+TIGER_DISTRICT_FIELDS = [('SLDUST', 'sldu'), ('SLDLST', 'sldl')]
+TIGER_UNDEFINED_DISTRICT = 'ZZZ'
+
+
+def division_from_properties(properties):
+    """ Returns the OCD division id for a boundary feature, or None """
+    for field in ['ocdid', 'ocd_id', 'division_id', 'id']:
+        value = properties.get(field)
+        if value and str(value).startswith('ocd-division/'):
+            return value
+
+    state = US_STATE_FIPS.get(properties.get('STATEFP'))
+    if not state:
+        return None
+    for (field, division_type) in TIGER_DISTRICT_FIELDS:
+        district = properties.get(field)
+        if district and district != TIGER_UNDEFINED_DISTRICT:
+            district = district.lstrip('0') or '0' if district.isdigit() else district.lower()
+            return OCD_DIVISION.format(state=state.lower(), type=division_type, district=district)
+    return None
+
+
+def division_chamber(division):
+    """ Legislature chamber for a district division, matching OpenStates membership classification """
+    if ocd_field(division, 'sldl'):
+        return 'lower'
+    if ocd_field(division, 'state') == 'ne':
+        # unicameral, so there's only "legislature"
+        return 'legislature'
+    return 'upper'
+
+
+def geometry_polygons(geometry):
+    """ Converts GeoJSON Polygon or MultiPolygon coordinates to a list of polygons, each a list of flat rings """
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [[array('d', [c for point in ring for c in point[:2]]) for ring in polygon]
+            for polygon in polygons]
+
+
+def read_boundary_file(path):
+    """ Yields (division, geometry) for each district in a GeoJSON file or shapefile """
+    if path.lower().endswith('.shp'):
+        try:
+            import shapefile
+        except ImportError:
+            raise ValueError('install pyshp to load shapefiles, or convert %s to GeoJSON' % path)
+        reader = shapefile.Reader(path)
+        records = ((sr.record.as_dict(), sr.shape.__geo_interface__) for sr in reader.iterShapeRecords())
+    else:
+        with open(path) as f:
+            collection = json.load(f)
+        records = ((feature.get('properties') or {}, feature.get('geometry'))
+                   for feature in collection.get('features', []))
+
+    for (properties, geometry) in records:
+        division = division_from_properties(properties)
+        if division and geometry:
+            yield (division, geometry)
+
+
+def _ring_contains(x, y, ring):
+    # even-odd ray casting over flat [x0, y0, x1, y1, ...] coordinates
+    inside = False
+    n = len(ring) // 2
+    j = n - 1
+    for i in range(n):
+        xi, yi = ring[2*i], ring[2*i+1]
+        xj, yj = ring[2*j], ring[2*j+1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def polygon_contains(x, y, rings):
+    """ Point in polygon test, where rings after the first are holes """
+    inside = False
+    for ring in rings:
+        if _ring_contains(x, y, ring):
+            inside = not inside
+    return inside
+
+
+def _str_pack(entries, capacity):
+    """
+    Sort-Tile-Recursive packing of one tree level
+    entries are (xmin, ymin, xmax, ymax, child), returns parent nodes of the same shape with lists of children
+    """
+    n_nodes = int(math.ceil(len(entries) / float(capacity)))
+    slice_size = int(math.ceil(math.sqrt(n_nodes))) * capacity
+    by_x = sorted(entries, key=lambda e: e[0] + e[2])
+    nodes = []
+    for i in range(0, len(by_x), slice_size):
+        vertical = sorted(by_x[i:i+slice_size], key=lambda e: e[1] + e[3])
+        for j in range(0, len(vertical), capacity):
+            children = vertical[j:j+capacity]
+            nodes.append((min(c[0] for c in children), min(c[1] for c in children),
+                          max(c[2] for c in children), max(c[3] for c in children), children))
+    return nodes
+
+
+class DistrictIndex(object):
+
+    def __init__(self, divisions, polygons, root):
+        self.divisions = divisions
+        self.polygons = polygons
+        self.root = root
+
+    def __len__(self):
+        return len(self.divisions)
+
+    @classmethod
+    def build(cls, districts, capacity=STR_NODE_CAPACITY):
+        """ Builds an index from (division, geometry) pairs """
+        divisions = []
+        polygons = []
+        entries = []
+        for (division, geometry) in districts:
+            shapes = geometry_polygons(geometry)
+            if not shapes:
+                continue
+            xs = [c for shape in shapes for c in shape[0][0::2]]
+            ys = [c for shape in shapes for c in shape[0][1::2]]
+            entries.append((min(xs), min(ys), max(xs), max(ys), len(divisions)))
+            divisions.append(division)
+            polygons.append(shapes)
+
+        level = entries
+        while len(level) > capacity:
+            level = _str_pack(level, capacity)
+        root = (-180.0, -90.0, 180.0, 90.0, level)
+        return cls(divisions, polygons, root)
+
+    def locate(self, latitude, longitude):
+        """ Returns the divisions of all districts containing a point """
+        (x, y) = (longitude, latitude)
+        found = []
+        stack = [self.root]
+        while stack:
+            (xmin, ymin, xmax, ymax, children) = stack.pop()
+            if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                continue
+            for child in children:
+                if isinstance(child[4], int):
+                    if (child[0] <= x <= child[2] and child[1] <= y <= child[3] and
+                            any(polygon_contains(x, y, rings) for rings in self.polygons[child[4]])):
+                        found.append(self.divisions[child[4]])
+                else:
+                    stack.append(child)
+        return sorted(found)
+
+    def save(self, path):
+        return write_snapshot(path, (self.divisions, self.polygons, self.root), BOUNDARIES_DIGEST)
+
+    @classmethod
+    def open(cls, path):
+        data = read_snapshot(path, BOUNDARIES_DIGEST)
+        if data is None:
+            return None
+        return cls(*data)
+
+
+def load_state_boundaries(paths, path=BOUNDARIES_INDEX):
+    """ Compiles boundary files into the local district index, replacing any existing one """
+    index = DistrictIndex.build(district for p in paths for district in read_boundary_file(p))
+    index.save(path)
+    reset_district_index()
+    log.info('indexed %d state legislative districts' % len(index))
+    return len(index)
+
+
+_index = None
+_index_checked = False
+_index_lock = threading.Lock()
+
+
+def get_district_index(path=BOUNDARIES_INDEX):
+    """
+    Returns the process-wide DistrictIndex, opening it on first use
+    Returns None if no boundaries have been loaded
+    """
+    global _index, _index_checked
+    if _index_checked:
+        return _index
+
+    with _index_lock:
+        if not _index_checked:
+            if os.path.exists(path):
+                _index = DistrictIndex.open(path)
+            _index_checked = True
+    return _index
+
+
+def reset_district_index():
+    """ Drops the process-wide index, so it is reopened on next use """
+    global _index, _index_checked
+    with _index_lock:
+        _index = None
+        _index_checked = False
@@ -1,20 +1,54 @@
 from flask import current_app
 from flask_babel import gettext as _
-import flask_caching
+from flask_caching.backends import RedisCache, SimpleCache
 import pickle
+import bisect
+import hashlib
+import collections
+from datetime import datetime, timedelta
+
+from ...utils import ignore_accents
+
+
+def search_term(value):
+    """ Normalize a value for search, ignoring case and accented characters """
+    return ignore_accents(str(value)).lower()
+
+
+def content_hash(value):
+    """ Short digest of a cached value, to compare with the previous load """
+    return hashlib.sha1(pickle.dumps(value, protocol=4)).digest()[:8]
+
+
+# keys written, rewritten and deleted by DataProvider.cache_sync
+CacheSync = collections.namedtuple('CacheSync', ['added', 'changed', 'removed'])
+
 
 class DataProvider(object):
     country_name = None
     campaign_types = []
 
     SORTED_SETS = []
+    CACHE_BATCH_SIZE = 1000
+
+    # secondary index for search, stored as a redis sorted set or a sorted list in other caches
+    # entries are "field:value|key", so a field prefix search is one range lookup
+    SEARCH_INDEX = None
+    SEARCH_FIELDS = []
+    SEARCH_NAME_FIELDS = []
+
+    # content hashes of keys from the previous load, so reloads only write what changed
+    # rewrite everything once the manifest is old, before unchanged keys hit the cache timeout
+    MANIFEST_KEY = None
+    MANIFEST_MAX_AGE = timedelta(days=180)
 
     def __init__(self, **kwargs):
         pass
 
-    def load_data(self):
+    def load_data(self, force=False):
         """
         Loads all country-specific data and caches the result
+        @return  collections.Counter of keys loaded, added, changed and removed
         """
         raise NotImplementedError()
 
@@ -39,10 +73,29 @@ class DataProvider(object):
         """
         return self._cache.get(key) or default
 
-    def cache_set(self, key, value):
-        """ Add a new key/value to the cache """
+    def cache_get_many(self, keys, default=None):
+        """
+        Fetches multiple keys, returning values in key order
+        Missing keys are returned as default, or a new empty list
+        On redis, uses one MGET per CACHE_BATCH_SIZE keys
+        Handles difference between flask-cache and mock-dictionary
+        """
+        keys = list(keys)
+        values = []
+        for i in range(0, len(keys), self.CACHE_BATCH_SIZE):
+            batch = keys[i:i+self.CACHE_BATCH_SIZE]
+            if hasattr(self._cache, 'get_many'):
+                values.extend(self._cache.get_many(*batch))
+            elif hasattr(self._cache, 'get'):
+                values.extend(self._cache.get(key) for key in batch)
+            else:
+                raise AttributeError('cache does not appear to be dict-like')
+        return [value or (list() if default is None else default) for value in values]
+
+    def cache_set(self, key, value, timeout=None):
+        """ Add a new key/value to the cache, with the cache default timeout unless given """
         if hasattr(self._cache, 'set'):
-            self._cache.set(key, value)
+            self._cache.set(key, value, timeout=timeout)
         elif hasattr(self._cache, 'update'):
             self._cache.update({key:value})
         else:
@@ -51,6 +104,7 @@ class DataProvider(object):
     def cache_set_many(self, mapping):
         """
         Sets multiple keys and values from a mapping.
+        On redis, flask-cache writes these in one pipeline
         Handles difference between flask-cache and mock-dictionary
         """
         if hasattr(self._cache, 'set_many'):
@@ -60,48 +114,293 @@ class DataProvider(object):
         else:
             raise AttributeError('cache does not appear to be dict-like')
 
+    def cache_delete_many(self, keys):
+        """
+        Deletes multiple keys, in batches of CACHE_BATCH_SIZE
+        Handles difference between flask-cache and mock-dictionary
+        """
+        keys = list(keys)
+        for i in range(0, len(keys), self.CACHE_BATCH_SIZE):
+            batch = keys[i:i+self.CACHE_BATCH_SIZE]
+            if hasattr(self._cache, 'delete_many'):
+                self._cache.delete_many(*batch)
+            elif hasattr(self._cache, 'pop'):
+                for key in batch:
+                    self._cache.pop(key, None)
+            else:
+                raise AttributeError('cache does not appear to be dict-like')
+
+    def cache_missing_keys(self, keys):
+        """
+        Returns the keys not present in the cache, in key order
+        On redis, checks existence with pipelined EXISTS, without fetching values
+        Handles difference between flask-cache and mock-dictionary
+        """
+        keys = list(keys)
+        redis = self._redis_client()
+        if redis is not None:
+            prefix = self._cache.cache.key_prefix or ''
+            missing = []
+            for i in range(0, len(keys), self.CACHE_BATCH_SIZE):
+                batch = keys[i:i+self.CACHE_BATCH_SIZE]
+                pipe = redis.pipeline(transaction=False)
+                for key in batch:
+                    pipe.exists(prefix + key)
+                missing.extend(key for (key, exists) in zip(batch, pipe.execute()) if not exists)
+            return missing
+        elif hasattr(getattr(self._cache, 'cache', None), 'has'):
+            return [key for key in keys if not self._cache.cache.has(key)]
+        elif isinstance(self._cache, dict):
+            return [key for key in keys if key not in self._cache]
+        else:
+            raise AttributeError('cache does not appear to be dict-like')
+
+    def cache_sync(self, mapping, force=False):
+        """
+        Writes a full mapping of keys and values to the cache, as a diff against the previous load
+        Compares a content hash of each value with the manifest stored at MANIFEST_KEY,
+        sets only added and changed keys and deletes removed ones, in batches of CACHE_BATCH_SIZE
+        Unchanged keys missing from the cache, evicted or deleted since the last load, are added again
+        With force, or without a recent manifest, every key is written
+        @return  CacheSync of key lists
+        """
+        hashes = dict((key, content_hash(value)) for (key, value) in mapping.items())
+
+        manifest = None if force else self._cache.get(self.MANIFEST_KEY)
+        if manifest and datetime.now() - manifest['loaded'] < self.MANIFEST_MAX_AGE:
+            previous = manifest['keys']
+            loaded = manifest['loaded']
+        else:
+            previous = {}
+            loaded = datetime.now()
+
+        added = [key for key in hashes if key not in previous]
+        changed = [key for key in hashes if key in previous and previous[key] != hashes[key]]
+        if previous:
+            added.extend(self.cache_missing_keys(key for key in hashes if previous.get(key) == hashes[key]))
+        removed = [key for key in previous if key not in hashes]
+
+        writes = added + changed
+        for i in range(0, len(writes), self.CACHE_BATCH_SIZE):
+            self.cache_set_many(dict((key, mapping[key]) for key in writes[i:i+self.CACHE_BATCH_SIZE]))
+        self.cache_delete_many(removed)
+
+        # write the manifest last, so an interrupted load is diffed against the one before
+        self.cache_set(self.MANIFEST_KEY, {'loaded': loaded, 'keys': hashes})
+        return CacheSync(added, changed, removed)
+
+    def cache_index_many(self, keys):
+        """
+        Adds keys to the lexicographical SORTED_SETS they start with, in one pipeline
+        Only redis has sorted sets, other caches are searched by key directly
+        """
+        redis = self._redis_client(write=True)
+        if redis is None:
+            return 0
+
+        pipe = redis.pipeline(transaction=False)
+        n = 0
+        for key in keys:
+            for sorted_key in self.SORTED_SETS:
+                if key.startswith(sorted_key):
+                    pipe.zadd(sorted_key, {key: 0})
+                    n += 1
+        pipe.execute()
+        return n
+
+    def cache_unindex_many(self, keys):
+        """ Removes keys from the SORTED_SETS they start with, in one pipeline """
+        redis = self._redis_client(write=True)
+        if redis is None:
+            return 0
+
+        pipe = redis.pipeline(transaction=False)
+        n = 0
+        for key in keys:
+            for sorted_key in self.SORTED_SETS:
+                if key.startswith(sorted_key):
+                    pipe.zrem(sorted_key, key)
+                    n += 1
+        pipe.execute()
+        return n
+
+    def _redis_client(self, write=False):
+        """ Returns the redis client behind a flask-cache RedisCache, or None """
+        backend = getattr(self._cache, 'cache', None)
+        if isinstance(backend, RedisCache):
+            return backend._write_client if write else backend._read_clients
+        return None
+
     def cache_search(self, key_starts_with):
         """
         Searches for keys starting with a name
         Handles difference between flask-cache and mock-dictionary
         """
+        return self.cache_search_many([key_starts_with])
+
+    def cache_search_many(self, keys_start_with):
+        """
+        Searches for keys starting with any of the names
+        On redis, sorted set lookups for all names are pipelined and values fetched with MGET,
+        so a search is a few round trips regardless of the number of matches
+        Handles difference between flask-cache and mock-dictionary
+        """
         result = []
-        if isinstance(self._cache.cache, flask_caching.backends.rediscache.RedisCache):
-            redis = self._cache.cache._read_clients
-
-            # check sorted sets first
-            for s in self.SORTED_SETS:
-                if key_starts_with.startswith(s):
-                    # weird redis syntax for min/max
-                    min_val = u'[' + key_starts_with
-                    max_val = u'(' + key_starts_with + u'\xff'
-                    matching_keys = redis.zrangebylex(s, min_val, max_val)
-                    for key in matching_keys:
-                        key = key.decode('ascii')
-                        result.extend(self.cache_get(key))
+        redis = self._redis_client()
+        if redis is not None:
+            # check sorted sets first, in one pipeline
+            pipe = redis.pipeline(transaction=False)
+            queries = []
+            for key_starts_with in keys_start_with:
+                for s in self.SORTED_SETS:
+                    if key_starts_with.startswith(s):
+                        # weird redis syntax for min/max
+                        min_val = u'[' + key_starts_with
+                        max_val = u'(' + key_starts_with + u'\xff'
+                        pipe.zrangebylex(s, min_val, max_val)
+                        queries.append(key_starts_with)
+            matching_keys = collections.OrderedDict((k, []) for k in keys_start_with)
+            for (key_starts_with, keys) in zip(queries, pipe.execute() if queries else []):
+                matching_keys[key_starts_with].extend(k.decode('ascii') for k in keys)
 
             # fall back on key scan
             # can be fairly slow (3-4s for full scan)
-            if not result:
-                key_scan = current_app.config['CACHE_KEY_PREFIX'] + key_starts_with + '*'
-                for prefixed_key in redis.scan_iter(match=key_scan):
-                    prefixed_key = prefixed_key.decode('ascii')
-                    key = prefixed_key.replace(current_app.config['CACHE_KEY_PREFIX'], '')
-                    result.extend(self.cache_get(key))
-        elif isinstance(self._cache.cache, flask_caching.backends.simple.SimpleCache) \
-            or isinstance(self._cache.cache, dict):
-            # naively search across all the keys
-            for (k,v) in self._cache.cache.items():
-                if k.startswith(key_starts_with):
+            prefix = current_app.config['CACHE_KEY_PREFIX']
+            for (key_starts_with, keys) in matching_keys.items():
+                if not keys:
+                    key_scan = prefix + key_starts_with + '*'
+                    for prefixed_key in redis.scan_iter(match=key_scan):
+                        keys.append(prefixed_key.decode('ascii')[len(prefix):])
+
+            all_keys = [k for keys in matching_keys.values() for k in keys]
+            for value in self.cache_get_many(all_keys):
+                if isinstance(value, list):
+                    result.extend(value)
+                else:
+                    result.append(value)
+        elif isinstance(getattr(self._cache, 'cache', None), SimpleCache):
+            # naively search across all the keys, values are pickled in the SimpleCache
+            for (k,v) in self._cache.cache._cache.items():
+                if k.startswith(tuple(keys_start_with)):
                     wet_value = pickle.loads(v[1])
                     if isinstance(wet_value, list):
                         result.extend(wet_value)
                     else:
                         result.append(wet_value)
+        elif isinstance(self._cache, dict):
+            # mock-dictionary, values are stored directly
+            for (k,v) in self._cache.items():
+                if k.startswith(tuple(keys_start_with)):
+                    if isinstance(v, list):
+                        result.extend(v)
+                    else:
+                        result.append(v)
         else:
             raise AttributeError('cannot search cache. it should be a redis connection or a dict')
         return result
 
+    def cache_index_search(self, records):
+        """
+        Builds the secondary search index from a mapping of cache key to list of records
+        Indexes SEARCH_FIELDS by value, and SEARCH_NAME_FIELDS by each word as field "name"
+        Replaces any existing index atomically
+        """
+        if not self.SEARCH_INDEX:
+            return 0
+
+        entries = set()
+        for (key, values) in records.items():
+            for record in values:
+                for field in self.SEARCH_FIELDS:
+                    if record.get(field):
+                        entries.add(u'{}:{}|{}'.format(field, search_term(record[field]), key))
+                for field in self.SEARCH_NAME_FIELDS:
+                    for token in search_term(record.get(field) or '').split():
+                        entries.add(u'name:{}|{}'.format(token, key))
+        entries = sorted(entries)
+
+        redis = self._redis_client(write=True)
+        if redis is not None:
+            pipe = redis.pipeline(transaction=True)
+            pipe.delete(self.SEARCH_INDEX)
+            for i in range(0, len(entries), self.CACHE_BATCH_SIZE):
+                pipe.zadd(self.SEARCH_INDEX, dict((e, 0) for e in entries[i:i+self.CACHE_BATCH_SIZE]))
+            pipe.execute()
+        else:
+            self.cache_set(self.SEARCH_INDEX, entries)
+        return len(entries)
+
+    def _search_index_keys(self, filters):
+        """
+        Finds cache keys matching all of the (field, normalized value prefix) filters,
+        by intersecting range lookups on the search index
+        Returns None if the search index hasn't been built
+        """
+        terms = [u'{}:{}'.format(field, value) for (field, value) in filters]
+        redis = self._redis_client()
+        if redis is not None:
+            pipe = redis.pipeline(transaction=False)
+            pipe.exists(self.SEARCH_INDEX)
+            for term in terms:
+                pipe.zrangebylex(self.SEARCH_INDEX, u'[' + term, u'(' + term + u'\xff')
+            (exists, *members_list) = pipe.execute()
+            if not exists:
+                return None
+            matches = [[m.decode('utf-8') for m in members] for members in members_list]
+        else:
+            entries = self.cache_get(self.SEARCH_INDEX, None)
+            if not entries:
+                return None
+            matches = []
+            for term in terms:
+                start = bisect.bisect_left(entries, term)
+                end = bisect.bisect_left(entries, term + u'\xff')
+                matches.append(entries[start:end])
+
+        keys = None
+        for members in matches:
+            found = set(m.split('|', 1)[1] for m in members)
+            keys = found if keys is None else keys & found
+        return keys or set()
+
+    def search(self, keys_start_with, filters=None):
+        """
+        Searches for records with keys starting with any of the names,
+        where every (field, value) filter matches the start of that field, ignoring case and accents.
+        Uses the secondary search index to narrow down keys when filtering on indexed fields,
+        or scans the cache if the index hasn't been built yet.
+        """
+        filters = [(field, search_term(value)) for (field, value) in (filters or [])]
+        indexed_filters = [(f, v) for (f, v) in filters
+                           if f in self.SEARCH_FIELDS or (f == 'name' and self.SEARCH_NAME_FIELDS)]
+
+        keys = None
+        if self.SEARCH_INDEX and indexed_filters:
+            keys = self._search_index_keys(indexed_filters)
+        if keys is not None:
+            # keep keys in order of the names searched for
+            ordered_keys = []
+            for key_starts_with in keys_start_with:
+                ordered_keys.extend(sorted(k for k in keys if k.startswith(key_starts_with)))
+            results = []
+            for value in self.cache_get_many(collections.OrderedDict.fromkeys(ordered_keys)):
+                if isinstance(value, list):
+                    results.extend(value)
+                else:
+                    results.append(value)
+        else:
+            results = self.cache_search_many(keys_start_with)
+
+        # check each record, because a key may hold more than one
+        for (field, value) in filters:
+            if field == 'name':
+                results = [r for r in results if any(token.startswith(value)
+                           for f in self.SEARCH_NAME_FIELDS for token in search_term(r.get(f) or '').split())]
+            else:
+                results = [r for r in results if search_term(r.get(field) or '').startswith(value)]
+        return results
+
+
 class CampaignType(object):
     type_name = None
     subtypes = []
@@ -160,12 +459,28 @@ class CampaignType(object):
         choices_dict = dict(self.target_order_choices)
         return choices_dict.get(target_order, None)
 
-    def get_targets_for_campaign(self, location, campaign):
-        country_code = campaign.country_code
+    def all_targets_for_campaign(self, location, campaign):
+        """
+        Find all targets for a campaign at a location, before any sorting or shuffling.
+        @return  a dictionary of target uid lists grouped by subtype, safe to cache
+        """
         if isinstance(location, str):
             location = self.data_provider.get_location(campaign.locate_by, location)
-        all_targets = self.all_targets(location, campaign.campaign_state)
+        return materialize_targets(self.all_targets(location, campaign.campaign_state))
+
+    def get_targets_for_campaign(self, location, campaign, all_targets=None):
+        if all_targets is None:
+            all_targets = self.all_targets_for_campaign(location, campaign)
         return self.sort_targets(all_targets,
             campaign.campaign_subtype,
             campaign.target_ordering,
             shuffle_chamber=campaign.target_shuffle_chamber)
+
+
+def materialize_targets(targets):
+    """
+    Convert the generators returned by all_targets into lists, recursing into nested groups
+    """
+    if isinstance(targets, dict):
+        return dict((k, materialize_targets(v)) for (k, v) in targets.items())
+    return list(targets)
@@ -3,13 +3,34 @@ from flask_babel import gettext as _
 import represent
 from . import DataProvider, CampaignType
 
-from ..geocode import Geocoder, LocationError
+from ..geocode import Geocoder, Location, LocationError, LOCAL_CADATA_SERVICE
+from ..adapters import with_target_records
 from ..constants import CA_PROVINCE_ABBR_DICT
 from ...campaign.constants import (LOCATION_POSTAL, LOCATION_ADDRESS, LOCATION_LATLON)
 
+import collections
+import csv
+import re
+import unicodedata
+from datetime import datetime
 import logging
 log = logging.getLogger(__name__)
 
+POSTAL_CODE_RE = re.compile(r'^[A-Z]\d[A-Z](\d[A-Z]\d)?$')
+
+
+def normalize_postal(code):
+    """ Uppercase postal code or FSA without spaces, or None if it doesn't look like one """
+    code = ''.join(str(code or '').split()).upper()
+    return code if POSTAL_CODE_RE.match(code) else None
+
+
+def riding_slug(name):
+    """ Riding name without accents or punctuation, so spellings from different sources match """
+    name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    return '-'.join(re.findall(r'[a-z0-9]+', name.lower()))
+
+
 class CACampaignType(CampaignType):
     pass
 
@@ -68,8 +89,7 @@ class CACampaignType_Parliament(CACampaignType):
         return (r['cache_key'] for r in filtered)
 
     def _filter_representatives(self, representatives, elected_office="MP", campaign_region=None):
-        for key in representatives:
-            rep = self.data_provider.cache_get(key, {})
+        for rep in representatives:
             correct_office = rep['elected_office'].upper() == elected_office
             in_region = campaign_region is None or rep['district_name'].upper() == campaign_region.upper()
             if correct_office and in_region:
@@ -138,8 +158,7 @@ class CACampaignType_Province(CACampaignType):
         return (r['cache_key'] for r in filtered)
 
     def _filter_representatives(self, representatives, elected_office="MLA", district_name=None):
-        for key in representatives:
-            rep = self.data_provider.cache_get(key, {})
+        for rep in representatives:
             correct_office = rep['elected_office'].upper() == elected_office
             in_region = district_name is None or rep['district_name'].upper() == district_name.upper()
             if correct_office and in_region:
@@ -158,14 +177,30 @@ class CADataProvider(DataProvider):
     ]
 
     KEY_OPENNORTH = 'ca:opennorth:{boundary}'
+    KEY_RIDING = 'ca:riding:{riding}'
+    KEY_POSTAL = 'ca:postal:{code}'
+    MANIFEST_KEY = 'political_data:ca:manifest'
+
+    HOUSE_OF_COMMONS = 'house-of-commons'
+    FEDERAL_BOUNDARY = 'federal-electoral-districts:{fed_num}'
+    # postal codes learned from OpenNorth responses, until the next redistribution may have moved them
+    POSTAL_TIMEOUT = 60*60*24*365
 
     def __init__(self, cache, **kwargs):
         super(CADataProvider, self).__init__(**kwargs)
         self._cache = cache
-        self._geocoder = Geocoder(country='CA')
+        self._geocoder = Geocoder(country='CA', cache=cache)
 
     def get_location(self, locate_by, raw):
         if locate_by == LOCATION_POSTAL:
+            # a postal code in a single known riding doesn't need geocoding for parliament campaigns
+            ridings = self.get_postal_ridings(raw)
+            if len(ridings) == 1:
+                l = Location(raw, (None, None), {'zipcode': normalize_postal(raw),
+                                                 'state': ridings[0].get('province'),
+                                                 'ridings': ridings})
+                l.service = LOCAL_CADATA_SERVICE
+                return l
             return self._geocoder.postal(raw)
         elif locate_by == LOCATION_ADDRESS:
             return self._geocoder.geocode(raw)
@@ -175,13 +210,163 @@ class CADataProvider(DataProvider):
             return None
 
 
-    def load_data(self):
-        # we don't have an easy mapping of postcode to riding
-        # so just hit OpenNorth with every request and cache responses
-        log.info('no data to load for political_data.countries.ca')
-        self.cache_set('political_data:ca', ['data sourced from represent.opennorth.ca',])
-        return 0
-        
+    def _load_ridings(self):
+        """
+        Load members of parliament from ca_house_of_commons.csv, in the same shape as OpenNorth representatives
+        Returns a dictionary keyed by riding name, without boundary keys, which are only known from postal codes
+
+        eg ca:riding:abbotsford = {'name': 'Ed Fast', 'district_name': 'Abbotsford', 'elected_office': 'MP', ...}
+        """
+        ridings = {}
+
+        with open('call_server/political_data/data/ca_house_of_commons.csv', encoding='cp1252') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            n_fields = header.index('Office type')
+
+            for row in reader:
+                d = dict(zip(header[:n_fields], row[:n_fields]))
+                offices = []
+                for i in range(n_fields, len(row) - 3, 4):
+                    (office_type, postal, tel, fax) = row[i:i+4]
+                    if not office_type:
+                        continue
+                    office = {'type': office_type, 'postal': postal}
+                    if tel:
+                        office['tel'] = tel
+                    if fax:
+                        office['fax'] = fax
+                    offices.append(office)
+
+                rep = {
+                    'name': d['Name'],
+                    'first_name': d['First name'],
+                    'last_name': d['Last name'],
+                    'district_name': d['District name'],
+                    'elected_office': d['Primary role'],
+                    'party_name': d['Party name'],
+                    'email': d['Email'],
+                    'url': d['Website'],
+                    'photo_url': d['Photo URL'],
+                    'source_url': d['Source URL'],
+                    'representative_set_name': 'House of Commons',
+                    'offices': offices,
+                }
+                ridings[self.KEY_RIDING.format(riding=riding_slug(d['District name']))] = rep
+
+        return ridings
+
+    def load_data(self, force=False):
+        # postal codes are learned from OpenNorth responses, or seeded with load_postal_ridings
+        # so only members of parliament are loaded here
+        ridings = self._load_ridings()
+        sync = self.cache_sync(ridings, force=force)
+
+        success = [
+            "%s ridings" % len(ridings),
+            "%s added, %s changed, %s removed" % (len(sync.added), len(sync.changed), len(sync.removed)),
+            "other data sourced from represent.opennorth.ca",
+            "at %s" % datetime.now(),
+        ]
+        log.info('loaded %s' % ', '.join(success))
+        self.cache_set('political_data:ca', success)
+
+        return collections.Counter(loaded=len(ridings), added=len(sync.added),
+                                   changed=len(sync.changed), removed=len(sync.removed))
+
+    def load_postal_ridings(self, path):
+        """
+        Seed the postal code cache from a csv with postal_code, fed_num and district_name columns,
+        such as the Elections Canada postal code to riding file
+        Rows may be full postal codes or three character FSAs, listed once for each riding they overlap
+        Returns the number of postal codes loaded
+        """
+        postal = collections.defaultdict(list)
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                code = normalize_postal(row.get('postal_code'))
+                if not code:
+                    continue
+                riding = {
+                    'boundary_key': self.FEDERAL_BOUNDARY.format(fed_num=row['fed_num'].strip()),
+                    'district_name': row['district_name'].strip(),
+                    'province': row.get('province'),
+                }
+                key = self.KEY_POSTAL.format(code=code)
+                if riding not in postal[key]:
+                    postal[key].append(riding)
+
+        keys = list(postal.keys())
+        for i in range(0, len(keys), self.CACHE_BATCH_SIZE):
+            self.cache_set_many(dict((key, postal[key]) for key in keys[i:i+self.CACHE_BATCH_SIZE]))
+        log.info('loaded %s postal codes from %s' % (len(keys), path))
+        return len(keys)
+
+    def get_postal_ridings(self, code):
+        """
+        Ridings for a postal code, from the full code or else its FSA, in one round trip
+        Returns an empty list if unknown, or more than one riding if the area crosses a boundary
+        """
+        code = normalize_postal(code)
+        if not code:
+            return []
+        keys = [self.KEY_POSTAL.format(code=code)]
+        if len(code) > 3:
+            keys.append(self.KEY_POSTAL.format(code=code[:3]))
+        for ridings in self.cache_get_many(keys):
+            if ridings:
+                return ridings
+        return []
+
+    def _remember_postal(self, location, reps):
+        # the riding found for a located postal code serves later callers from the same code
+        try:
+            code = normalize_postal(location.postal)
+        except (AttributeError, ValueError):
+            return
+        if not code or len(code) == 3:
+            return
+        ridings = [{'boundary_key': rep['boundary_key'],
+                    'district_name': rep['district_name'],
+                    'province': location.state}
+                   for rep in reps if rep.get('elected_office', '').upper() == 'MP']
+        if len(ridings) == 1:
+            self.cache_set(self.KEY_POSTAL.format(code=code), ridings, timeout=self.POSTAL_TIMEOUT)
+
+    def _get_local_representatives(self, location):
+        """
+        Resolves the member of parliament for a location from the postal code and riding caches
+        Returns a list with one representative, or None if the riding is unknown or ambiguous
+        """
+        ridings = None
+        if location.service == LOCAL_CADATA_SERVICE:
+            ridings = location.raw.get('ridings')
+        else:
+            try:
+                ridings = self.get_postal_ridings(location.postal)
+            except (AttributeError, ValueError):
+                pass
+        if not ridings or len(ridings) != 1:
+            return None
+
+        riding = ridings[0]
+        cache_key = self.KEY_OPENNORTH.format(boundary=riding['boundary_key'])
+        riding_key = self.KEY_RIDING.format(riding=riding_slug(riding['district_name']))
+        (existing, local) = self.cache_get_many([cache_key, riding_key])
+        if not local:
+            return [existing] if existing else None
+
+        # fields of an earlier OpenNorth response are fresher than the shipped csv, which only fills gaps
+        rep = dict(existing or {})
+        for (field, value) in local.items():
+            if rep.get(field) in (None, '', [], {}):
+                rep[field] = value
+        rep['boundary_key'] = riding['boundary_key']
+        rep['cache_key'] = cache_key
+        rep.setdefault('related', {'boundary_url': '/boundaries/%s/' % riding['boundary_key'].replace(':', '/')})
+        if rep != existing:
+            self.cache_set_many(with_target_records({cache_key: rep}))
+        return [rep]
 
     # convenience methods for easy district access
     def get_executive(self):
@@ -194,25 +379,44 @@ class CADataProvider(DataProvider):
         return represent.postcode(code=postcode)
 
 
-    def get_representatives(self, location, body_name='house-of-commons'):
+    def _query_representatives(self, latitude, longitude, body_name):
+        point = "{},{}".format(latitude, longitude)
+        return represent.representative(point=point, repr_set=body_name)
+        # add throttle=False here to avoid rate limits
+
+    def get_representatives(self, location, body_name=HOUSE_OF_COMMONS):
+        """
+        Representatives for a location in a House of Commons or provincial legislature body
+        Returns full records, each with its cache_key, so callers don't read back what was just cached
+        """
+        if location and body_name == self.HOUSE_OF_COMMONS:
+            reps = self._get_local_representatives(location)
+            if reps:
+                return reps
+
+        if location and location.service == LOCAL_CADATA_SERVICE:
+            # located from the postal cache, but other bodies need a point
+            location = self._geocoder.postal(location.postal)
+
         if not location or not (location.latitude and location.longitude):
             raise LocationError('CADataProvider.get_representatives requires location with lat/lon')
 
-        point = "{},{}".format(location.latitude, location.longitude)
-        reps = represent.representative(point=point, repr_set=body_name)
-        # add throttle=False here to avoid rate limits
+        reps = self._query_representatives(location.latitude, location.longitude, body_name)
 
-        # calculate keys and cache responses
-        keys = []
+        # calculate keys and cache responses in one batch
+        records = {}
         for rep in reps:
             boundary_key = self.boundary_url_to_key(rep['related']['boundary_url'])
             cache_key = self.KEY_OPENNORTH.format(boundary=boundary_key)
             rep['boundary_key'] = boundary_key
             rep['cache_key'] = cache_key
-            self.cache_set(cache_key, rep)
-            keys.append(cache_key)
+            records[cache_key] = rep
+        if records:
+            self.cache_set_many(with_target_records(records))
 
-        return keys
+        if body_name == self.HOUSE_OF_COMMONS:
+            self._remember_postal(location, reps)
+        return reps
 
 
     def get_uid(self, uid):
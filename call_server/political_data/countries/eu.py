@@ -3,6 +3,7 @@ from . import DataProvider, CampaignType
 from ..geocode import Geocoder, LocationError
 from ...campaign.constants import (LOCATION_POSTAL, LOCATION_ADDRESS, LOCATION_LATLON)
 
+import collections
 import logging
 log = logging.getLogger(__name__)
 
@@ -21,11 +22,11 @@ class EUDataProvider(DataProvider):
     def __init__(self, cache, **kwargs):
         super(EUDataProvider, self).__init__(**kwargs)
         self._cache = cache
-        self._geocoder = Geocoder(country=self.country_code.upper())
+        self._geocoder = Geocoder(country=self.country_code.upper(), cache=cache)
 
-    def load_data(self):
+    def load_data(self, force=False):
         # no stored data to load for this data provider
-        return 0
+        return collections.Counter()
 
 class FRDataProvider(EUDataProvider):
     country_name = "France"
@@ -1,20 +1,25 @@
-import flask_caching
 from flask_babel import gettext as _
-from graphqlclient import GraphQLClient
 
-from . import DataProvider, CampaignType
+from . import DataProvider, CampaignType, search_term
+from .. import provider_setting
 
-from ..adapters import OpenStatesData
+from ..adapters import OpenStatesData, with_target_records
 from ..geocode import Geocoder, LocationError
+from ..snapshot import load_snapshot
+from ..yaml_stream import iter_yaml_sequence, peak_rss
+from ..zipcodes import get_zipcode_index, reset_zipcode_index
+from ..geohash import geohash_cell, near_cell_edge
+from ..boundaries import get_district_index
+from ..openstates import get_openstates_client
 from ..constants import US_STATES
 from ...campaign.constants import (LOCATION_POSTAL, LOCATION_ADDRESS, LOCATION_LATLON)
-from ...utils import ocd_field
+from ...utils import ocd_field, LRUCache, SingleFlight
 
 import os
 import random
+import time
 import csv
 import yaml
-import json
 import collections
 from datetime import datetime
 import logging
@@ -26,6 +31,34 @@ except ImportError:
     log.info('install libyaml to speed up loadpoliticaldata')
     from yaml import Loader as yamlLoader
 
+# organization ids change only between legislative sessions, so keep them per process too
+_local_organizations = LRUCache(256)
+# concurrent identical OpenStates lookups share one request
+_openstates_flights = SingleFlight()
+
+
+GEOHASH_PRECISION_DEFAULT = 6
+
+
+def geohash_settings():
+    """
+    OpenStates geohash cache settings
+    Returns tuple (precision, verify), with the default precision if the setting isn't a valid one
+    """
+    precision = provider_setting('OPENSTATES_GEOHASH_PRECISION', GEOHASH_PRECISION_DEFAULT)
+    try:
+        precision = int(precision)
+        if not 0 <= precision <= 12:
+            raise ValueError(precision)
+    except (TypeError, ValueError):
+        log.warning('invalid OPENSTATES_GEOHASH_PRECISION %r, using %d' % (precision, GEOHASH_PRECISION_DEFAULT))
+        precision = GEOHASH_PRECISION_DEFAULT
+    verify = provider_setting('OPENSTATES_GEOHASH_VERIFY', '')
+    if not isinstance(verify, bool):
+        verify = str(verify).lower() in ('1', 'true', 'yes')
+    return (precision, verify)
+
+
 class USCampaignType(CampaignType):
     pass
 
@@ -72,25 +105,50 @@ class USCampaignType_Congress(USCampaignType):
         ('democrats-only', _("Democrats Only")),
         ('republicans-only', _("Republicans Only")),
     ]
+    party_groups = {
+        'Democrat': 'democrats',
+        'Republican': 'republicans',
+    }
 
     @property
     def region_choices(self):
         return US_STATES
 
     def all_targets(self, location, campaign_region=None):
-        return {
-            'upper': {
-                'all': self._get_senators(location),
-                'democrats': self._get_senate_party(location, 'Democrat'),
-                'republicans': self._get_senate_party(location, 'Republican')
-            },
-            'lower': {
-                'all': self._get_representative(location),
-                'democrats': self._get_congress_party(location, 'Democrat'),
-                'republicans': self._get_congress_party(location, 'Republican'),
-            }
+        """
+        Fetches districts for the location once, then all senators and house members in one batch,
+        and partitions them by chamber and party.
+        """
+        targets = {
+            'upper': {'all': [], 'democrats': [], 'republicans': []},
+            'lower': {'all': [], 'democrats': [], 'republicans': []}
         }
 
+        districts = self.data_provider.get_districts(location.postal)
+        # zipcodes may cross states, keep them unique and in district order
+        states = list(collections.OrderedDict.fromkeys(d['state'] for d in districts))
+
+        senate_keys = [self.data_provider.KEY_SENATE.format(state=state) for state in states]
+        house_keys = [self.data_provider.KEY_HOUSE.format(state=d['state'], district=d['house_district'])
+                      for d in districts]
+        members = self.data_provider.cache_get_many(senate_keys + house_keys)
+
+        for senators in members[:len(senate_keys)]:
+            for senator in senators:
+                self._add_target(targets['upper'], senator)
+        for reps in members[len(senate_keys):]:
+            if reps:
+                self._add_target(targets['lower'], reps[0])
+
+        return targets
+
+    def _add_target(self, chamber, legislator):
+        key = self.data_provider.KEY_BIOGUIDE.format(**legislator)
+        chamber['all'].append(key)
+        party_group = self.party_groups.get(legislator.get('party'))
+        if party_group:
+            chamber[party_group].append(key)
+
     def sort_targets(self, targets, subtype, order, shuffle_chamber=True):
         # get all targets for both chambers
         upper_targets = list(targets.get('upper').get('all'))
@@ -139,46 +197,6 @@ class USCampaignType_Congress(USCampaignType):
         elif subtype == 'exec':
             return exec_targets
 
-    def _get_senators(self, location):
-        districts = self.data_provider.get_districts(location.postal)
-        # This is a set because zipcodes may cross states
-        states = set(d['state'] for d in districts)
-
-        for state in states:
-            for senator in self.data_provider.get_senators(state):
-                yield self.data_provider.KEY_BIOGUIDE.format(**senator)
-
-    def _get_representative(self, location):
-        districts = self.data_provider.get_districts(location.postal)
-
-        for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
-            if rep:
-                yield self.data_provider.KEY_BIOGUIDE.format(**rep[0])
-
-    def _get_senate_party(self, location, party):
-        districts = self.data_provider.get_districts(location.postal)
-        # This is a set because zipcodes may cross states
-        states = set(d['state'] for d in districts)
-        matched_party = []
-
-        for state in states:
-            for senator in self.data_provider.get_senators(state):
-                if senator.get('party') == party:
-                    matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**senator))
-        return matched_party
-
-    def _get_congress_party(self, location, party):
-        districts = self.data_provider.get_districts(location.postal)
-        matched_party = []
-        
-        for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
-            if rep and rep[0].get('party') == party:
-                matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**rep[0]))
-        return matched_party
-
-
 class USCampaignType_State(USCampaignType):
     type_name = "State"
 
@@ -273,17 +291,48 @@ class USDataProvider(DataProvider):
     KEY_HOUSE = 'us:house:{state}:{district}'
     KEY_SENATE = 'us:senate:{state}'
     KEY_OPENSTATES = 'us_state:openstates:{id}'
+    KEY_OPENSTATES_GEOHASH = 'us_state:geohash:{precision}:{geohash}'
+    KEY_OPENSTATES_ZIPCODE = 'us_state:zipcode:{zipcode}'
+    KEY_OPENSTATES_DISTRICT = 'us_state:district:{division}'
+    KEY_OPENSTATES_ORGANIZATION = 'us_state:organization:{state}:{chamber}'
+    KEY_OPENSTATES_SEARCH = 'us_state:search:{state}:{chamber}:{name}'
     KEY_GOVERNOR = 'us_state:governor:{state}'
     KEY_ZIPCODE = 'us:zipcode:{zipcode}'
 
     SORTED_SETS = ['us:house', 'us:senate', 'us_state:governor']
-
-    def __init__(self, cache, api_cache=None, **kwargs):
+    MANIFEST_KEY = 'political_data:us:manifest'
+
+    DATA_SOURCES = [
+        'call_server/political_data/data/us_congress_current.yaml',
+        'call_server/political_data/data/us_congress_historical.yaml',
+        'call_server/political_data/data/us_congress_offices.yaml',
+        'call_server/political_data/data/us_districts.csv',
+        'call_server/political_data/data/us_governors.csv',
+    ]
+    DATA_SNAPSHOT = 'call_server/political_data/data/us_political_data.snapshot'
+    # legislators whose last term started earlier are not loaded
+    # set this to be before the start date of the oldest currently seated Senate class
+    LEGISLATORS_SINCE = '2015-01-01'
+    SEARCH_INDEX = 'us:search'
+    SEARCH_FIELDS = ['state', 'chamber', 'party', 'first_name', 'last_name']
+    SEARCH_NAME_FIELDS = ['first_name', 'last_name', 'nick_name']
+
+    # state legislators for a location are cached by geohash cell and by zipcode
+    # buckets found to cross a district boundary are marked split, and always looked up
+    OPENSTATES_BUCKET_TIMEOUT = 60*60*24*30
+    OPENSTATES_BUCKET_SPLIT = 'split'
+    # name searches from the campaign form repeat as the admin types
+    OPENSTATES_SEARCH_TIMEOUT = 60*5
+
+    def __init__(self, cache, api_cache=None, zipcode_index=True, **kwargs):
         super(USDataProvider, self).__init__(**kwargs)
         self._cache = cache
-        self._geocoder = Geocoder(country='US')
-        self._openstates = GraphQLClient('https://open.pluralpolicy.com/graphql')
-        self._openstates.inject_token(os.environ.get('OPENSTATES_API_KEY'), 'x-api-key')
+        self._zipcode_index = zipcode_index
+        # precision 0 disables the geohash cache
+        # verify looks up points near the edge of a cell, to find cells that cross a boundary
+        (self._geohash_precision, self._geohash_verify) = geohash_settings()
+        self._geocoder = Geocoder(country='US', cache=cache)
+        self._openstates = get_openstates_client()
 
     def get_location(self, locate_by, raw, ignore_local_cache=False):
         if locate_by == LOCATION_POSTAL:
@@ -301,27 +350,37 @@ class USDataProvider(DataProvider):
         else:
             return None
 
-    def _load_legislators(self):
+    def _load_legislators(self, stream=True):
         """
-        Load US legislator data from us_congress_current.yaml
+        Load US legislator data from us_congress_current.yaml, and recent legislators from us_congress_historical.yaml
         Merges with district office data from us_congress_offices.yaml by bioguide id
-        Returns a dictionary keyed by state, district and bioguide id
+        Returns a dictionary keyed by bioguide id, with the end date of each legislator's last term
 
-        eg us:senate:CA = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...},
-                           {'title':'Sen', 'first_name':'Barbara', 'last_name': 'Boxer', ...}]
-        or us:house:CA:13 = [{'title':'Rep', 'first_name':'Barbara',  'last_name': 'Lee', ...}]
-        or us:bioguide:F000062 = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...}]
+        eg us:bioguide:F000062 = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', 'term_end': '2025-01-03', ...}]
+
+        Records don't depend on the date they are parsed, so they can be kept in the snapshot,
+        see _current_legislators for the state and district keys
+
+        With stream, the yaml files are read one legislator at a time, instead of as whole documents
         """
         legislators = collections.defaultdict(list)
         offices = collections.defaultdict(list)
+        started = time.time()
 
         with open('call_server/political_data/data/us_congress_current.yaml') as f1, \
             open('call_server/political_data/data/us_congress_historical.yaml') as f2, \
             open('call_server/political_data/data/us_congress_offices.yaml') as f3:
 
-            current_leg = yaml.load(f1, Loader=yamlLoader)
-            historical_leg = yaml.load(f2, Loader=yamlLoader)
-            office_info = yaml.load(f3, Loader=yamlLoader)
+            if stream:
+                # skip legislators whose last term is too old, without building them
+                recent = lambda start: start is not None and start >= self.LEGISLATORS_SINCE
+                current_leg = list(iter_yaml_sequence(f1, ('terms', '*', 'start'), recent, Loader=yamlLoader))
+                historical_leg = list(iter_yaml_sequence(f2, ('terms', '*', 'start'), recent, Loader=yamlLoader))
+                office_info = iter_yaml_sequence(f3, Loader=yamlLoader)
+            else:
+                current_leg = yaml.load(f1, Loader=yamlLoader)
+                historical_leg = yaml.load(f2, Loader=yamlLoader) or []
+                office_info = yaml.load(f3, Loader=yamlLoader)
 
             for info in office_info:
                 id = info['id']['bioguide']
@@ -329,28 +388,15 @@ class USDataProvider(DataProvider):
 
             for info in current_leg+historical_leg:
                 term = info['terms'][-1]
-                if term['start'] < "2015-01-01":
+                if term['start'] < self.LEGISLATORS_SINCE:
                     continue # skip loading historical data
-                    # set this to be before the start date of the oldest currently seated Senate class
-
-                term['current'] = (term['end'] >= datetime.now().strftime('%Y-%m-%d'))
-
-                if term.get('phone') is None:
-                    term['name'] = info['name']['last']
-                    if term['current']:
-                        # try to pull from previous term, for re-elected incumbents
-                        try:
-                            prev_term = info['terms'][-2]
-                            old_phone = prev_term.get('phone')
-                            if old_phone and prev_term['type'] == term['type']:
-                                term['phone'] = old_phone
-                                log.info(u"pulling phone number from previous {type} term for {name}".format(**term))
-                            else:
-                                log.warning(u"term {start} - {end} does not have field phone for {type} {name}".format(**term))
-                        except IndexError:
-                            log.warning(u"term {start} - {end} does not have field phone for {type} {name}".format(**term))
-                    else:
-                        continue
+
+                previous_phone = None
+                if term.get('phone') is None and len(info['terms']) > 1:
+                    # keep the previous term's phone, for re-elected incumbents if they are current
+                    prev_term = info['terms'][-2]
+                    if prev_term['type'] == term['type']:
+                        previous_phone = prev_term.get('phone')
 
                 district = str(term['district']) if 'district' in term else None
 
@@ -370,8 +416,10 @@ class USDataProvider(DataProvider):
                     'state':       term['state'],
                     'district':    district,
                     'offices':     offices.get(bioguide, []),
-                    'current':     term['current'],
+                    'term_end':    term['end'],
                 }
+                if previous_phone:
+                    record['previous_phone'] = previous_phone
                 if info['name'].get('nickname'):
                     record['nick_name'] = info['name']['nickname']
 
@@ -381,19 +429,53 @@ class USDataProvider(DataProvider):
                     record['party'] = term['party']
 
                 direct_key = self.KEY_BIOGUIDE.format(**record)
-                if record['chamber'] == "senate":
-                    chamber_key = self.KEY_SENATE.format(**record)
-                else:
-                    chamber_key = self.KEY_HOUSE.format(**record)
-
-                # we want bioguide access to all recent legislators
                 legislators[direct_key].append(record)
-                # but only house or senate access to current ones
-                if term['current']:
-                    legislators[chamber_key].append(record)
 
+        log.info('parsed %d legislator keys in %.2fs, peak RSS %s MB' % (
+            len(legislators), time.time() - started, peak_rss()))
         return legislators
 
+    def _current_legislators(self, legislators, today=None):
+        """
+        Marks legislators parsed by _load_legislators current if their last term hasn't ended
+        Returns a dictionary keyed by state, district and bioguide id
+
+        eg us:senate:CA = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...},
+                           {'title':'Sen', 'first_name':'Barbara', 'last_name': 'Boxer', ...}]
+        or us:house:CA:13 = [{'title':'Rep', 'first_name':'Barbara',  'last_name': 'Lee', ...}]
+        or us:bioguide:F000062 = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...}]
+        """
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        current = collections.defaultdict(list)
+
+        for (direct_key, records) in legislators.items():
+            for record in records:
+                record = dict(record)
+                term_end = record.pop('term_end')
+                previous_phone = record.pop('previous_phone', None)
+                record['current'] = (term_end >= today)
+
+                if record['phone'] is None:
+                    if not record['current']:
+                        continue
+                    if previous_phone:
+                        record['phone'] = previous_phone
+                        log.info(u"pulling phone number from previous {chamber} term for {last_name}".format(**record))
+                    else:
+                        log.warning(u"term ending {end} does not have field phone for {chamber} {last_name}".format(
+                            end=term_end, **record))
+
+                # we want bioguide access to all recent legislators
+                current[direct_key].append(record)
+                # but only house or senate access to current ones
+                if record['current']:
+                    if record['chamber'] == "senate":
+                        chamber_key = self.KEY_SENATE.format(**record)
+                    else:
+                        chamber_key = self.KEY_HOUSE.format(**record)
+                    current[chamber_key].append(record)
+        return current
+
 
     def _load_districts(self):
         """
@@ -444,35 +526,62 @@ class USDataProvider(DataProvider):
                 governors[direct_key] = [d, ]
         return governors
 
-    def load_data(self):
-        districts = self._load_districts()
-        legislators = self._load_legislators()
-        governors = self._load_governors()
+    def _load_sources(self):
+        return {
+            'districts': self._load_districts(),
+            'legislators': self._load_legislators(),
+            'governors': self._load_governors(),
+        }
 
-        self.cache_set_many(districts)
-        self.cache_set_many(legislators)
-        self.cache_set_many(governors)
+    def compile_data(self, force=False):
+        """
+        Returns parsed districts, legislators and governors
+        Reads the binary snapshot if it is fresh, otherwise parses the source files and rebuilds it
+        Legislators keep their term end date, and are marked current by load_data
+        """
+        return load_snapshot(self.DATA_SNAPSHOT, self.DATA_SOURCES, self._load_sources, force=force)
+
+    def load_data(self, force=False):
+        data = self.compile_data()
+        districts = data['districts']
+        legislators = self._current_legislators(data['legislators'])
+        governors = data['governors']
+
+        # write only keys that changed since the last load
+        mapping = {}
+        mapping.update(districts)
+        mapping.update(legislators)
+        mapping.update(governors)
+        # with adapted target records, so Target lookups don't adapt on every call
+        mapping = with_target_records(mapping)
+        sync = self.cache_sync(mapping, force=force)
+
+        # rebuild local zipcode index if the districts csv changed
+        if self._zipcode_index:
+            reset_zipcode_index()
+            get_zipcode_index()
 
         # if cache is redis, add lexigraphical index on states, names
-        if hasattr(self._cache, 'cache') and isinstance(self._cache.cache, flask_caching.backends.rediscache.RedisCache):
-            redis = self._cache.cache._write_client
-            searchable_items = [legislators.items(), governors.items()]
-            for item in searchable_items:
-                for (key, value) in item:
-                    for sorted_key in self.SORTED_SETS:
-                        if key.startswith(sorted_key):
-                            redis.zadd(sorted_key, {key: 0})
+        self.cache_index_many(sync.added)
+        self.cache_unindex_many(sync.removed)
+        # and secondary index on fields for search, if any searchable records changed
+        if any(key.startswith(tuple(self.SORTED_SETS)) for key in sync.added + sync.changed + sync.removed):
+            searchable = dict((key, value) for (key, value) in list(legislators.items()) + list(governors.items())
+                              if key.startswith(tuple(self.SORTED_SETS)))
+            self.cache_index_search(searchable)
 
         success = [
             "%s zipcodes" % len(districts),
             "%s legislators" % len(legislators),
             "%s governors" % len(governors),
+            "%s added, %s changed, %s removed" % (len(sync.added), len(sync.changed), len(sync.removed)),
             "at %s" % datetime.now(),
         ]
         log.info('loaded %s' % ', '.join(success))
         self.cache_set('political_data:us', success)
 
-        return len(districts) + len(legislators) + len(governors)
+        return collections.Counter(loaded=len(mapping), added=len(sync.added),
+                                   changed=len(sync.changed), removed=len(sync.removed))
 
 
     # convenience methods for easy house, senate, district access
@@ -492,6 +601,12 @@ class USDataProvider(DataProvider):
         return self.cache_get(key)
 
     def get_districts(self, zipcode):
+        # check the local memory-mapped index first, fall back to cache
+        index = get_zipcode_index() if self._zipcode_index else None
+        if index is not None:
+            districts = index.get(zipcode)
+            if districts:
+                return districts
         key = self.KEY_ZIPCODE.format(zipcode=zipcode)
         return self.cache_get(key)
 
@@ -500,136 +615,165 @@ class USDataProvider(DataProvider):
         return self.cache_get(key)
 
     def get_state_legislators(self, location):
+        zipcode = None
         if not (location.latitude and location.longitude):
+            zipcode = location.raw.get('zipcode') if type(location.raw) == dict else location.raw
+            zipcode_key = self.KEY_OPENSTATES_ZIPCODE.format(zipcode=zipcode)
+            legislators = self._get_bucket_legislators(self._cache.get(zipcode_key))
+            if legislators:
+                return legislators
+
             location = self.get_location(LOCATION_POSTAL, location.raw, ignore_local_cache=True)
-        
+
         if not (location.latitude and location.longitude):
-            raise LocationError('USDataProvider.get_state_legislators requires location with lat/lon')    
+            raise LocationError('USDataProvider.get_state_legislators requires location with lat/lon')
+
+        # with local district boundaries, only contact details come from the cache or OpenStates
+        divisions = self.get_state_districts(location)
+        if divisions:
+            district_keys = [self.KEY_OPENSTATES_DISTRICT.format(division=d) for d in divisions]
+            buckets = self.cache_get_many(district_keys)
+            if all(buckets):
+                legislators = self._get_bucket_legislators([key for bucket in buckets for key in bucket])
+                if legislators:
+                    return legislators
+
+        geohash_key = None
+        bucket = None
+        cached = None
+        if self._geohash_precision:
+            (geohash, bounds) = geohash_cell(location.latitude, location.longitude, self._geohash_precision)
+            geohash_key = self.KEY_OPENSTATES_GEOHASH.format(precision=self._geohash_precision, geohash=geohash)
+            bucket = self._cache.get(geohash_key)
+            cached = self._get_bucket_legislators(bucket)
+            if cached and not (self._geohash_verify and near_cell_edge(location.latitude, location.longitude, bounds)):
+                return cached
+
+        legislators = self._query_state_legislators(location.latitude, location.longitude)
+        if legislators:
+            legislator_keys = [leg['cache_key'] for leg in legislators]
+            if geohash_key and bucket != self.OPENSTATES_BUCKET_SPLIT:
+                if cached and set(legislator_keys) != set(bucket):
+                    log.info('%s crosses a district boundary' % geohash_key)
+                    self.cache_set(geohash_key, self.OPENSTATES_BUCKET_SPLIT, timeout=self.OPENSTATES_BUCKET_TIMEOUT)
+                else:
+                    self.cache_set(geohash_key, legislator_keys, timeout=self.OPENSTATES_BUCKET_TIMEOUT)
+            if zipcode:
+                # matches the zipcode lookup above, which uses the geocoded zipcode centroid
+                self.cache_set(zipcode_key, legislator_keys, timeout=self.OPENSTATES_BUCKET_TIMEOUT)
+
+            # and by district, for any other location in the same districts
+            districts = collections.defaultdict(list)
+            for leg in legislators:
+                districts[self.KEY_OPENSTATES_DISTRICT.format(division=leg['division'])].append(leg['cache_key'])
+            for (district_key, district_legislators) in districts.items():
+                self.cache_set(district_key, district_legislators, timeout=self.OPENSTATES_BUCKET_TIMEOUT)
+        return legislators
 
-        # execute GraphQL query to get id, name, chamber, and contactDetails
-        api_response = self._openstates.execute('''
-            { people(latitude: %f, longitude: %f, first: 100) {
-                edges {
-                  node {
-                    id
-                    name
-                    givenName
-                    familyName
-                    chamber: currentMemberships(classification:["upper", "lower", "legislature"]) {
-                      post {
-                        label
-                        role
-                        division {
-                          id
-                        }
-                      }
-                      organization {
-                        name
-                        classification
-                        jurisdictionId
-                      }
-                    }
-                    contactDetails {
-                        value
-                        note
-                        type
-                    }
-                  }
-                }
-              }
-            }''' % (location.latitude, location.longitude))
-        parsed_response = json.loads(api_response)
-
-        legislators = []
-        # save results individually in local cache
-        for edge in parsed_response['data']['people']['edges']:
-            leg = edge['node']
-
-            org_classificiation = leg['chamber'][0]['organization']['classification']
-            org_jurisdiction = leg['chamber'][0]['organization']['jurisdictionId']
-            
-            post_label = leg['chamber'][0]['post']['label']
-            post_division = leg['chamber'][0]['post']['division']['id']
-            post_state = ocd_field(post_division, 'state').upper()
-            role_title = leg['chamber'][0]['post']['role']
-
-            leg['chamber'] = org_classificiation
-            leg['state'] = post_state
-            leg['district'] = post_label
-            leg['title'] = role_title
-
-            # filter out non-state jurisdictions
-            # we only want (eg) ocd-jurisdiction/country:us/state:ca/government
-            jurisdiction_state = ocd_field(org_jurisdiction, 'state')
-            if not jurisdiction_state:
-                continue
-
-            key = self.KEY_OPENSTATES.format(id=leg['id'])
-            leg['cache_key'] = key
-            self.cache_set(key, leg)
-            legislators.append(leg)
+    def get_state_districts(self, location):
+        """
+        Returns OCD division ids of the state legislative districts containing a location,
+        from local boundaries loaded with `flask loadpoliticaldata --state-boundaries`
+        or an empty list if none were loaded
+        """
+        index = get_district_index()
+        if index is None:
+            return []
+        return index.locate(location.latitude, location.longitude)
 
+    def _get_bucket_legislators(self, legislator_keys):
+        """
+        Returns cached legislators for the keys stored in a geohash or zipcode bucket,
+        or None if the bucket is empty, split, or any legislator has expired
+        """
+        if not legislator_keys or legislator_keys == self.OPENSTATES_BUCKET_SPLIT:
+            return None
+        legislators = self.cache_get_many(legislator_keys)
+        if not all(legislators):
+            return None
         return legislators
 
+    def _query_state_legislators(self, latitude, longitude):
+        return self.get_state_legislators_at([(latitude, longitude)])[0]
+
+    def get_state_legislators_at(self, points):
+        """
+        Looks up state legislators for many (latitude, longitude) points, in as few OpenStates requests as possible
+        @return  a list of legislators for each point
+        """
+        results = []
+        for people in self._openstates.people_at(points):
+            legislators = {}
+            for leg in people:
+                self._parse_state_legislator(leg)
+
+                # filter out non-state jurisdictions
+                # we only want (eg) ocd-jurisdiction/country:us/state:ca/government
+                if not ocd_field(leg.pop('jurisdiction') or '', 'state'):
+                    continue
+                legislators[leg['cache_key']] = leg
+
+            # save results individually in local cache
+            self.cache_set_many(with_target_records(legislators))
+            results.append(list(legislators.values()))
+        return results
+
+    def _parse_state_legislator(self, leg):
+        """ Flattens the current membership of an OpenStates person node """
+        membership = leg['chamber'][0]
+        post_division = membership['post']['division']['id']
+
+        leg['chamber'] = membership['organization']['classification']
+        leg['jurisdiction'] = membership['organization'].get('jurisdictionId')
+        leg['state'] = ocd_field(post_division, 'state').upper()
+        leg['district'] = membership['post']['label']
+        leg['division'] = post_division
+        leg['title'] = membership['post']['role']
+        leg['cache_key'] = self.KEY_OPENSTATES.format(id=leg['id'])
+        return leg
+
     def get_bioguide(self, bioguide):
         # try first to get from cache
         key = self.KEY_BIOGUIDE.format(bioguide_id=bioguide)
         return self.cache_get(key, list({}))
 
     def get_state_legid(self, ocd_id):
-        # try first to get from cache
-        key = self.KEY_OPENSTATES.format(id=ocd_id)
-        leg = self.cache_get(key, None)
-        
-        if not leg:
-            # or lookup from openstates and save
-            api_response = self._openstates.execute('''{
-                person(id:"%s") {
-                  id
-                  name
-                  givenName
-                  familyName
-                  chamber: currentMemberships(classification:["upper", "lower", "legislature"]) {
-                      post {
-                        label
-                        role
-                        division {
-                          id
-                        }
-                      }
-                      organization {
-                        name
-                        classification
-                      }
-                  }
-                  contactDetails {
-                    value
-                    note
-                    type
-                  }
-                }
-                }''' % ocd_id)
-            parsed_response = json.loads(api_response)
-            leg = parsed_response['data']['person']
-
-            chamber_classification = leg['chamber'][0]['organization']['classification']
-            district_label = leg['chamber'][0]['post']['label']
-            post_division = leg['chamber'][0]['post']['division']['id']
-            post_state = ocd_field(post_division, 'state').upper()
-            role_title = leg['chamber'][0]['post']['role']
-
-            leg['chamber'] = chamber_classification
-            leg['state'] = post_state
-            leg['district'] = district_label
-            leg['title'] = role_title
-
-            leg['cache_key'] = key
-            self.cache_set(key, leg)
-        return leg
+        return self.get_state_legids([ocd_id])[0]
 
-    def search_state_leg(self, state, chamber, name):
-        # first get the legislature chamber OCD ID
-        organization_response = self._openstates.execute('''
+    def get_state_legids(self, ocd_ids):
+        """
+        Gets state legislators by OCD person id, from cache or in batched OpenStates lookups
+        @return  a list of legislators in the same order, or None for ids OpenStates doesn't know
+        """
+        keys = [self.KEY_OPENSTATES.format(id=ocd_id) for ocd_id in ocd_ids]
+        legislators = self.cache_get_many(keys)
+
+        missing = [i for (i, leg) in enumerate(legislators) if not leg]
+        if missing:
+            # lookup from openstates and save
+            found = {}
+            for (i, leg) in zip(missing, self._openstates.people_by_id([ocd_ids[i] for i in missing])):
+                if leg:
+                    self._parse_state_legislator(leg)
+                    leg.pop('jurisdiction')
+                    leg['cache_key'] = keys[i]
+                    found[keys[i]] = leg
+                legislators[i] = leg
+            self.cache_set_many(with_target_records(found))
+        return legislators
+
+    def get_state_organization_id(self, state, chamber):
+        """ Returns the OCD organization id for a state legislature chamber, cached for the default timeout """
+        key = self.KEY_OPENSTATES_ORGANIZATION.format(state=state.lower(), chamber=chamber)
+        org_ocd_id = _local_organizations.get(key) or self._cache.get(key)
+        if not org_ocd_id:
+            org_ocd_id = _openstates_flights.do(key, lambda: self._query_state_organization_id(state, chamber))
+            self.cache_set(key, org_ocd_id)
+        _local_organizations.set(key, org_ocd_id)
+        return org_ocd_id
+
+    def _query_state_organization_id(self, state, chamber):
+        organization_parsed = self._openstates.execute('''
             query getOrganizationID($stateOCD:String, $chamber:String) {
               jurisdiction(id: $stateOCD) {
                 organizations(classification: [$chamber], first: 3) {
@@ -645,11 +789,26 @@ class USDataProvider(DataProvider):
             'stateOCD': 'ocd-jurisdiction/country:us/state:%s/government' % state.lower(),
             'chamber': chamber
         })
-        organization_parsed = json.loads(organization_response)
-        org_ocd_id = organization_parsed['data']['jurisdiction']['organizations']['edges'][0]['node']['id']
+        return organization_parsed['jurisdiction']['organizations']['edges'][0]['node']['id']
+
+    def search_state_leg(self, state, chamber, name):
+        """
+        Searches state legislators by name, for the campaign form
+        Results are cached for OPENSTATES_SEARCH_TIMEOUT, and concurrent identical searches share one request
+        """
+        key = self.KEY_OPENSTATES_SEARCH.format(state=state.lower(), chamber=chamber,
+                                                name=search_term(name or '').strip())
+        results = self._cache.get(key)
+        if results is None:
+            results = _openstates_flights.do(key, lambda: self._search_state_leg(key, state, chamber, name))
+        return results
+
+    def _search_state_leg(self, key, state, chamber, name):
+        # first get the legislature chamber OCD ID
+        org_ocd_id = self.get_state_organization_id(state, chamber)
 
         # now use that to query for members by name
-        person_response = self._openstates.execute('''
+        people_parsed = self._openstates.execute('''
             query getLegislatorContact($name: String, $organizationID: String, $chamber: String) {
               people(name: $name, memberOf: $organizationID, first: 5) {
                 edges {
@@ -681,9 +840,8 @@ class USDataProvider(DataProvider):
             'chamber': chamber,
             'name': name
         })
-        people_parsed = json.loads(person_response)
         result_data = []
-        for person_edge in people_parsed['data']['people']['edges']:
+        for person_edge in people_parsed['people']['edges']:
             person = person_edge['node']
             person['chamber'] = chamber
             person['district'] = person['currentMemberships'][0]['post']['label']
@@ -692,6 +850,7 @@ class USDataProvider(DataProvider):
             target['state'] = state.lower()
             target['phone'] = target.pop('number') # fix field name inconsistency...
             result_data.append(target)
+        self.cache_set(key, result_data, timeout=self.OPENSTATES_SEARCH_TIMEOUT)
         return result_data
 
     def get_uid(self, uid):
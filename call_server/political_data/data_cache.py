@@ -1,11 +1,30 @@
 from flask import current_app
 from ..extensions import cache
-from ..political_data.adapters import adapt_by_key
+from ..political_data.adapters import adapt_by_key, adapt_target, target_record_key, TARGET_KEY_PREFIXES
+from . import get_country_data
 from .countries.us import USDataProvider
+from .openstates import OpenStatesError
+
+
+def _copy_record(record):
+    # callers pop and modify the result
+    data = dict(record)
+    data['offices'] = [dict(o) for o in record['offices']]
+    return data
+
 
 def check_political_data_cache(key, cache=cache):
+    """
+    Target fields and offices for a political data key
+    Uses the adapted record stored next to the raw data when there is one, in a single cache fetch
+    """
     adapter = adapt_by_key(key)
     adapted_key, adapter_suffix = adapter.key(key)
+    if adapted_key.startswith(TARGET_KEY_PREFIXES):
+        record = cache.get(target_record_key(adapted_key))
+        if record:
+            return _copy_record(record)
+
     cached_obj = cache.get(adapted_key)
 
     if not cached_obj:
@@ -13,30 +32,67 @@ def check_political_data_cache(key, cache=cache):
         # but may be available over external APIs
         if adapted_key.startswith("us_state:openstates"):
             leg_id = key.split(':')[-1]
-            leg = USDataProvider(cache).get_state_legid(leg_id)
-            leg['cache_key'] = key
-            cache.set(key, leg)
+            try:
+                leg = get_country_data('us', cache=cache).get_state_legid(leg_id)
+            except OpenStatesError as e:
+                current_app.logger.error('Unable to look up %s: %s' % (key, e))
+                leg = None
+            if leg:
+                leg['cache_key'] = key
+                cache.set(key, leg)
             cached_obj = leg
 
-    if type(cached_obj) is list:
-        data = adapter.target(cached_obj[0])
-        offices = adapter.offices(cached_obj[0])
-    elif type(cached_obj) is dict:
-        data = adapter.target(cached_obj)
-        offices = adapter.offices(cached_obj)
+    data = adapt_target(key, cached_obj)
+    if data is not None:
+        if adapted_key.startswith(TARGET_KEY_PREFIXES):
+            # raw data cached before adapted records were, store one for next time
+            cache.set(target_record_key(adapted_key), _copy_record(data))
+        return data
+
+    if not key.startswith("custom"):
+        current_app.logger.error('Target.check_political_data_cache got unknown cached_obj type %s for key %s' % (type(cached_obj), key))
+    # do it live
+    if cached_obj:
+        data = cached_obj
     else:
-        if not key.startswith("custom"):
-            current_app.logger.error('Target.check_political_data_cache got unknown cached_obj type %s for key %s' % (type(cached_obj), key))
-        # do it live
-        if cached_obj:
-            data = cached_obj
-        else:
-            data = {}
-        try:
-            offices = cached_obj.get('offices', [])
-        except AttributeError:
-            offices = []
+        data = {}
+    try:
+        offices = cached_obj.get('offices', [])
+    except AttributeError:
+        offices = []
 
     data['key'] = adapted_key
     data['offices'] = offices
     return data
+
+
+def get_target_records(keys, cache=cache):
+    """
+    Adapted target records for many keys, in one cache fetch
+    Keys with an office suffix share the record of their adapted key, like check_political_data_cache
+    @return  dict of key to record, without keys that have no stored record
+    """
+    adapted_keys = {}
+    for key in set(keys):
+        if key:
+            adapted_key = adapt_by_key(key).key(key)[0]
+            if adapted_key.startswith(TARGET_KEY_PREFIXES):
+                adapted_keys[key] = adapted_key
+    if not adapted_keys:
+        return {}
+    unique_keys = list(set(adapted_keys.values()))
+    records = dict(zip(unique_keys, cache.get_many(*[target_record_key(key) for key in unique_keys])))
+    return dict((key, _copy_record(records[adapted_key]))
+                for (key, adapted_key) in adapted_keys.items() if records[adapted_key])
+
+
+def warm_political_data_cache(keys, cache=cache):
+    """
+    Fetches uncached state legislators for many target keys in batched OpenStates requests,
+    so check_political_data_cache finds them in the cache
+    """
+    prefix = USDataProvider.KEY_OPENSTATES.format(id='')
+    leg_ids = [key.split(':')[-1] for key in keys if key.startswith(prefix)]
+    if leg_ids:
+        get_country_data('us', cache=cache).get_state_legids(leg_ids)
+    return len(leg_ids)
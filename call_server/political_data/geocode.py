@@ -1,13 +1,32 @@
 import geopy
 import os
+import time
 
 from .constants import US_STATE_NAME_DICT, CA_PROVINCE_NAME_DICT
+from ..utils import LRUCache
 
 GOOGLE_SERVICE = 'GoogleV3'
 SMARTYSTREETS_SERVICE = 'LiveAddress'
 SMARTYSTEETS_ZIPCODE_SERVICE = 'SmartyStreetsUSZipcode'
 NOMINATIM_SERVICE = 'Nominatim'
 LOCAL_USDATA_SERVICE = 'LocalUSDataProvider'
+LOCAL_CADATA_SERVICE = 'LocalCADataProvider'
+CACHED_GEOCODE_SERVICE = 'CachedGeocoder'
+
+GEOCODE_CACHE_KEY = 'geocode:{provider}:{country}:{method}:{query}'
+# keep results as long as each provider's terms allow
+GEOCODE_CACHE_TIMEOUTS = {
+    GOOGLE_SERVICE: 60*60*24*30,
+    SMARTYSTREETS_SERVICE: 60*60*24*90,
+    NOMINATIM_SERVICE: 60*60*24*90,
+}
+GEOCODE_CACHE_DEFAULT_TIMEOUT = 60*60*24*30
+# remember lookups without results briefly, so repeated typos don't reach the provider
+GEOCODE_NEGATIVE_TIMEOUT = 60*60
+GEOCODE_NO_RESULT = ()
+# per-process tier in front of the shared cache
+GEOCODE_LOCAL_TIMEOUT = 60*60
+_local_geocodes = LRUCache(10000)
 
 class Location(geopy.Location):
     """
@@ -136,13 +155,37 @@ class Location(geopy.Location):
 class LocationError(TypeError):
     pass
 
+
+def normalize_query(query):
+    """ Lowercase and collapse whitespace in text queries, round lat/lon to about a meter """
+    if isinstance(query, (tuple, list)):
+        return ','.join('%.5f' % float(c) for c in query)
+    return ' '.join(str(query).lower().split())
+
+
+def dump_location(location):
+    """ Compact cache record for a Location, with only the fields we read from it """
+    if not (location.latitude or location.longitude or location.raw):
+        return GEOCODE_NO_RESULT
+    return (location.address, location.latitude, location.longitude, location.state, location.postal)
+
+
+def load_location(record):
+    if record == GEOCODE_NO_RESULT:
+        location = Location()
+    else:
+        (address, latitude, longitude, state, postal) = record
+        location = Location(address, (latitude, longitude), {'state': state, 'zipcode': postal})
+    location.service = CACHED_GEOCODE_SERVICE
+    return location
+
 class Geocoder(object):
     """
     a light wrapper around the geopy client
     with configurable service name
     """
 
-    def __init__(self, API_NAME=None, API_KEY=None, country='US'):
+    def __init__(self, API_NAME=None, API_KEY=None, country='US', cache=None):
         if not (API_NAME or API_KEY):
             # get keys from os.environ, because we may not have current_app context
             API_NAME = os.environ.get('GEOCODE_PROVIDER', 'nominatim').lower()  # default to the FOSS provider
@@ -150,6 +193,7 @@ class Geocoder(object):
 
         service = geopy.geocoders.get_geocoder_for_service(API_NAME)
         self.country = country
+        self.cache = cache
 
         if API_NAME == 'nominatim':
                 # nominatim sets country bias at init
@@ -170,6 +214,43 @@ class Geocoder(object):
         "returns geopy.geocoder class name, like GoogleV3, LiveAddress, Nominatim, etc"
         return self.client.__class__.__name__.split('.')[-1]
 
+    def _cached(self, method, query, lookup):
+        """
+        Returns a cached Location for the normalized query, or calls lookup and caches the result
+        Checks the per-process tier first, then the shared cache
+        Lookups without results are cached for GEOCODE_NEGATIVE_TIMEOUT, timeouts are not cached
+        """
+        service = self.get_service_name()
+        key = GEOCODE_CACHE_KEY.format(provider=service, country=self.country,
+                                       method=method, query=normalize_query(query))
+        now = time.time()
+        local = _local_geocodes.get(key)
+        if local and local[0] > now:
+            return load_location(local[1])
+
+        record = self.cache.get(key) if self.cache is not None else None
+        if record is not None:
+            timeout = GEOCODE_LOCAL_TIMEOUT
+            result = load_location(record)
+        else:
+            result = lookup()
+            if result.service == 'Timeout':
+                return result
+            record = dump_location(result)
+            if record == GEOCODE_NO_RESULT:
+                timeout = GEOCODE_NEGATIVE_TIMEOUT
+            else:
+                timeout = GEOCODE_CACHE_TIMEOUTS.get(service, GEOCODE_CACHE_DEFAULT_TIMEOUT)
+
+            if hasattr(self.cache, 'set'):
+                self.cache.set(key, record, timeout=timeout)
+            elif self.cache is not None:
+                # mock-dictionary, without timeouts
+                self.cache[key] = record
+
+        _local_geocodes.set(key, (now + min(timeout, GEOCODE_LOCAL_TIMEOUT), record))
+        return result
+
     def postal(self, code, country='us', provider=None):
         if provider and country == 'us':
             districts = provider.get_districts(code)
@@ -183,11 +264,14 @@ class Geocoder(object):
         return self.geocode(code, postal_only=True)
 
     def geocode(self, address, postal_only=False):
-        service = self.get_service_name()
-
         if not address:
             raise LocationError('empty string passed to geocoder')
-            return None
+
+        method = 'postal' if postal_only else 'address'
+        return self._cached(method, address, lambda: self._geocode(address, postal_only))
+
+    def _geocode(self, address, postal_only=False):
+        service = self.get_service_name()
 
         try:
             if service == GOOGLE_SERVICE:
@@ -235,6 +319,9 @@ class Geocoder(object):
                 (lat, lon) = latlon.split(',')
             except ValueError:
                 raise ValueError('unable to parse latlon as either tuple or comma delimited string')
+        return self._cached('reverse', (lat, lon), lambda: self._reverse(lat, lon))
+
+    def _reverse(self, lat, lon):
         located = Location(self.client.reverse((lat, lon)))
         located.service = self.get_service_name()
         return located
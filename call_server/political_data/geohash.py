@@ -0,0 +1,57 @@
+"""
+Minimal geohash encoding, for bucketing lat/lon lookups in the cache
+
+At precision 6 a cell is about 1.2km x 0.6km, 5 is about 4.9km x 4.9km
+"""
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_cell(latitude, longitude, precision):
+    """
+    Returns the geohash of the cell containing a point,
+    and the cell bounds as (lat_min, lat_max, lon_min, lon_max)
+    """
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    chars = []
+    bits = 0
+    n_bits = 0
+    even = True  # geohash bits alternate, starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lon_min + lon_max) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_min = mid
+            else:
+                bits = bits << 1
+                lon_max = mid
+        else:
+            mid = (lat_min + lat_max) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_min = mid
+            else:
+                bits = bits << 1
+                lat_max = mid
+        even = not even
+        n_bits += 1
+        if n_bits == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            n_bits = 0
+    return ''.join(chars), (lat_min, lat_max, lon_min, lon_max)
+
+
+def geohash_encode(latitude, longitude, precision):
+    return geohash_cell(latitude, longitude, precision)[0]
+
+
+def near_cell_edge(latitude, longitude, bounds, margin=0.1):
+    """ True if a point is within margin (as a fraction of cell size) of its cell boundary """
+    (lat_min, lat_max, lon_min, lon_max) = bounds
+    lat_margin = (lat_max - lat_min) * margin
+    lon_margin = (lon_max - lon_min) * margin
+    return (latitude - lat_min < lat_margin or lat_max - latitude < lat_margin or
+            longitude - lon_min < lon_margin or lon_max - longitude < lon_margin)
@@ -3,16 +3,49 @@ from collections import OrderedDict
 import random
 
 from ..extensions import cache
+from ..utils import LRUCache
 from ..campaign.constants import (SEGMENT_BY_LOCATION,
     INCLUDE_SPECIAL_BEFORE, INCLUDE_SPECIAL_AFTER,
     INCLUDE_SPECIAL_ONLY, INCLUDE_SPECIAL_FIRST, INCLUDE_SPECIAL_FALLBACK,
 )
+from . import get_data_version
+
+TARGETS_KEY = 'political_data:targets:{campaign_id}:{campaign_version}:{data_version}:{location}'
+TARGETS_TIMEOUT = 60*60*24
+TARGETS_LRU_SIZE = 4096
+
+_local_targets = LRUCache(maxsize=TARGETS_LRU_SIZE)
 
 def validate_location(location, campaign, cache=cache):
     campaign_data = campaign.get_campaign_data(cache)
     validated_location = campaign_data.data_provider.get_location(campaign.locate_by, location)
     return validated_location
 
+def normalize_location(location):
+    return ''.join(str(location).split()).upper()
+
+def get_all_targets(location, campaign, campaign_data, cache=cache):
+    """
+    Memoized campaign_data.all_targets_for_campaign, keyed by campaign id and version,
+    political data version and normalized location.
+    Stores the unshuffled lists, so each caller still gets their own ordering from sort_targets.
+    Only campaign snapshots have a version, other campaign objects are not memoized.
+    """
+    campaign_version = getattr(campaign, 'version', None)
+    if not campaign_version or not isinstance(location, str):
+        return campaign_data.all_targets_for_campaign(location, campaign)
+
+    key = TARGETS_KEY.format(campaign_id=campaign.id, campaign_version=campaign_version,
+                             data_version=get_data_version(cache), location=normalize_location(location))
+    all_targets = _local_targets.get(key)
+    if all_targets is None:
+        all_targets = cache.get(key)
+        if all_targets is None:
+            all_targets = campaign_data.all_targets_for_campaign(location, campaign)
+            cache.set(key, all_targets, timeout=TARGETS_TIMEOUT)
+        _local_targets.set(key, all_targets)
+    return all_targets
+
 def locate_targets(location, campaign, skip_special=False, cache=cache):
     """
     Convenience method to get targets for location in a given campaign.
@@ -26,7 +59,8 @@ def locate_targets(location, campaign, skip_special=False, cache=cache):
         return []
 
     campaign_data = campaign.get_campaign_data(cache)
-    location_targets = campaign_data.get_targets_for_campaign(location, campaign)
+    all_targets = get_all_targets(location, campaign, campaign_data, cache)
+    location_targets = campaign_data.get_targets_for_campaign(location, campaign, all_targets)
     special_targets = [t.key for t in campaign.target_set]
 
     if skip_special:
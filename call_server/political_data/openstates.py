@@ -0,0 +1,183 @@
+"""
+OpenStates GraphQL client
+
+Shares one keep-alive requests session per process, with connect and read timeouts,
+and retries connection errors, rate limits and server errors with jittered exponential backoff,
+within a time budget that is shorter while answering a web request.
+After retries run out, lookups fail right away for OPENSTATES_COOLDOWN.
+Many person(id) or people(lat, lon) lookups are combined into one GraphQL document with aliases.
+"""
+import json
+import os
+import random
+import threading
+import time
+import logging
+
+import requests
+from flask import has_request_context
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+OPENSTATES_URL = 'https://open.pluralpolicy.com/graphql'
+OPENSTATES_TIMEOUT = (3.05, 10)  # connect, read
+OPENSTATES_RETRIES = 3
+OPENSTATES_BACKOFF = 0.5  # seconds, doubled each retry
+OPENSTATES_MAX_BACKOFF = 10
+OPENSTATES_MAX_TIME = 60  # seconds for a lookup, including retries
+OPENSTATES_REQUEST_MAX_TIME = 6  # within a web request, well under the Twilio webhook timeout of 15s
+OPENSTATES_COOLDOWN = 30  # seconds to fail fast after retries run out
+OPENSTATES_BATCH_SIZE = 25  # aliased lookups per request
+OPENSTATES_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# fields for state legislators, shared by person and people lookups
+LEGISLATOR_FRAGMENT = '''
+fragment LegislatorFields on Person {
+  id
+  name
+  givenName
+  familyName
+  chamber: currentMemberships(classification:["upper", "lower", "legislature"]) {
+    post {
+      label
+      role
+      division {
+        id
+      }
+    }
+    organization {
+      name
+      classification
+      jurisdictionId
+    }
+  }
+  contactDetails {
+    value
+    note
+    type
+  }
+}
+'''
+
+
+class OpenStatesError(Exception):
+    pass
+
+
+class OpenStatesClient(object):
+
+    def __init__(self, api_key=None, url=OPENSTATES_URL, timeout=OPENSTATES_TIMEOUT,
+                 retries=OPENSTATES_RETRIES, backoff=OPENSTATES_BACKOFF, pool_size=10):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._unavailable_until = 0
+
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({'Content-Type': 'application/json', 'Accept': 'application/json'})
+        if api_key:
+            self.session.headers['x-api-key'] = api_key
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            delay = retry_after
+        else:
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        return min(delay, OPENSTATES_MAX_BACKOFF)
+
+    def _sleep(self, delay):
+        time.sleep(delay)
+
+    def _unavailable(self, message):
+        self._unavailable_until = time.time() + OPENSTATES_COOLDOWN
+        return OpenStatesError(message)
+
+    def execute(self, query, variables=None, max_time=None):
+        """
+        Posts a GraphQL query, retrying transient failures for up to max_time seconds
+        @return  the response data, or raises OpenStatesError
+        """
+        if time.time() < self._unavailable_until:
+            raise OpenStatesError('OpenStates unavailable, not retrying yet')
+        if max_time is None:
+            max_time = OPENSTATES_REQUEST_MAX_TIME if has_request_context() else OPENSTATES_MAX_TIME
+        deadline = time.time() + max_time
+
+        payload = json.dumps({'query': query, 'variables': variables or {}})
+        for attempt in range(self.retries + 1):
+            remaining = max(deadline - time.time(), 0.1)
+            timeout = tuple(min(t, remaining) for t in self.timeout)
+            try:
+                response = self.session.post(self.url, data=payload, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self._delay(attempt)
+                if attempt == self.retries or time.time() + delay >= deadline:
+                    raise self._unavailable('OpenStates request failed: %s' % e)
+                log.info('OpenStates request failed, retrying: %s' % e)
+                self._sleep(delay)
+                continue
+
+            if response.status_code in OPENSTATES_RETRY_STATUS:
+                retry_after = response.headers.get('Retry-After')
+                delay = self._delay(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                if attempt == self.retries or time.time() + delay >= deadline:
+                    raise self._unavailable('OpenStates returned %s: %s' % (response.status_code, response.text[:200]))
+                log.info('OpenStates returned %s, retrying' % response.status_code)
+                self._sleep(delay)
+                continue
+            if response.status_code != 200:
+                raise OpenStatesError('OpenStates returned %s: %s' % (response.status_code, response.text[:200]))
+
+            parsed = response.json()
+            if parsed.get('errors') and not parsed.get('data'):
+                raise OpenStatesError('OpenStates query error: %s' % parsed['errors'])
+            return parsed['data']
+
+    def _execute_aliased(self, fields, batch_size=OPENSTATES_BATCH_SIZE):
+        """
+        Runs aliased lookups in as few requests as possible
+        fields is a list of GraphQL field expressions, returns their results in order
+        """
+        results = []
+        for i in range(0, len(fields), batch_size):
+            batch = fields[i:i+batch_size]
+            query = '{\n%s\n}\n%s' % ('\n'.join('a%d: %s' % (n, f) for (n, f) in enumerate(batch)),
+                                      LEGISLATOR_FRAGMENT)
+            data = self.execute(query)
+            results.extend(data.get('a%d' % n) for n in range(len(batch)))
+        return results
+
+    def people_by_id(self, ocd_ids):
+        """ Looks up legislators by OCD person id, returns a list of person nodes or None in the same order """
+        fields = ['person(id: %s) { ...LegislatorFields }' % json.dumps(ocd_id) for ocd_id in ocd_ids]
+        return self._execute_aliased(fields)
+
+    def people_at(self, points):
+        """ Looks up legislators for (latitude, longitude) points, returns a list of person nodes for each point """
+        fields = ['people(latitude: %f, longitude: %f, first: 100) { edges { node { ...LegislatorFields } } }'
+                  % (latitude, longitude) for (latitude, longitude) in points]
+        return [[edge['node'] for edge in (result or {}).get('edges', [])]
+                for result in self._execute_aliased(fields)]
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_openstates_client():
+    """
+    Returns the process-wide OpenStatesClient, so connections are reused across requests
+    A new client is built if OPENSTATES_API_KEY changes
+    """
+    global _client, _client_key
+    api_key = os.environ.get('OPENSTATES_API_KEY')
+    if _client is None or _client_key != api_key:
+        with _client_lock:
+            if _client is None or _client_key != api_key:
+                _client = OpenStatesClient(api_key=api_key)
+                _client_key = api_key
+    return _client
@@ -0,0 +1,96 @@
+"""
+Versioned, checksummed binary snapshots of parsed political data sources.
+
+Parsing the US congress yaml and district csv takes several seconds, which we pay on
+every `flask loadpoliticaldata`. Instead we compile the parsed result once into a file with
+a fixed struct header and a pickled payload, and reuse it until the source files change.
+
+Header layout (little-endian):
+    magic (4s), format version (H), reserved (H), payload length (Q),
+    sha256 of sources (32s), sha256 of payload (32s)
+"""
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import logging
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CPDS'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHHQ32s32s')
+
+
+def sources_digest(paths, salt=''):
+    """ sha256 over the names and contents of the source files, plus an optional salt """
+    digest = hashlib.sha256(salt.encode('utf-8'))
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def write_snapshot(path, data, digest):
+    """ Writes data to a snapshot file, atomically replacing any existing one """
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, 0, len(payload),
+                                  digest, hashlib.sha256(payload).digest())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return len(header) + len(payload)
+
+
+def read_snapshot(path, digest):
+    """
+    Reads data from a memory-mapped snapshot file.
+    Returns None if the file is missing, was built from other sources, or fails its checksum.
+    """
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    with f:
+        if os.fstat(f.fileno()).st_size < SNAPSHOT_HEADER.size:
+            log.warning('political data snapshot %s is truncated' % path)
+            return None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            (magic, version, _, length, source_digest, checksum) = SNAPSHOT_HEADER.unpack_from(mm, 0)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+                log.info('political data snapshot %s has an unknown format' % path)
+                return None
+            if source_digest != digest:
+                log.info('political data snapshot %s is stale' % path)
+                return None
+
+            payload = mm[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size+length]
+            if len(payload) != length or hashlib.sha256(payload).digest() != checksum:
+                log.warning('political data snapshot %s failed checksum' % path)
+                return None
+            return pickle.loads(payload)
+
+
+def load_snapshot(path, sources, build, salt='', force=False):
+    """
+    Returns data from the snapshot at path if it is fresh for the sources,
+    otherwise calls build() and writes a new snapshot.
+    """
+    digest = sources_digest(sources, salt)
+    data = None if force else read_snapshot(path, digest)
+    if data is None:
+        data = build()
+        try:
+            size = write_snapshot(path, data, digest)
+            log.info('wrote political data snapshot %s (%d bytes)' % (path, size))
+        except (IOError, OSError) as e:
+            # read-only filesystems can still load from the sources
+            log.warning('unable to write political data snapshot %s: %s' % (path, e))
+    return data
@@ -0,0 +1,137 @@
+"""
+Streaming reader for large YAML sequences, like the congress-legislators files
+
+Walks parser events one top level item at a time, tracking the key path of each scalar,
+so items can be filtered on a nested value before any Python objects are built for them.
+Kept items are composed and constructed from their buffered events, skipped items are dropped.
+"""
+import collections
+import sys
+
+import yaml
+from yaml.composer import Composer
+from yaml.constructor import Constructor
+from yaml.resolver import Resolver
+from yaml.events import (AliasEvent, CollectionStartEvent, CollectionEndEvent,
+                         MappingStartEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent)
+
+try:
+    from yaml import CLoader as yamlLoader
+except ImportError:
+    from yaml import Loader as yamlLoader
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+class _EventConstructor(Composer, Constructor, Resolver):
+    """ Builds one node from a list of buffered events """
+
+    def __init__(self, events):
+        self._events = collections.deque(events)
+        Composer.__init__(self)
+        Constructor.__init__(self)
+        Resolver.__init__(self)
+
+    def check_event(self, *choices):
+        if not self._events:
+            return False
+        return not choices or isinstance(self._events[0], choices)
+
+    def peek_event(self):
+        return self._events[0]
+
+    def get_event(self):
+        return self._events.popleft()
+
+    def construct(self):
+        return self.construct_document(self.compose_node(None, None))
+
+
+class _Frame(object):
+    __slots__ = ['is_mapping', 'expecting_key', 'key', 'is_key']
+
+    def __init__(self, is_mapping, is_key):
+        self.is_mapping = is_mapping
+        self.expecting_key = True
+        self.key = None
+        self.is_key = is_key
+
+
+def iter_yaml_sequence(stream, select=None, keep=None, Loader=yamlLoader):
+    """
+    Yields the items of a top level YAML sequence, one at a time
+    select is a path of mapping keys, with '*' for any sequence item, like ('terms', '*', 'start')
+    keep is called with the last scalar value found at that path in each item (or None),
+    and items it rejects are skipped without being constructed
+    """
+    in_sequence = False
+    frames = []
+    events = []
+    selected = None
+
+    for event in yaml.parse(stream, Loader=Loader):
+        if not frames:
+            if not in_sequence:
+                in_sequence = isinstance(event, SequenceStartEvent)
+                continue
+            if isinstance(event, SequenceEndEvent):
+                in_sequence = False
+                continue
+            if isinstance(event, (ScalarEvent, AliasEvent)):
+                if keep is None or keep(None):
+                    yield _EventConstructor([event]).construct()
+                continue
+            # start of an item
+            events = [event]
+            selected = None
+            frames.append(_Frame(isinstance(event, MappingStartEvent), False))
+            continue
+
+        events.append(event)
+        parent = frames[-1]
+
+        if isinstance(event, CollectionEndEvent):
+            frame = frames.pop()
+            if not frames:
+                if keep is None or keep(selected):
+                    yield _EventConstructor(events).construct()
+                events = []
+                continue
+            parent = frames[-1]
+            if parent.is_mapping:
+                parent.expecting_key = not frame.is_key
+            continue
+
+        is_key = parent.is_mapping and parent.expecting_key
+        if isinstance(event, CollectionStartEvent):
+            if is_key:
+                parent.key = None
+            frames.append(_Frame(isinstance(event, MappingStartEvent), is_key))
+            continue
+
+        # scalar or alias
+        if is_key:
+            parent.key = event.value if isinstance(event, ScalarEvent) else None
+            parent.expecting_key = False
+        else:
+            if parent.is_mapping:
+                parent.expecting_key = True
+            if select and isinstance(event, ScalarEvent) and len(frames) == len(select):
+                path = tuple(f.key if f.is_mapping else '*' for f in frames)
+                if path == select:
+                    selected = event.value
+
+
+def peak_rss():
+    """ Peak resident set size of this process in whole megabytes, or None if unknown """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    if sys.platform == 'darwin':
+        return peak // (1024 * 1024)
+    return peak // 1024
@@ -0,0 +1,159 @@
+"""
+Memory-mapped zipcode to congressional district index, built from us_districts.csv
+
+Holds sorted parallel arrays of zipcode (uint32), state id (uint8) and district (uint8),
+looked up by binary search. The file is opened read-only with mmap, so worker processes
+share the same pages and a lookup needs no network round trip or unpickling.
+
+File layout (little-endian):
+    header: magic (4s), format version (H), state count (H), row count (I), sha256 of source csv (32s)
+    state table: 2 ascii bytes per state
+    zipcodes: uint32 * rows
+    states: uint8 * rows
+    districts: uint8 * rows
+"""
+import bisect
+import csv
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import logging
+
+from .snapshot import sources_digest
+
+log = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'CPZI'
+INDEX_FORMAT = 1
+INDEX_HEADER = struct.Struct('<4sHHI32s')
+
+DISTRICTS_CSV = 'call_server/political_data/data/us_districts.csv'
+# built at runtime, so kept out of the source tree
+DISTRICTS_INDEX = os.path.join(tempfile.gettempdir(), 'call-power', 'us_districts.snapshot')
+INDEX_RETRY_INTERVAL = 60  # seconds before trying again to open or build a failed index
+
+
+class ZipcodeIndex(object):
+
+    def __init__(self, mm):
+        self._mm = mm
+        (magic, version, n_states, n_rows, digest) = INDEX_HEADER.unpack_from(mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_FORMAT:
+            raise ValueError('unknown zipcode index format')
+        self.digest = digest
+
+        offset = INDEX_HEADER.size
+        table = mm[offset:offset + 2*n_states].decode('ascii')
+        self.states = [table[i:i+2] for i in range(0, len(table), 2)]
+        offset += 2*n_states
+
+        view = memoryview(mm)
+        self.zipcodes = view[offset:offset + 4*n_rows].cast('I')
+        offset += 4*n_rows
+        self.state_ids = view[offset:offset + n_rows]
+        offset += n_rows
+        self.districts = view[offset:offset + n_rows]
+
+    def __len__(self):
+        return len(self.zipcodes)
+
+    def get(self, zipcode):
+        """
+        Returns a list of districts for a zipcode, in the same format as the cached us:zipcode keys
+        eg [{'state':'CA', 'zipcode': '94612', 'house_district': '13'}]
+        """
+        try:
+            zip_int = int(zipcode)
+        except (TypeError, ValueError):
+            return []
+
+        result = []
+        i = bisect.bisect_left(self.zipcodes, zip_int)
+        while i < len(self.zipcodes) and self.zipcodes[i] == zip_int:
+            result.append({
+                'state': self.states[self.state_ids[i]],
+                'zipcode': '%05d' % zip_int,
+                'house_district': str(self.districts[i])
+            })
+            i += 1
+        return result
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mm)
+
+    @staticmethod
+    def build(csv_path, path):
+        """ Compiles the districts csv into an index file, atomically replacing any existing one """
+        rows = []
+        states = []
+        with open(csv_path) as f:
+            for row in csv.DictReader(f):
+                if row['state_abbr'] not in states:
+                    states.append(row['state_abbr'])
+                rows.append((int(row['zcta']), states.index(row['state_abbr']), int(row['cd'])))
+        # stable sort, so districts for a zipcode stay in csv order
+        rows.sort(key=lambda r: r[0])
+
+        n = len(rows)
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        # per process, so workers building at the same time don't write the same file
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, len(states), n, sources_digest([csv_path])))
+            f.write(''.join(states).encode('ascii'))
+            f.write(struct.pack('<%dI' % n, *[r[0] for r in rows]))
+            f.write(bytes(r[1] for r in rows))
+            f.write(bytes(r[2] for r in rows))
+        os.replace(tmp_path, path)
+        return n
+
+
+_index = None
+_index_failed = None  # time of the last failure
+_index_lock = threading.Lock()
+
+
+def _recently_failed():
+    return _index_failed is not None and time.time() - _index_failed < INDEX_RETRY_INTERVAL
+
+
+def get_zipcode_index(csv_path=DISTRICTS_CSV, path=DISTRICTS_INDEX):
+    """
+    Returns the process-wide ZipcodeIndex, opening it on first use
+    Builds the index if it is missing or older than the csv
+    Returns None if it can't be opened or built, so callers fall back to the cache
+    """
+    global _index, _index_failed
+    if _index is not None or _recently_failed():
+        return _index
+
+    with _index_lock:
+        if _index is None and not _recently_failed():
+            try:
+                index = ZipcodeIndex.open(path) if os.path.exists(path) else None
+                if index is None or index.digest != sources_digest([csv_path]):
+                    ZipcodeIndex.build(csv_path, path)
+                    index = ZipcodeIndex.open(path)
+                _index = index
+                _index_failed = None
+            except (IOError, OSError, ValueError, struct.error) as e:
+                # don't retry on every lookup
+                log.warning('unable to open zipcode index %s: %s' % (path, e))
+                _index_failed = time.time()
+    return _index
+
+
+def reset_zipcode_index():
+    """ Drops the process-wide index, so it is reopened or rebuilt on next use """
+    global _index, _index_failed
+    with _index_lock:
+        _index = None
+        _index_failed = None
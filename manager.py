@@ -35,7 +35,12 @@ def runserver(external=None):
     sys.exit(-1)
 
 @app.cli.command()
-def loadpoliticaldata():
+@click.option('--force', is_flag=True, help='Rewrite all keys, not just those changed since the last load')
+@click.option('--state-boundaries', multiple=True, type=click.Path(exists=True),
+              help='State legislative district boundaries, as GeoJSON or shapefile, to locate districts locally')
+@click.option('--ca-postal-ridings', type=click.Path(exists=True),
+              help='Canadian postal codes and FSAs with their riding, as csv, to locate callers without OpenNorth')
+def loadpoliticaldata(force, state_boundaries, ca_postal_ridings):
     """Load political data into persistent cache"""
     # try:
     #     import gevent.monkey
@@ -44,10 +49,34 @@ def loadpoliticaldata():
     #     app.logger.warning("unable to apply gevent monkey.patch_thread")
     from flask_babel import force_locale
 
+    if state_boundaries:
+        from call_server.political_data.boundaries import load_state_boundaries
+        app.logger.info("loading state legislative district boundaries")
+        n = load_state_boundaries(state_boundaries)
+        app.logger.info("done indexing %d districts" % n)
+
     app.logger.info("loading political data")
     with app.app_context(), force_locale('en'):
-            n = political_data.load_data(cache)
-    app.logger.info("done loading %d objects" % n)
+            counts = political_data.load_data(cache, force=force)
+    app.logger.info("done loading %d objects: %d added, %d changed, %d removed" % (
+        counts['loaded'], counts['added'], counts['changed'], counts['removed']))
+
+    if ca_postal_ridings:
+        from call_server.political_data.countries.ca import CADataProvider
+        app.logger.info("loading canadian postal code ridings")
+        with app.app_context():
+            n = CADataProvider(cache).load_postal_ridings(ca_postal_ridings)
+        app.logger.info("done loading %d postal codes" % n)
+
+@app.cli.command()
+def compilepoliticaldata():
+    """Compile political data sources into a binary snapshot, for faster loading"""
+    from call_server.political_data.countries.us import USDataProvider
+
+    app.logger.info("compiling political data")
+    with app.app_context():
+        data = USDataProvider(cache).compile_data(force=True)
+    app.logger.info("done compiling %d objects" % sum(len(v) for v in data.values()))
 
 @app.cli.command()
 @click.argument('campaign_id')
@@ -117,10 +146,18 @@ def crmsync(campaigns):
         campaigns_list = (campaigns,)
     sync.jobs.sync_campaigns(campaigns_list)
 
+@app.cli.command()
+def flushcalllog():
+    """Write calls logged to the redis stream to the database, without waiting for the rq worker"""
+    from call_server.call.write_behind import flush_call_log
+    print("Wrote %s calls" % flush_call_log())
+
 @app.cli.command()
 @click.argument('campaign_id')
 def fixtargets(campaign_id):
     from call_server.campaign import Campaign, Target, CampaignTarget
+    from call_server.campaign.snapshot import invalidate_campaign_snapshot
+    from call_server.political_data.data_cache import warm_political_data_cache
     from call_server.utils import parse_target
 
     print("Fixing duplicate campaign targets")
@@ -133,6 +170,7 @@ def fixtargets(campaign_id):
     CampaignTarget.query.filter_by(campaign=campaign).delete()
 
     # recreate from set
+    warm_political_data_cache(target_set)
     target_list = []
     for index,target_key in enumerate(list(target_set)):
         # split prefix:uid
@@ -146,6 +184,7 @@ def fixtargets(campaign_id):
     setattr(campaign, 'target_set', target_list)
     db.session.add(campaign)
     db.session.commit()
+    invalidate_campaign_snapshot(campaign.id)
 
 @app.cli.command()
 def redis_clear():
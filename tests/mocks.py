@@ -0,0 +1,114 @@
+"""
+Test doubles shared by the test modules
+"""
+import collections
+import threading
+
+
+class CountingCache(object):
+    """Wraps a mock cache dict, counting round trips, and reads among them"""
+
+    def __init__(self, data=None):
+        self.data = {} if data is None else data
+        self.round_trips = 0
+        self.reads = 0
+
+    def get(self, key):
+        self.round_trips += 1
+        self.reads += 1
+        return self.data.get(key)
+
+    def get_many(self, *keys):
+        self.round_trips += 1
+        self.reads += 1
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        self.round_trips += 1
+        self.data[key] = value
+
+    def set_many(self, mapping, timeout=None):
+        self.round_trips += 1
+        self.data.update(mapping)
+
+
+class MockRedis(object):
+    """Just enough of a redis connection for streams, sorted set counters, keys and a lock"""
+
+    def __init__(self):
+        self.streams = collections.defaultdict(list)
+        self.zsets = {}
+        self.keys = {}
+        self.round_trips = 0
+        self.lock_held = threading.Lock()
+
+    def pipeline(self, transaction=True):
+        return MockPipeline(self)
+
+    def xadd(self, name, fields):
+        stream = self.streams[name]
+        entry_id = ('%d-0' % (len(stream) + 1)).encode('ascii')
+        stream.append((entry_id, dict((k.encode('ascii'), v if isinstance(v, bytes) else v.encode('utf-8'))
+                                      for (k, v) in fields.items())))
+        return entry_id
+
+    def xrange(self, name, count=None):
+        self.round_trips += 1
+        return self.streams[name][:count]
+
+    def xdel(self, name, *ids):
+        self.streams[name] = [e for e in self.streams[name] if e[0] not in ids]
+
+    def xlen(self, name):
+        return len(self.streams[name])
+
+    def zincrby(self, name, amount, value):
+        zset = self.zsets.setdefault(name, {})
+        zset[value] = zset.get(value, 0) + float(amount)
+        return zset[value]
+
+    def zscore(self, name, value):
+        return self.zsets.get(name, {}).get(value)
+
+    def zrevrange(self, name, start, end, withscores=False):
+        ranked = sorted(self.zsets.get(name, {}).items(), key=lambda item: item[1], reverse=True)
+        return [(value.encode('utf-8'), score) for (value, score) in ranked[start:end + 1]]
+
+    def expire(self, name, seconds):
+        return True
+
+    def set(self, name, value, nx=False, ex=None):
+        if nx and name in self.keys:
+            return None
+        self.keys[name] = value
+        return True
+
+    def delete(self, name):
+        self.keys.pop(name, None)
+
+    def lock(self, name, timeout=None):
+        return MockLock(self.lock_held)
+
+
+class MockPipeline(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def __getattr__(self, command):
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    def execute(self):
+        self.connection.round_trips += 1
+        return [getattr(self.connection, c)(*args, **kwargs) for (c, args, kwargs) in self.commands]
+
+
+class MockLock(object):
+    def __init__(self, lock):
+        self.lock = lock
+
+    def acquire(self, blocking=True):
+        return self.lock.acquire(blocking)
+
+    def release(self):
+        self.lock.release()
@@ -1,11 +1,18 @@
+import ipaddress
 import logging
+import time
 from datetime import datetime, timedelta
 
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+
 from .run import BaseTestCase
 
 from call_server.utils import utc_now
 from call_server.extensions import db
 from call_server.admin.models import Blocklist
+from call_server.admin.blocklist import get_compiled_blocklist, flush_blocklist_hits, NetworkTree
+from call_server.admin.forms import BlocklistForm
 
 
 class TestBlocklist(BaseTestCase):
@@ -163,3 +170,142 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
         self.assertEqual(b.hits, 1)
+
+
+class TestCompiledBlocklist(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCompiledBlocklist, self).setUp(**kwargs)
+        self.user_phone = '510-867-5309'
+        self.user_ip = '18.123.45.78'
+        self.block = Blocklist(phone_number=self.user_phone)
+        db.session.add(self.block)
+        db.session.commit()
+
+        self.app.config['BLOCKLIST_HITS_FLUSH_INTERVAL'] = 60
+        self.scheduled = []
+        self.original_schedule = flush_blocklist_hits.schedule
+        flush_blocklist_hits.schedule = lambda *args, **kwargs: self.scheduled.append(args)
+
+    def tearDown(self):
+        flush_blocklist_hits.schedule = self.original_schedule
+        self.app.config['BLOCKLIST_HITS_FLUSH_INTERVAL'] = 0
+        super(TestCompiledBlocklist, self).tearDown()
+
+    def test_compiled_once(self):
+        compiled = get_compiled_blocklist()
+        self.assertIs(get_compiled_blocklist(), compiled)
+        self.assertEqual(len(compiled), 1)
+
+        # saving a block recompiles
+        db.session.add(Blocklist(ip_address=self.user_ip))
+        db.session.commit()
+        self.assertIsNot(get_compiled_blocklist(), compiled)
+        self.assertEqual(len(get_compiled_blocklist()), 2)
+
+    def test_hits_counted_without_writes(self):
+        get_compiled_blocklist()
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            for n in range(3):
+                self.assertTrue(Blocklist.user_blocked(self.user_phone, self.user_ip))
+            self.assertFalse(Blocklist.user_blocked('404-123-4567', '255.255.255.255'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(len(self.scheduled), 1)
+        self.assertEqual(Blocklist.query.get(self.block.id).hits, 0)
+
+        self.assertEqual(flush_blocklist_hits(), 3)
+        self.assertEqual(Blocklist.query.get(self.block.id).hits, 3)
+        self.assertEqual(flush_blocklist_hits(), 0)
+
+    def test_expired_from_heap(self):
+        self.block.expires = timedelta(hours=1)
+        db.session.commit()
+        compiled = get_compiled_blocklist()
+        self.assertEqual(compiled.match(self.user_phone, None), set([self.block.id]))
+
+        compiled._expire(time.time() + 2*60*60)
+        self.assertEqual(compiled.match(self.user_phone, None), set())
+        self.assertEqual(len(compiled), 0)
+
+
+class TestNetworkBlocklist(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestNetworkBlocklist, self).setUp(**kwargs)
+        self.user_phone = '510-867-5309'
+
+    def test_longest_match(self):
+        tree = NetworkTree()
+        tree.insert(ipaddress.ip_network('10.0.0.0/8'), 'wide')
+        tree.insert(ipaddress.ip_network('10.1.2.0/24'), 'narrow')
+        tree.insert(ipaddress.ip_network('2001:db8::/32'), 'v6')
+
+        self.assertEqual(tree.longest_match(ipaddress.ip_address('10.1.2.3')), set(['narrow']))
+        self.assertEqual(tree.longest_match(ipaddress.ip_address('10.9.9.9')), set(['wide']))
+        self.assertEqual(tree.longest_match(ipaddress.ip_address('11.0.0.1')), set())
+        self.assertEqual(tree.longest_match(ipaddress.ip_address('2001:db8:1::1')), set(['v6']))
+
+        tree.remove(ipaddress.ip_network('10.1.2.0/24'), 'narrow')
+        self.assertEqual(tree.longest_match(ipaddress.ip_address('10.1.2.3')), set(['wide']))
+
+    def test_ipv4_range(self):
+        b = Blocklist(ip_network='192.0.2.0/24')
+        db.session.add(b)
+        db.session.commit()
+
+        self.assertTrue(b.match(self.user_phone, '192.0.2.77'))
+        self.assertTrue(Blocklist.user_blocked(self.user_phone, '192.0.2.77'))
+        # IPv4 mapped into IPv6
+        self.assertTrue(Blocklist.user_blocked(self.user_phone, '::ffff:192.0.2.1'))
+        self.assertFalse(Blocklist.user_blocked(self.user_phone, '192.0.3.1'))
+        self.assertFalse(Blocklist.user_blocked(self.user_phone, 'not an ip'))
+        self.assertEqual(b.hits, 2)
+
+    def test_ipv6_range_and_address(self):
+        b_range = Blocklist(ip_network='2001:db8:abcd::/48')
+        b_address = Blocklist(ip_address='2001:db8::1')
+        db.session.add_all([b_range, b_address])
+        db.session.commit()
+
+        self.assertTrue(Blocklist.user_blocked(self.user_phone, '2001:db8:abcd:12::5'))
+        self.assertTrue(Blocklist.user_blocked(self.user_phone, '2001:0db8:0000::0001'))
+        self.assertFalse(Blocklist.user_blocked(self.user_phone, '2001:db8:abce::5'))
+        self.assertEqual(b_range.hits, 1)
+        self.assertEqual(b_address.hits, 1)
+
+    def test_invalid_range_skipped(self):
+        # saved outside the admin form
+        b_invalid = Blocklist(ip_network='192.0.2.0/33')
+        b_address = Blocklist(ip_address='192.0.2.5')
+        db.session.add_all([b_invalid, b_address])
+        db.session.commit()
+
+        self.assertTrue(Blocklist.user_blocked(self.user_phone, '192.0.2.5'))
+        self.assertFalse(Blocklist.user_blocked(self.user_phone, '192.0.2.6'))
+        self.assertFalse(b_invalid.match(self.user_phone, '192.0.2.6'))
+
+    def test_match_normalized(self):
+        b = Blocklist(ip_address='2001:db8::1')
+        self.assertTrue(b.match(self.user_phone, '2001:0db8:0000::0001'))
+        self.assertTrue(Blocklist(ip_address='192.0.2.1').match(self.user_phone, '::ffff:192.0.2.1'))
+        self.assertFalse(b.match(self.user_phone, None))
+
+    def test_form_range(self):
+        self.assertEqual(self.form_network('192.0.2.9/24'), '192.0.2.0/24')
+        self.assertEqual(self.form_network('2001:DB8::/32'), '2001:db8::/32')
+        self.assertIsNone(self.form_network('192.0.2.0/33'))
+
+    def form_network(self, value):
+        # error messages are translated for the session locale
+        self.app.secret_key = 'test'
+        with self.app.test_request_context():
+            form = BlocklistForm(formdata=MultiDict({'ip_network': value}), meta={'csrf': False})
+            if form.validate():
+                return form.ip_network.data
+        return None
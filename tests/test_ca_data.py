@@ -1,11 +1,15 @@
 import logging
+import os
+import tempfile
 
 from tests.run import BaseTestCase
+from tests.mocks import CountingCache
 import pytest
 
 from call_server.political_data.lookup import locate_targets
 from call_server.political_data.countries.ca import CADataProvider
-from call_server.political_data.geocode import Location
+from call_server.political_data.geocode import Location, LOCAL_CADATA_SERVICE
+from call_server.campaign.constants import LOCATION_POSTAL
 from call_server.campaign.models import Campaign
 
 
@@ -68,3 +72,113 @@ class TestCAData(BaseTestCase):
         self.assertEqual(mha['elected_office'], 'MNA')
         # compare on the url, not the representative_set_name, to avoid unicode comparison issues
         self.assertEqual(mha['related']['representative_set_url'], '/representative-sets/quebec-assemblee-nationale/')
+
+
+class TestCALocalRidings(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCALocalRidings, self).setUp(**kwargs)
+        self.mock_cache = {}
+        self.ca_data = CADataProvider(self.mock_cache)
+        self.ca_data.load_data()
+
+        self.queries = []
+        self.ca_data._query_representatives = self.mock_query
+
+        self.PARLIAMENT_CAMPAIGN = Campaign(
+            country_code='ca',
+            campaign_type='parliament',
+            campaign_subtype='lower',
+            target_ordering='in-order',
+            locate_by='postal')
+        self.mock_location = Location('Westmount', (45.48, -73.59), {'zipcode': 'H3Z 1A1', 'state': 'QC'})
+
+    def mock_query(self, latitude, longitude, body_name):
+        self.queries.append((latitude, longitude))
+        return [{'name': 'Ed Fast', 'first_name': 'Ed', 'last_name': 'Fast', 'elected_office': 'MP',
+                 'district_name': 'Abbotsford', 'representative_set_name': 'House of Commons',
+                 'offices': [{'type': 'legislature', 'tel': '1 613 555-0100'}],
+                 'related': {'boundary_url': '/boundaries/federal-electoral-districts/59001/'}}]
+
+    def test_load_ridings(self):
+        mp = self.ca_data.cache_get(self.ca_data.KEY_RIDING.format(riding='abitibi-temiscamingue'))
+        self.assertEqual(mp['district_name'], u'Abitibi—Témiscamingue')
+        self.assertEqual(mp['elected_office'], 'MP')
+        self.assertIn('legislature', [o['type'] for o in mp['offices']])
+
+    def test_postal_learned(self):
+        location = Location('Abbotsford', (49.05, -122.3), {'zipcode': 'v2s 1a1', 'state': 'BC'})
+        reps = self.ca_data.get_representatives(location)
+        self.assertEqual([r['cache_key'] for r in reps], ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(self.mock_cache[reps[0]['cache_key']], reps[0])
+        self.assertEqual(len(self.queries), 1)
+
+        # same postal code is located without geocoding or OpenNorth
+        location = self.ca_data.get_location(LOCATION_POSTAL, 'V2S1A1')
+        self.assertEqual(location.service, LOCAL_CADATA_SERVICE)
+        keys = locate_targets('V2S1A1', self.PARLIAMENT_CAMPAIGN, cache=self.mock_cache)
+        self.assertEqual(keys, ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(len(self.queries), 1)
+
+        # keeping contact details from OpenNorth, with missing fields from the loaded data
+        mp = self.ca_data.cache_get(keys[0])
+        self.assertEqual(mp['offices'][0]['tel'], '1 613 555-0100')
+        loaded = self.ca_data.cache_get(self.ca_data.KEY_RIDING.format(riding='abbotsford'))
+        self.assertEqual(mp['party_name'], loaded['party_name'])
+
+    def test_postal_seeded(self):
+        path = os.path.join(tempfile.mkdtemp(), 'postal_ridings.csv')
+        with open(path, 'w') as f:
+            f.write('postal_code,fed_num,district_name\n'
+                    'V2S,59001,Abbotsford\n'
+                    'V2T 1A1,59001,Abbotsford\n'
+                    'V2T 1A1,59016,Mission--Matsqui--Fraser Canyon\n')
+        self.assertEqual(self.ca_data.load_postal_ridings(path), 2)
+        os.remove(path)
+
+        # FSA inside one riding
+        keys = locate_targets('V2S 9Z9', self.PARLIAMENT_CAMPAIGN, cache=self.mock_cache)
+        self.assertEqual(keys, ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(self.ca_data.cache_get(keys[0])['name'], 'Ed Fast')
+
+        # postal code crossing a boundary
+        self.assertEqual(len(self.ca_data.get_postal_ridings('V2T1A1')), 2)
+        self.assertEqual(self.queries, [])
+
+    def test_lookup_round_trips(self):
+        counting_cache = CountingCache(self.mock_cache)
+        ca_data = CADataProvider(counting_cache)
+        ca_data._query_representatives = self.mock_query
+        parliament = ca_data.get_campaign_type('parliament')
+        location = Location('Abbotsford', (49.05, -122.3), {'zipcode': 'V2S 1A1', 'state': 'BC'})
+
+        # unknown postal code: one read, then representatives and the postal code are written
+        targets = parliament.all_targets(location)
+        self.assertEqual(list(targets['lower']), ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(counting_cache.round_trips, 3)
+
+        # known postal code: one read to locate, one to read the riding, and one write merging in loaded data
+        counting_cache.round_trips = 0
+        location = ca_data.get_location(LOCATION_POSTAL, 'V2S 1A1')
+        self.assertEqual(list(parliament.all_targets(location)['lower']), ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(counting_cache.round_trips, 3)
+
+        # and no write after that
+        counting_cache.round_trips = 0
+        location = ca_data.get_location(LOCATION_POSTAL, 'V2S 1A1')
+        self.assertEqual(list(parliament.all_targets(location)['lower']), ['ca:opennorth:federal-electoral-districts:59001'])
+        self.assertEqual(counting_cache.round_trips, 2)
+
+    def test_province_round_trips(self):
+        counting_cache = CountingCache(self.mock_cache)
+        ca_data = CADataProvider(counting_cache)
+        ca_data._query_representatives = lambda latitude, longitude, body_name: [
+            {'name': 'Member %d' % n, 'elected_office': 'MNA' if n else 'Mayor', 'district_name': 'Westmount',
+             'related': {'boundary_url': '/boundaries/%s/%d/' % (body_name, n)}} for n in range(3)]
+        province = ca_data.get_campaign_type('province')
+
+        # representatives come back from the lookup, and are written in one batch
+        targets = province.all_targets(self.mock_location, 'QC')
+        self.assertEqual(list(targets['lower']), ['ca:opennorth:quebec-assemblee-nationale:1',
+                                                  'ca:opennorth:quebec-assemblee-nationale:2'])
+        self.assertEqual(counting_cache.round_trips, 1)
@@ -0,0 +1,108 @@
+from .run import BaseTestCase
+from .mocks import MockRedis
+
+from call_server.extensions import db, cache
+from call_server.admin.models import Blocklist
+from call_server.campaign.models import Campaign, TwilioPhoneNumber
+from call_server.call.abuse import (check_abuse, count_request, get_abuse_counters, phone_prefix,
+                                    ABUSE_KEY, ABUSE_ALERT_KEY)
+
+
+class TestAbuseCounters(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestAbuseCounters, self).setUp(**kwargs)
+        self.redis = MockRedis()
+        self.app.config['ABUSE_COUNTERS'] = True
+        self.app.config['ABUSE_WINDOW'] = 600
+        self.app.config['ABUSE_THRESHOLDS'] = {'ip': 3, 'phone_prefix': 5, 'campaign': 0, 'referral': 0}
+        self.app.config['ABUSE_BLOCK_DURATION'] = 3600
+
+    def tearDown(self):
+        self.app.config['ABUSE_COUNTERS'] = False
+        super(TestAbuseCounters, self).tearDown()
+
+    def test_phone_prefix(self):
+        self.assertEqual(phone_prefix('+15108675309'), '+1510867')
+        self.assertIsNone(phone_prefix('5108675309'))
+
+    def test_sliding_window(self):
+        values = {'ip': '192.0.2.1'}
+        for n in range(4):
+            count_request(values, 600, self.redis, now=1200 + n)
+        # half way through the next window, the previous one counts for half
+        self.assertEqual(count_request(values, 600, self.redis, now=1800 + 300)['ip'], 3)
+        # and the window before that no longer counts
+        self.assertEqual(count_request(values, 600, self.redis, now=2400 + 1)['ip'], 1 + 599/600.)
+
+    def test_one_round_trip(self):
+        check_abuse('192.0.2.1', '+15108675309', 1, 'ref', connection=self.redis)
+        self.assertEqual(self.redis.round_trips, 1)
+        # disabled counters are not kept
+        self.assertEqual(len(self.redis.zsets), 2)
+
+    def test_ip_blocked(self):
+        for n in range(3):
+            phone = '+1404555%04d' % n
+            self.assertEqual(check_abuse('192.0.2.1', phone, 1, connection=self.redis), [])
+        self.assertEqual(Blocklist.query.count(), 0)
+
+        self.assertEqual(check_abuse('192.0.2.1', '+14045559999', 1, connection=self.redis), ['ip'])
+        block = Blocklist.query.one()
+        self.assertEqual(block.ip_address, '192.0.2.1')
+        self.assertTrue(block.expires)
+        self.assertIn('ip 4 > 3', block.reason)
+        self.assertTrue(Blocklist.user_blocked('+14045550000', '192.0.2.1'))
+
+    def test_block_added_once(self):
+        for n in range(5):
+            tripped = check_abuse('192.0.2.1', '+1404555%04d' % n, 1, connection=self.redis)
+        self.assertEqual(tripped, ['ip'])
+        self.assertEqual(Blocklist.query.count(), 1)
+
+    def test_blocked_by_remote_addr(self):
+        campaign = Campaign(name='Test Abuse', country_code='us', campaign_type='custom',
+                            campaign_language='en', segment_by='custom')
+        campaign.phone_number_set = [TwilioPhoneNumber(number='+15105550100')]
+        db.session.add(campaign)
+        db.session.add(Blocklist(ip_address='192.0.2.1'))
+        db.session.commit()
+
+        # the caller can set userIPAddress, but not the address the request came from
+        response = self.client.post('/call/create', data={
+            'campaignId': campaign.id,
+            'userPhone': '4045550000',
+            'userIPAddress': '198.51.100.7',
+        }, environ_base={'REMOTE_ADDR': '192.0.2.1'})
+        self.assertStatus(response, 429)
+        self.assertEqual(Blocklist.query.count(), 1)
+
+    def test_phone_prefix_blocked(self):
+        for n in range(6):
+            tripped = check_abuse('192.0.2.%d' % n, '+1510867000%d' % n, 1, connection=self.redis)
+        self.assertEqual(tripped, ['phone_prefix'])
+        block = Blocklist.query.one()
+        self.assertEqual(block.phone_number.e164, '+15108670005')
+
+    def test_campaign_only_warns(self):
+        self.app.config['ABUSE_THRESHOLDS']['campaign'] = 2
+        for n in range(4):
+            tripped = check_abuse('192.0.2.%d' % n, '+1404555%04d' % n, 1, connection=self.redis)
+        self.assertEqual(tripped, [])
+        self.assertEqual(Blocklist.query.count(), 0)
+        self.assertFalse(cache.add(ABUSE_ALERT_KEY.format(dimension='campaign', value='1'), 1))
+
+    def test_admin_counters(self):
+        for n in range(2):
+            check_abuse('192.0.2.1', '+15108675309', 1, connection=self.redis)
+        check_abuse('192.0.2.2', '+15108675309', 1, connection=self.redis)
+        counters = get_abuse_counters(connection=self.redis)
+        self.assertEqual(counters['ip'], [('192.0.2.1', 2), ('192.0.2.2', 1)])
+        self.assertEqual(counters['phone_prefix'], [('+1510867', 3)])
+        self.assertEqual(counters['campaign'], [])
+
+    def test_disabled(self):
+        self.app.config['ABUSE_COUNTERS'] = False
+        self.assertEqual(check_abuse('192.0.2.1', '+15108675309', 1, connection=self.redis), [])
+        self.assertEqual(self.redis.round_trips, 0)
+        self.assertIsNone(get_abuse_counters(connection=self.redis))
@@ -0,0 +1,274 @@
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from .run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign, Target, TargetOffice, CampaignTarget
+from call_server.campaign.snapshot import get_campaign_snapshot, invalidate_campaign_snapshot, get_call_target
+from call_server.call.models import Call, Session
+from call_server.call.state import get_call_state, save_call_state, dump_call_state, load_call_state
+from call_server.political_data import DATA_VERSION_KEY
+from call_server.political_data.adapters import target_record_key
+from call_server.political_data.data_cache import get_target_records
+from call_server.political_data.lookup import get_all_targets
+
+
+@contextmanager
+def recorded_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def target_statements(statements):
+    return [s for s in statements if 'campaign_target' in s]
+
+
+class TestCallState(BaseTestCase):
+
+    def test_round_trip(self):
+        params = {'campaignId': '1', 'userPhone': '5108675309', 'userCountry': 'US',
+                  'targetIds': ['custom:1', 'custom:2'], 'call_index': 1, 'sessionId': 3}
+        loaded = load_call_state(dump_call_state(params))
+        for key in ['campaignId', 'userPhone', 'userCountry', 'targetIds', 'call_index']:
+            self.assertEqual(loaded[key], params[key])
+        self.assertIsNone(loaded['userLocation'])
+
+    def test_missing_state(self):
+        self.assertIsNone(get_call_state(None))
+        self.assertIsNone(get_call_state('12345'))
+
+
+class TestCallFlow(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestCallFlow, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Flow', country_code='us',
+                                 campaign_type='custom', campaign_language='en',
+                                 segment_by='custom', target_ordering='in-order')
+        db.session.add(self.campaign)
+        for n in range(3):
+            target = Target(key='custom:%d' % n, name='Target %d' % n, title='Rep.',
+                            number='+1510555000%d' % n)
+            db.session.add(CampaignTarget(campaign=self.campaign, target=target, order=n))
+        db.session.commit()
+
+        self.call_session = Session(campaign_id=self.campaign.id, direction='outbound', phone_number='5108675309')
+        db.session.add(self.call_session)
+        db.session.commit()
+
+        save_call_state({
+            'sessionId': self.call_session.id,
+            'campaignId': str(self.campaign.id),
+            'userPhone': '5108675309',
+            'userCountry': 'US',
+            'targetIds': [],
+        })
+        self.session_url = 'sessionId=%s' % self.call_session.id
+
+    def post(self, endpoint, call_index=0, **data):
+        url = '/call/%s?%s' % (endpoint, self.session_url)
+        if call_index:
+            url += '&call_index=%d' % call_index
+        response = self.client.post(url, data=data)
+        self.assert200(response)
+        return response.data.decode('utf-8')
+
+    def test_urls_carry_session_only(self):
+        twiml = self.post('make_calls')
+        self.assertIn('/call/make_single?%s<' % self.session_url, twiml)
+        self.assertNotIn('targetIds', twiml)
+
+        state = get_call_state(self.call_session.id)
+        self.assertEqual(state['targetIds'], ['custom:0', 'custom:1', 'custom:2'])
+        self.assertEqual(state['call_index'], 0)
+
+    def test_schedule_prompt_timeout(self):
+        self.campaign.prompt_schedule = True
+        db.session.commit()
+
+        twiml = self.post('make_calls')
+        self.assertIn('<Gather', twiml)
+        self.assertIn('/call/make_calls?%s<' % self.session_url, twiml)
+
+        # following the timeout redirect dials instead of prompting again
+        twiml = self.post('make_calls')
+        self.assertNotIn('<Gather', twiml)
+        self.assertIn('/call/make_single?%s<' % self.session_url, twiml)
+
+    def test_call_sequence(self):
+        self.post('make_calls')
+
+        for n in range(3):
+            twiml = self.post('make_single', call_index=n)
+            self.assertIn('+1510555000%d' % n, twiml)
+            self.assertIn('/call/complete?%s' % self.session_url, twiml)
+
+            twiml = self.post('complete', call_index=n, CallSid='CA%d' % n, DialCallStatus='completed')
+            if n < 2:
+                self.assertIn('/call/make_single?%s&amp;call_index=%d' % (self.session_url, n + 1), twiml)
+            else:
+                self.assertNotIn('<Redirect', twiml)
+
+        self.assertEqual(Call.query.filter_by(session_id=self.call_session.id).count(), 3)
+
+    def test_complete_retried(self):
+        self.post('make_calls')
+        self.post('make_single')
+        first = self.post('complete', CallSid='CA0', DialCallStatus='completed')
+        retried = self.post('complete', CallSid='CA0', DialCallStatus='completed')
+        self.assertEqual(first, retried)
+        self.assertIn('call_index=1<', retried)
+
+    def test_complete_after_status_callback(self):
+        self.post('make_calls')
+        self.post('make_single', call_index=2)
+        self.post('status_callback', CallSid='CA2', CallStatus='completed', CallDuration='60')
+        twiml = self.post('complete', call_index=2, CallSid='CA2', DialCallStatus='completed')
+        self.assertNotIn('<Redirect', twiml)
+        self.assertEqual(Call.query.filter_by(session_id=self.call_session.id).count(), 1)
+
+    def test_call_index_out_of_range(self):
+        self.post('make_calls')
+        twiml = self.post('make_single', call_index=5)
+        self.assertIn('<Hangup', twiml)
+
+    def test_targets_materialized_once(self):
+        get_campaign_snapshot(self.campaign.id)
+        with recorded_statements() as statements:
+            self.post('make_calls')
+        selects = target_statements(statements)
+        # one query for targets, one for their offices
+        self.assertEqual(len(selects), 2)
+        self.assertTrue(all(s.lstrip().startswith('SELECT') for s in selects))
+
+        state = get_call_state(self.call_session.id)
+        self.assertEqual(len(state['targetRowIds']), 3)
+
+        with recorded_statements() as statements:
+            for n in range(3):
+                self.post('make_single', call_index=n)
+                self.post('complete', call_index=n, CallSid='CA%d' % n, DialCallStatus='completed')
+        self.assertEqual(target_statements(statements), [])
+        self.assertEqual([c.target_id for c in Call.query.order_by(Call.id)], state['targetRowIds'])
+
+    def test_session_without_row_ids(self):
+        # state saved before make_calls stored target row ids
+        self.post('make_calls')
+        state = get_call_state(self.call_session.id)
+        state['targetRowIds'] = []
+        save_call_state(state)
+
+        twiml = self.post('make_single')
+        self.assertIn('+15105550000', twiml)
+
+
+class TestTargetMaterialize(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestTargetMaterialize, self).setUp(**kwargs)
+        self.existing = Target(key='us:bioguide:E000001', name='Existing', title='Sen.', number='+12025550101')
+        db.session.add(self.existing)
+        db.session.commit()
+
+        for (uid, name) in [('E000001', 'Existing'), ('N000002', 'New')]:
+            cache.set(target_record_key('us:bioguide:%s' % uid), {
+                'key': 'us:bioguide:%s' % uid, 'uid': uid, 'title': 'Sen.', 'name': name,
+                'number': '+12025550102', 'location': 'DC',
+                'offices': [{'uid': '%s-sf' % uid, 'name': 'San Francisco', 'type': 'district',
+                             'number': '+14155550100', 'address': '1 Market St'}]})
+
+    def test_get_or_create_many(self):
+        keys = ['us:bioguide:E000001', 'us:bioguide:N000002', 'us:bioguide:E000001', 'us:bioguide:U000003']
+        with recorded_statements() as statements:
+            targets = Target.get_or_create_many(keys)
+
+        self.assertEqual(sorted(targets.keys()), ['us:bioguide:E000001', 'us:bioguide:N000002'])
+        self.assertEqual(targets['us:bioguide:E000001'].id, self.existing.id)
+        self.assertEqual(Target.query.count(), 2)
+        self.assertEqual(TargetOffice.query.count(), 2)
+        # updated number from political data
+        self.assertEqual(Target.query.get(self.existing.id).number.e164, '+12025550102')
+
+        selects = [s for s in target_statements(statements) if s.lstrip().startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+
+        # nothing left to write
+        with recorded_statements() as statements:
+            Target.get_or_create_many(keys)
+        self.assertFalse([s for s in target_statements(statements) if not s.lstrip().startswith('SELECT')])
+
+    def test_office_suffix_records(self):
+        records = get_target_records(['us:bioguide:N000002-1', 'us:bioguide:N000002', 'us:bioguide:U000003'])
+        self.assertEqual(sorted(records.keys()), ['us:bioguide:N000002', 'us:bioguide:N000002-1'])
+        self.assertEqual(records['us:bioguide:N000002-1']['name'], 'New')
+
+    def test_call_target(self):
+        target = get_call_target('us:bioguide:N000002')
+        self.assertEqual(target.name, 'New')
+        self.assertEqual(target.offices[0].number, '+14155550100')
+        self.assertEqual(get_call_target('us:bioguide:N000002', target.id), target)
+        self.assertIsNone(get_call_target('us:bioguide:U000003'))
+
+
+class TestTargetCache(BaseTestCase):
+
+    class CountingCampaignType(object):
+        def __init__(self):
+            self.calls = 0
+
+        def all_targets_for_campaign(self, location, campaign):
+            self.calls += 1
+            return {'lower': ['us:house:CA:12'], 'upper': ['us:senate:CA']}
+
+    def setUp(self, **kwargs):
+        super(TestTargetCache, self).setUp(**kwargs)
+        self.campaign = Campaign(name='Test Targets', country_code='us',
+                                 campaign_type='congress', campaign_subtype='both',
+                                 campaign_language='en', segment_by='location', locate_by='postal')
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.campaign_data = self.CountingCampaignType()
+
+    def test_memoized_by_location(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        first = get_all_targets('94110', snapshot, self.campaign_data)
+        second = get_all_targets(' 94110 ', snapshot, self.campaign_data)
+        self.assertEqual(first, second)
+        self.assertEqual(self.campaign_data.calls, 1)
+
+        get_all_targets('94612', snapshot, self.campaign_data)
+        self.assertEqual(self.campaign_data.calls, 2)
+
+    def test_invalidated_by_campaign_edit(self):
+        get_all_targets('94110', get_campaign_snapshot(self.campaign.id), self.campaign_data)
+        invalidate_campaign_snapshot(self.campaign.id)
+        get_all_targets('94110', get_campaign_snapshot(self.campaign.id), self.campaign_data)
+        self.assertEqual(self.campaign_data.calls, 2)
+
+    def test_invalidated_by_data_load(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        get_all_targets('94110', snapshot, self.campaign_data)
+        cache.set(DATA_VERSION_KEY, 'reloaded')
+        get_all_targets('94110', snapshot, self.campaign_data)
+        self.assertEqual(self.campaign_data.calls, 2)
+
+    def test_orm_campaign_not_memoized(self):
+        get_all_targets('94110', self.campaign, self.campaign_data)
+        get_all_targets('94110', self.campaign, self.campaign_data)
+        self.assertEqual(self.campaign_data.calls, 2)
@@ -0,0 +1,134 @@
+from .run import BaseTestCase
+from .mocks import MockRedis
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.call.write_behind import (log_call_event, flush_call_log, write_call_events,
+                                           call_event, ringing_event, session_event, dial_id,
+                                           CALL_LOG_STREAM, CALL_LOG_DEAD_LETTER, CALL_LOG_FLUSH_KEY)
+
+
+class TestCallLog(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCallLog, self).setUp(**kwargs)
+        self.campaign = Campaign(name='Test Log', country_code='us', campaign_type='custom',
+                                 campaign_language='en', segment_by='custom')
+        self.target = Target(key='custom:1', name='Target', title='Rep.', number='+15105550001')
+        db.session.add_all([self.campaign, self.target])
+        db.session.commit()
+        self.call_session = Session(campaign_id=self.campaign.id, phone_number='5108675309')
+        db.session.add(self.call_session)
+        db.session.commit()
+
+        self.app.config['CALL_LOG_WRITE_BEHIND'] = True
+        self.redis = MockRedis()
+        self.queued = []
+        self.original_queue = flush_call_log.queue
+        flush_call_log.queue = lambda *args, **kwargs: self.queued.append(args)
+
+    def tearDown(self):
+        flush_call_log.queue = self.original_queue
+        self.app.config['CALL_LOG_WRITE_BEHIND'] = False
+        super(TestCallLog, self).tearDown()
+
+    @property
+    def entries(self):
+        return self.redis.streams[CALL_LOG_STREAM]
+
+    def call(self, call_index, status='completed'):
+        return call_event(str(self.call_session.id), self.campaign.id, self.target.id, 'CA1',
+                          dial_id('CA1', None, call_index), status, '30')
+
+    def test_dial_id(self):
+        self.assertEqual(dial_id('CA1', 'CA2', 3), 'CA2')
+        self.assertEqual(dial_id('CA1', None, 3), 'CA1:3')
+        self.assertIsNone(dial_id(None))
+
+    def test_logged_without_writes(self):
+        for n in range(3):
+            log_call_event(self.call(n), connection=self.redis)
+        log_call_event(ringing_event(self.call_session.id), connection=self.redis)
+        log_call_event(session_event(self.call_session.id, 'completed', '95'), connection=self.redis)
+
+        # one round trip each, one flush queued
+        self.assertEqual(self.redis.round_trips, 5)
+        self.assertEqual(len(self.queued), 1)
+        self.assertEqual(Call.query.count(), 0)
+
+        self.assertEqual(flush_call_log(connection=self.redis), 3)
+        self.assertEqual(self.entries, [])
+        calls = Call.query.order_by(Call.id).all()
+        self.assertEqual([c.dial_id for c in calls], ['CA1:0', 'CA1:1', 'CA1:2'])
+        self.assertEqual(calls[0].duration, 30)
+
+        call_session = Session.query.get(self.call_session.id)
+        self.assertEqual(call_session.status, 'completed')
+        self.assertEqual(call_session.duration, 95)
+        self.assertIsNotNone(call_session.queue_delay)
+
+    def test_redelivery_written_once(self):
+        event = self.call(0)
+        write_call_events([event, event])
+        # flush failed before deleting the entry, so it is read again
+        log_call_event(event, connection=self.redis)
+        flush_call_log(connection=self.redis)
+        self.assertEqual(Call.query.count(), 1)
+
+    def test_batches(self):
+        for n in range(5):
+            log_call_event(self.call(n), connection=self.redis)
+        self.redis.round_trips = 0
+        self.assertEqual(flush_call_log(batch_size=2, connection=self.redis), 5)
+        self.assertEqual(self.redis.round_trips, 4)
+
+    def test_flush_running(self):
+        log_call_event(self.call(0), connection=self.redis)
+        with self.redis.lock_held:
+            self.assertEqual(flush_call_log(connection=self.redis), 0)
+        self.assertEqual(len(self.entries), 1)
+
+    def test_bad_entries_moved_aside(self):
+        log_call_event(self.call(0), connection=self.redis)
+        self.redis.xadd(CALL_LOG_STREAM, {'event': 'not json'})
+        self.redis.xadd(CALL_LOG_STREAM, {'event': '{"type": "call"}'})
+        log_call_event(self.call(1), connection=self.redis)
+
+        self.assertEqual(flush_call_log(connection=self.redis), 2)
+        self.assertEqual(self.entries, [])
+        self.assertEqual([fields[b'event'] for (entry_id, fields) in self.redis.streams[CALL_LOG_DEAD_LETTER]],
+                         [b'not json', b'{"type": "call"}'])
+        self.assertEqual(Call.query.count(), 2)
+
+    def test_close_error(self):
+        original_close = Session.close
+
+        def failing_close(call_session):
+            raise ValueError('CRM unavailable')
+        Session.close = failing_close
+        try:
+            log_call_event(self.call(0), connection=self.redis)
+            log_call_event(session_event(self.call_session.id, 'completed', '95'), connection=self.redis)
+            self.assertEqual(flush_call_log(connection=self.redis), 1)
+        finally:
+            Session.close = original_close
+        self.assertEqual(self.entries, [])
+        self.assertEqual(Session.query.get(self.call_session.id).status, 'completed')
+
+    def test_flush_queued_after_lock_taken(self):
+        with self.redis.lock_held:
+            log_call_event(self.call(0), connection=self.redis)
+            flush_call_log(connection=self.redis)
+        self.assertNotIn(CALL_LOG_FLUSH_KEY, self.redis.keys)
+
+        # the next event queues a flush of both
+        log_call_event(self.call(1), connection=self.redis)
+        self.assertEqual(len(self.queued), 2)
+        self.assertEqual(flush_call_log(connection=self.redis), 2)
+
+    def test_written_now_when_disabled(self):
+        self.app.config['CALL_LOG_WRITE_BEHIND'] = False
+        log_call_event(self.call(0), connection=self.redis)
+        self.assertEqual(self.entries, [])
+        self.assertEqual(Call.query.count(), 1)
@@ -0,0 +1,134 @@
+import logging
+
+import sqlalchemy
+
+from .run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, AudioRecording, CampaignAudioRecording
+from call_server.call.views import intro_wait_human
+from call_server.campaign.snapshot import (get_campaign_snapshot, invalidate_campaign_snapshot,
+                                           CampaignSnapshot, AudioMessage)
+
+
+class TestCampaignSnapshot(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestCampaignSnapshot, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Snapshot', country_code='us',
+                                 campaign_type='congress', campaign_subtype='both',
+                                 campaign_language='en', segment_by='location', locate_by='postal')
+        db.session.add(self.campaign)
+
+        recording = AudioRecording(key='msg_intro', text_to_speech='Hello {{name}}')
+        db.session.add(recording)
+        db.session.add(CampaignAudioRecording(campaign=self.campaign, recording=recording, selected=True))
+        db.session.commit()
+
+    def test_snapshot_settings(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        self.assertIsInstance(snapshot, CampaignSnapshot)
+        self.assertEqual(snapshot.name, 'Test Snapshot')
+        self.assertEqual(snapshot.segment_by, 'location')
+        self.assertEqual(snapshot.status, self.campaign.status)
+        self.assertEqual(snapshot.language_code, self.campaign.language_code)
+
+    def test_snapshot_audio(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        intro = snapshot.audio('msg_intro')
+        self.assertIsInstance(intro, AudioMessage)
+        self.assertEqual(intro.text_to_speech, 'Hello {{name}}')
+        self.assertTrue(snapshot.has_audio('msg_intro'))
+
+        # unselected keys fall back to the message defaults
+        self.assertFalse(snapshot.has_audio('msg_goodbye'))
+        self.assertEqual(snapshot.audio('msg_goodbye'), self.campaign.audio('msg_goodbye'))
+
+    def test_snapshot_cached(self):
+        first = get_campaign_snapshot(self.campaign.id)
+
+        # edits without invalidation are not visible
+        self.campaign.call_maximum = 3
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.assertIs(get_campaign_snapshot(self.campaign.id), first)
+
+        invalidate_campaign_snapshot(self.campaign.id)
+        second = get_campaign_snapshot(self.campaign.id)
+        self.assertNotEqual(first.version, second.version)
+        self.assertEqual(second.call_maximum, 3)
+
+    def test_snapshot_missing(self):
+        self.assertIsNone(get_campaign_snapshot(self.campaign.id + 1))
+
+
+class TestCampaignAudioQueries(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCampaignAudioQueries, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Audio', country_code='us',
+                                 campaign_type='congress', campaign_subtype='both',
+                                 campaign_language='en', segment_by='custom')
+        db.session.add(self.campaign)
+        for key in ['msg_intro', 'msg_intro_confirm']:
+            recording = AudioRecording(key=key, text_to_speech='Say %s' % key)
+            db.session.add(recording)
+            db.session.add(CampaignAudioRecording(campaign=self.campaign, recording=recording, selected=True))
+        db.session.commit()
+
+        self.queries = []
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', self._count_query)
+
+    def tearDown(self):
+        sqlalchemy.event.remove(db.engine, 'before_cursor_execute', self._count_query)
+        super(TestCampaignAudioQueries, self).tearDown()
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries.append(statement)
+
+    def audio_queries(self):
+        return [q for q in self.queries if 'campaign_audio_recordings' in q]
+
+    def test_audio_map(self):
+        campaign = Campaign.query.get(self.campaign.id)
+        self.queries = []
+
+        self.assertEqual(campaign.audio('msg_intro').text_to_speech, 'Say msg_intro')
+        self.assertTrue(campaign.has_audio('msg_intro_confirm'))
+        self.assertFalse(campaign.has_audio('msg_goodbye'))
+        self.assertEqual(campaign.audio('msg_goodbye'),
+                         self.app.config.CAMPAIGN_MESSAGE_DEFAULTS.get('msg_goodbye'))
+        self.assertEqual(set(campaign.audio_msgs().keys()), set(['msg_intro', 'msg_intro_confirm']))
+
+        self.assertEqual(len(self.queries), 1)
+
+    def test_intro_wait_human_queries(self):
+        campaign = Campaign.query.get(self.campaign.id)
+        self.queries = []
+
+        with self.app.test_request_context():
+            twiml = intro_wait_human({'campaignId': campaign.id}, campaign)
+        self.assertIn('Say msg_intro_confirm', twiml)
+        self.assertEqual(len(self.queries), 1)
+
+    def test_connection_response_queries(self):
+        params = {'campaignId': self.campaign.id, 'userPhone': '5108675309'}
+
+        # first response builds the campaign snapshot, with one audio query
+        response = self.client.post('/call/connection', data=params)
+        self.assert200(response)
+        self.assertIn(b'Say msg_intro', response.data)
+        self.assertEqual(len(self.audio_queries()), 1)
+
+        # later responses read it from cache
+        self.queries = []
+        response = self.client.post('/call/connection', data=params)
+        self.assert200(response)
+        self.assertEqual(len(self.audio_queries()), 0)
@@ -1,13 +1,34 @@
 import logging
 import json, yaml
 
+import geopy
 from tests.run import BaseTestCase
 import pytest
 
-from call_server.political_data.geocode import LOCAL_USDATA_SERVICE, NOMINATIM_SERVICE
+from call_server.political_data.geocode import (LOCAL_USDATA_SERVICE, NOMINATIM_SERVICE, CACHED_GEOCODE_SERVICE,
+                                                Geocoder, _local_geocodes)
 from call_server.political_data.countries.us import USDataProvider
 
 
+class GoogleV3(object):
+    """Stands in for the geopy client, counting requests"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def geocode(self, address, region=None):
+        self.requests += 1
+        if 'typo' in address:
+            return None
+        return geopy.Location('Oakland, CA 94612, USA', (37.804417, -122.267747), {'address_components': [
+            {'types': ['administrative_area_level_1'], 'short_name': 'CA'},
+            {'types': ['postal_code'], 'short_name': '94612'},
+        ]})
+
+    def reverse(self, latlon):
+        return self.geocode('reverse')
+
+
 class TestGeocoders(BaseTestCase):
 
     @classmethod
@@ -50,3 +71,58 @@ class TestGeocoders(BaseTestCase):
             print("geocoder timeout, skipping")
         else:
             self.assertEqual(result.postal, '20500')
+
+
+class TestGeocoderCache(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestGeocoderCache, self).setUp(**kwargs)
+        _local_geocodes.clear()
+        self.mock_cache = {}
+        self.geocoder = Geocoder(country='US', cache=self.mock_cache)
+        self.geocoder.client = GoogleV3()
+
+    def tearDown(self):
+        _local_geocodes.clear()
+        super(TestGeocoderCache, self).tearDown()
+
+    def test_repeat_query(self):
+        first = self.geocoder.geocode('1 Frank H Ogawa Plaza, Oakland')
+        second = self.geocoder.geocode('  1 frank h ogawa plaza,   OAKLAND ')
+        self.assertEqual(self.geocoder.client.requests, 1)
+
+        self.assertEqual(second.service, CACHED_GEOCODE_SERVICE)
+        self.assertEqual(second.latlon, first.latlon)
+        self.assertEqual(second.state, first.state)
+        self.assertEqual(second.postal, '94612')
+
+    def test_shared_cache(self):
+        self.geocoder.geocode('1 Frank H Ogawa Plaza, Oakland')
+
+        # another process, with an empty local tier
+        _local_geocodes.clear()
+        other = Geocoder(country='US', cache=self.mock_cache)
+        other.client = GoogleV3()
+        self.assertEqual(other.geocode('1 Frank H Ogawa Plaza, Oakland').state, 'CA')
+        self.assertEqual(other.client.requests, 0)
+
+    def test_keyed_by_method_and_country(self):
+        self.geocoder.geocode('94612')
+        self.geocoder.geocode('94612', postal_only=True)
+        self.assertEqual(self.geocoder.client.requests, 2)
+
+        other = Geocoder(country='CA', cache=self.mock_cache)
+        other.client = self.geocoder.client
+        other.geocode('94612')
+        self.assertEqual(self.geocoder.client.requests, 3)
+
+    def test_negative_result(self):
+        for n in range(3):
+            result = self.geocoder.geocode('typo street')
+            self.assertIsNone(result.latitude)
+        self.assertEqual(self.geocoder.client.requests, 1)
+
+    def test_reverse(self):
+        self.geocoder.reverse((37.804417, -122.267747))
+        self.assertEqual(self.geocoder.reverse('37.8044171,-122.2677472').postal, '94612')
+        self.assertEqual(self.geocoder.client.requests, 1)
@@ -2,8 +2,10 @@ import logging
 import json, yaml
 
 from tests.run import BaseTestCase
+from tests.mocks import CountingCache
 
-from call_server.political_data.adapters import adapt_by_key
+from call_server.political_data.adapters import adapt_by_key, with_target_records, target_record_key
+from call_server.political_data.data_cache import check_political_data_cache
 from call_server.political_data.countries.us import USDataProvider
 from call_server.political_data.countries.ca import CADataProvider
 
@@ -81,3 +83,41 @@ class TestDataAdapters(BaseTestCase):
         self.assertEqual(target['number'], data['offices'][0]['tel'])
         self.assertEqual(target['offices'][0]['number'], data['offices'][1]['tel'])
         self.assertEqual(target['offices'][0]['type'], 'constituency')
+
+
+class TestTargetRecords(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestTargetRecords, self).setUp(**kwargs)
+        self.key = 'us_state:governor:CA'
+        self.governor = [{'title': 'Governor', 'first_name': 'Gavin', 'last_name': 'Newsom',
+                          'phone': '9164452841', 'state': 'CA', 'state_name': 'California'}]
+
+    def test_with_target_records(self):
+        records = with_target_records({self.key: self.governor, 'us:house:CA:13': []})
+        self.assertEqual(len(records), 3)
+
+        record = records[target_record_key(self.key)]
+        self.assertEqual(record['name'], 'Gavin Newsom')
+        self.assertEqual(record['number'], '9164452841')
+        self.assertEqual(record['key'], self.key)
+        self.assertEqual(record['offices'], [])
+
+    def test_check_cache_one_fetch(self):
+        cache = CountingCache(with_target_records({self.key: self.governor}))
+        data = check_political_data_cache(self.key, cache)
+        self.assertEqual(cache.reads, 1)
+        self.assertEqual(data['name'], 'Gavin Newsom')
+
+        # callers modify the result, not the stored record
+        data.pop('offices')
+        self.assertIn('offices', cache.data[target_record_key(self.key)])
+
+    def test_check_cache_stores_record(self):
+        cache = CountingCache({self.key: self.governor})
+        data = check_political_data_cache(self.key, cache)
+        self.assertEqual(cache.reads, 2)
+        self.assertEqual(cache.data[target_record_key(self.key)], data)
+
+        self.assertEqual(check_political_data_cache(self.key, cache), data)
+        self.assertEqual(cache.reads, 3)
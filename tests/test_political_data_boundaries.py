@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+
+from .run import BaseTestCase
+
+from call_server.political_data.boundaries import (DistrictIndex, division_from_properties, division_chamber,
+                                                   load_state_boundaries, get_district_index, reset_district_index)
+from call_server.political_data.countries.us import USDataProvider
+from call_server.political_data.geocode import Location
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+def feature(division, *rings):
+    return {'type': 'Feature', 'properties': {'ocdid': division},
+            'geometry': {'type': 'Polygon', 'coordinates': list(rings)}}
+
+
+class TestDistrictIndex(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestDistrictIndex, self).setUp(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp()
+
+        # a 20x20 grid of lower districts, enough for a few tree levels
+        features = []
+        for i in range(20):
+            for j in range(20):
+                division = 'ocd-division/country:us/state:ca/sldl:%d' % (i*20 + j)
+                features.append(feature(division, square(-123 + i*0.1, 37 + j*0.1, 0.1)))
+        # and one upper district with a hole
+        features.append(feature('ocd-division/country:us/state:ca/sldu:9',
+                                square(-123, 37, 1), square(-122.6, 37.4, 0.2)))
+
+        self.source = os.path.join(self.tmp_dir, 'districts.geojson')
+        with open(self.source, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        self.path = os.path.join(self.tmp_dir, 'districts.snapshot')
+
+    def tearDown(self):
+        reset_district_index()
+        shutil.rmtree(self.tmp_dir)
+        super(TestDistrictIndex, self).tearDown()
+
+    def test_division_from_properties(self):
+        self.assertEqual(division_from_properties({'STATEFP': '06', 'SLDUST': '009'}),
+                         'ocd-division/country:us/state:ca/sldu:9')
+        self.assertEqual(division_from_properties({'STATEFP': '25', 'SLDLST': '1ST'}),
+                         'ocd-division/country:us/state:ma/sldl:1st')
+        self.assertIsNone(division_from_properties({'STATEFP': '06', 'SLDLST': 'ZZZ'}))
+        self.assertEqual(division_chamber('ocd-division/country:us/state:ne/sldu:12'), 'legislature')
+        self.assertEqual(division_chamber('ocd-division/country:us/state:ca/sldl:18'), 'lower')
+
+    def test_locate(self):
+        self.assertEqual(load_state_boundaries([self.source], path=self.path), 401)
+        index = DistrictIndex.open(self.path)
+
+        self.assertEqual(index.locate(37.05, -122.95), ['ocd-division/country:us/state:ca/sldl:0',
+                                                        'ocd-division/country:us/state:ca/sldu:9'])
+        self.assertEqual(index.locate(37.95, -122.05), ['ocd-division/country:us/state:ca/sldl:189',
+                                                        'ocd-division/country:us/state:ca/sldu:9'])
+        self.assertEqual(index.locate(38.95, -121.05), ['ocd-division/country:us/state:ca/sldl:399'])
+        # in the hole
+        self.assertEqual(index.locate(37.45, -122.55), ['ocd-division/country:us/state:ca/sldl:84'])
+        self.assertEqual(index.locate(40.0, -100.0), [])
+
+    def test_district_legislators_cached(self):
+        load_state_boundaries([self.source], path=self.path)
+        get_district_index(self.path)
+
+        queries = []
+        mock_cache = {}
+        us_data = USDataProvider(mock_cache, zipcode_index=False)
+
+        def mock_query(latitude, longitude):
+            queries.append((latitude, longitude))
+            legislators = []
+            for division in us_data.get_state_districts(Location('', (latitude, longitude), {})):
+                key = us_data.KEY_OPENSTATES.format(id=division)
+                leg = {'id': key, 'chamber': division_chamber(division), 'state': 'CA',
+                       'division': division, 'cache_key': key}
+                mock_cache[key] = leg
+                legislators.append(leg)
+            return legislators
+        us_data._query_state_legislators = mock_query
+
+        first = us_data.get_state_legislators(Location('', (37.01, -122.99), {}))
+        # opposite corner of the same districts, in another geohash cell
+        second = us_data.get_state_legislators(Location('', (37.09, -122.91), {}))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(first, second)
+
+        us_data.get_state_legislators(Location('', (37.15, -122.95), {}))
+        self.assertEqual(len(queries), 2)
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from .run import BaseTestCase
+
+from call_server.political_data.countries import DataProvider
+
+
+class MockDataProvider(DataProvider):
+    MANIFEST_KEY = 'political_data:mock:manifest'
+
+    def __init__(self, cache):
+        self._cache = cache
+
+
+class TestCacheSync(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCacheSync, self).setUp(**kwargs)
+        self.mock_cache = {}
+        self.data = MockDataProvider(self.mock_cache)
+        self.mapping = {
+            'mock:a': [{'name': 'A'}],
+            'mock:b': [{'name': 'B'}],
+            'mock:c': [{'name': 'C'}],
+        }
+
+    def test_first_load(self):
+        sync = self.data.cache_sync(self.mapping)
+        self.assertEqual(sorted(sync.added), ['mock:a', 'mock:b', 'mock:c'])
+        self.assertEqual(sync.changed, [])
+        self.assertEqual(sync.removed, [])
+        self.assertEqual(self.mock_cache['mock:b'], [{'name': 'B'}])
+
+    def test_reload_diff(self):
+        self.data.cache_sync(self.mapping)
+
+        # no changes, no writes
+        self.mock_cache['mock:a'] = 'untouched'
+        sync = self.data.cache_sync(self.mapping)
+        self.assertEqual(sync, ([], [], []))
+        self.assertEqual(self.mock_cache['mock:a'], 'untouched')
+
+        del self.mapping['mock:c']
+        self.mapping['mock:b'] = [{'name': 'Bee'}]
+        self.mapping['mock:d'] = [{'name': 'D'}]
+        sync = self.data.cache_sync(self.mapping)
+        self.assertEqual(sync.added, ['mock:d'])
+        self.assertEqual(sync.changed, ['mock:b'])
+        self.assertEqual(sync.removed, ['mock:c'])
+
+        self.assertEqual(self.mock_cache['mock:a'], 'untouched')
+        self.assertEqual(self.mock_cache['mock:b'], [{'name': 'Bee'}])
+        self.assertNotIn('mock:c', self.mock_cache)
+
+    def test_evicted_keys(self):
+        self.data.cache_sync(self.mapping)
+        del self.mock_cache['mock:b']
+        sync = self.data.cache_sync(self.mapping)
+        self.assertEqual(sync, (['mock:b'], [], []))
+        self.assertEqual(self.mock_cache['mock:b'], [{'name': 'B'}])
+
+    def test_force(self):
+        self.data.cache_sync(self.mapping)
+        sync = self.data.cache_sync(self.mapping, force=True)
+        self.assertEqual(len(sync.added), 3)
+
+    def test_old_manifest(self):
+        self.data.cache_sync(self.mapping)
+        self.mock_cache[MockDataProvider.MANIFEST_KEY]['loaded'] = datetime.now() - timedelta(days=365)
+        sync = self.data.cache_sync(self.mapping)
+        self.assertEqual(len(sync.added), 3)
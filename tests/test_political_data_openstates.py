@@ -0,0 +1,226 @@
+import json
+import re
+import threading
+import time
+
+import requests
+
+from .run import BaseTestCase
+
+from call_server.political_data import get_country_data, reset_country_data
+from call_server.political_data.data_cache import check_political_data_cache, warm_political_data_cache
+from call_server.political_data.openstates import OpenStatesClient, OpenStatesError
+from call_server.political_data.countries.us import USDataProvider, _local_organizations
+
+
+def person(ocd_id, chamber='upper', district='9'):
+    return {
+        'id': ocd_id,
+        'name': 'Legislator %s' % ocd_id,
+        'chamber': [{
+            'post': {'label': district, 'role': 'Senator',
+                     'division': {'id': 'ocd-division/country:us/state:ca/sldu:%s' % district}},
+            'organization': {'name': 'Senate', 'classification': chamber,
+                             'jurisdictionId': 'ocd-jurisdiction/country:us/state:ca/government'},
+        }],
+        'contactDetails': [{'type': 'voice', 'value': '916-555-0100', 'note': 'Capitol Office'}],
+    }
+
+
+class MockResponse(object):
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+class MockSession(object):
+    """Answers aliased person(id) queries, after failing with any queued errors"""
+
+    def __init__(self, errors=None):
+        self.queries = []
+        self.errors = list(errors or [])
+
+    def post(self, url, data=None, timeout=None):
+        if self.errors:
+            error = self.errors.pop(0)
+            if isinstance(error, Exception):
+                raise error
+            return MockResponse(error)
+
+        query = json.loads(data)['query']
+        self.queries.append(query)
+        result = {}
+        for (alias, ocd_id) in re.findall(r'(a\d+): person\(id: "([^"]+)"\)', query):
+            result[alias] = None if ocd_id.endswith('unknown') else person(ocd_id)
+        return MockResponse(200, {'data': result})
+
+
+class TestOpenStatesClient(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestOpenStatesClient, self).setUp(**kwargs)
+        self.client = OpenStatesClient(api_key='test')
+        self.delays = []
+        self.client._sleep = self.delays.append
+
+    def test_aliased_batches(self):
+        self.client.session = MockSession()
+        ids = ['ocd-person/%d' % n for n in range(30)]
+        people = self.client.people_by_id(ids)
+
+        self.assertEqual(len(self.client.session.queries), 2)
+        self.assertEqual([p['id'] for p in people], ids)
+
+    def test_retry(self):
+        self.client.session = MockSession(errors=[requests.ConnectionError('reset'), 503])
+        people = self.client.people_by_id(['ocd-person/1'])
+        self.assertEqual(people[0]['id'], 'ocd-person/1')
+        self.assertEqual(len(self.delays), 2)
+
+    def test_retry_exhausted(self):
+        self.client.session = MockSession(errors=[requests.Timeout('slow')] * 4)
+        with self.assertRaises(OpenStatesError):
+            self.client.people_by_id(['ocd-person/1'])
+
+    def test_client_error_not_retried(self):
+        self.client.session = MockSession(errors=[401])
+        with self.assertRaises(OpenStatesError):
+            self.client.people_by_id(['ocd-person/1'])
+        self.assertEqual(self.delays, [])
+
+    def test_time_budget(self):
+        self.client.session = MockSession(errors=[503] * 4)
+        self.client.backoff = 5
+        with self.assertRaises(OpenStatesError):
+            self.client.execute('{ jurisdictions { edges { node { id } } } }', max_time=1)
+        # gave up instead of sleeping past the budget
+        self.assertEqual(self.delays, [])
+        self.assertEqual(len(self.client.session.errors), 3)
+
+    def test_unavailable_fails_fast(self):
+        self.client.session = MockSession(errors=[requests.Timeout('slow')] * 4)
+        with self.assertRaises(OpenStatesError):
+            self.client.people_by_id(['ocd-person/1'])
+        with self.assertRaises(OpenStatesError):
+            self.client.people_by_id(['ocd-person/1'])
+        self.assertEqual(self.client.session.queries, [])
+
+        self.client._unavailable_until = 0
+        self.assertEqual(self.client.people_by_id(['ocd-person/1'])[0]['id'], 'ocd-person/1')
+
+
+class TestStateLegislatorBatch(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestStateLegislatorBatch, self).setUp(**kwargs)
+        self.mock_cache = {}
+        self.us_data = USDataProvider(self.mock_cache, zipcode_index=False)
+        self.us_data._openstates = OpenStatesClient()
+        self.session = self.us_data._openstates.session = MockSession()
+
+    def test_get_state_legids(self):
+        cached_key = self.us_data.KEY_OPENSTATES.format(id='ocd-person/cached')
+        self.mock_cache[cached_key] = {'id': 'ocd-person/cached', 'cache_key': cached_key}
+
+        ids = ['ocd-person/cached'] + ['ocd-person/%d' % n for n in range(10)] + ['ocd-person/unknown']
+        legislators = self.us_data.get_state_legids(ids)
+
+        self.assertEqual(len(self.session.queries), 1)
+        self.assertNotIn('ocd-person/cached', self.session.queries[0])
+        self.assertEqual(legislators[0]['id'], 'ocd-person/cached')
+        self.assertIsNone(legislators[-1])
+
+        leg = legislators[1]
+        self.assertEqual(leg['chamber'], 'upper')
+        self.assertEqual(leg['state'], 'CA')
+        self.assertEqual(leg['district'], '9')
+        self.assertEqual(self.mock_cache[leg['cache_key']], leg)
+
+        # now all cached
+        self.us_data.get_state_legids(ids[:-1])
+        self.assertEqual(len(self.session.queries), 1)
+
+    def test_openstates_unavailable(self):
+        reset_country_data()
+        us_data = get_country_data('us', cache=self.mock_cache)
+        us_data._openstates = OpenStatesClient()
+        us_data._openstates._unavailable_until = time.time() + 60
+        key = us_data.KEY_OPENSTATES.format(id='ocd-person/1')
+        try:
+            with self.assertRaises(OpenStatesError):
+                warm_political_data_cache([key], cache=self.mock_cache)
+            # targets are still saved, from the campaign form
+            self.assertEqual(check_political_data_cache(key, cache=self.mock_cache)['offices'], [])
+        finally:
+            reset_country_data()
+
+
+class MockSearchSession(object):
+    """Answers organization and name search queries, slowly"""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, timeout=None):
+        payload = json.loads(data)
+        with self.lock:
+            self.queries.append(payload)
+        time.sleep(0.05)
+
+        if 'getOrganizationID' in payload['query']:
+            return MockResponse(200, {'data': {'jurisdiction': {'organizations': {'edges': [
+                {'node': {'id': 'ocd-organization/ca-senate'}}]}}}})
+
+        node = person('ocd-person/%s' % payload['variables']['name'])
+        node['currentMemberships'] = node.pop('chamber')
+        return MockResponse(200, {'data': {'people': {'edges': [{'node': node}]}}})
+
+
+class TestStateLegislatorSearch(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestStateLegislatorSearch, self).setUp(**kwargs)
+        _local_organizations.clear()
+        self.mock_cache = {}
+        self.us_data = USDataProvider(self.mock_cache, zipcode_index=False)
+        self.us_data._openstates = OpenStatesClient()
+        self.session = self.us_data._openstates.session = MockSearchSession()
+
+    def tearDown(self):
+        _local_organizations.clear()
+        super(TestStateLegislatorSearch, self).tearDown()
+
+    def organization_queries(self):
+        return [q for q in self.session.queries if 'getOrganizationID' in q['query']]
+
+    def test_search_cached(self):
+        results = self.us_data.search_state_leg('CA', 'upper', 'Smith')
+        self.assertEqual(results[0]['uid'], 'ocd-person/Smith')
+        self.assertEqual(results[0]['state'], 'ca')
+
+        # same search, ignoring case
+        self.assertEqual(self.us_data.search_state_leg('ca', 'upper', 'smith '), results)
+        self.assertEqual(len(self.session.queries), 2)
+
+        # organization id is reused for other names
+        self.us_data.search_state_leg('CA', 'upper', 'Smit')
+        self.assertEqual(len(self.organization_queries()), 1)
+        self.assertEqual(len(self.session.queries), 3)
+
+    def test_concurrent_searches_coalesced(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.us_data.search_state_leg('CA', 'upper', 'Jones')))
+                   for n in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.session.queries), 2)
@@ -0,0 +1,86 @@
+import threading
+
+from .run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.political_data import COUNTRY_CHOICES, get_country_data, reset_country_data
+from call_server.political_data.countries.us import USDataProvider
+# import other countries outside the test request, where gettext needs a session
+import call_server.political_data.countries.ca
+import call_server.political_data.countries.eu
+from call_server.campaign.models import Campaign
+
+
+class TestDataProviderRegistry(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestDataProviderRegistry, self).setUp(**kwargs)
+        reset_country_data()
+        self.mock_cache = {}
+
+    def tearDown(self):
+        reset_country_data()
+        super(TestDataProviderRegistry, self).tearDown()
+
+    def test_provider_reused(self):
+        us_data = get_country_data('us', cache=self.mock_cache)
+        self.assertIsInstance(us_data, USDataProvider)
+        self.assertIs(get_country_data('US', cache=self.mock_cache), us_data)
+
+        # bound to each cache backend
+        other_cache = {}
+        self.assertIsNot(get_country_data('us', cache=other_cache), us_data)
+        self.assertIs(get_country_data('us', cache=other_cache)._cache, other_cache)
+
+    def test_rebuilt_on_config_change(self):
+        us_data = get_country_data('us', cache=self.mock_cache)
+        self.app.config['OPENSTATES_GEOHASH_PRECISION'] = '5'
+        rebuilt = get_country_data('us', cache=self.mock_cache)
+        self.assertIsNot(rebuilt, us_data)
+        self.assertEqual(rebuilt._geohash_precision, 5)
+
+    def test_invalid_geohash_precision(self):
+        self.app.config['OPENSTATES_GEOHASH_PRECISION'] = 'fine'
+        us_data = get_country_data('us', cache=self.mock_cache)
+        self.assertEqual(us_data._geohash_precision, 6)
+
+    def test_concurrent_build(self):
+        providers = []
+        threads = [threading.Thread(target=lambda: providers.append(get_country_data('ca', cache=self.mock_cache)))
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(providers), 8)
+        self.assertTrue(all(p is providers[0] for p in providers))
+
+    def test_campaign_list_builds_once(self):
+        # the admin campaign list and type form display every campaign and country
+        built = []
+        original_init = USDataProvider.__init__
+
+        def counting_init(provider, *args, **kwargs):
+            built.append(provider)
+            original_init(provider, *args, **kwargs)
+        USDataProvider.__init__ = counting_init
+        try:
+            campaigns = [Campaign(name='Campaign %d' % n, country_code='us', campaign_type='congress',
+                                  campaign_subtype='both', target_ordering='in-order') for n in range(20)]
+            db.session.add_all(campaigns)
+            db.session.commit()
+
+            for campaign in Campaign.query.all():
+                campaign.campaign_type_display()
+                campaign.campaign_subtype_display()
+                campaign.order_display()
+            for (country_code, country_name) in COUNTRY_CHOICES:
+                Campaign.get_campaign_type_choices(country_code)
+
+            # and the call hot path
+            for campaign in campaigns:
+                campaign.get_campaign_data().data_provider
+        finally:
+            USDataProvider.__init__ = original_init
+
+        self.assertEqual(len(built), 1)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+
+from .run import BaseTestCase
+
+from call_server.political_data.snapshot import (load_snapshot, read_snapshot, write_snapshot,
+                                                 sources_digest, SNAPSHOT_HEADER)
+from call_server.political_data import zipcodes
+from call_server.political_data.zipcodes import ZipcodeIndex, get_zipcode_index, reset_zipcode_index
+from call_server.political_data.countries.us import USDataProvider
+
+
+class TestPoliticalDataSnapshot(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestPoliticalDataSnapshot, self).setUp(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'source.csv')
+        with open(self.source, 'w') as f:
+            f.write('state_abbr,zcta,cd\nCA,94612,13\n')
+        self.path = os.path.join(self.tmp_dir, 'test.snapshot')
+
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(TestPoliticalDataSnapshot, self).tearDown()
+
+    def build(self):
+        self.builds += 1
+        return {'us:zipcode:94612': [{'state': 'CA', 'house_district': '13'}]}
+
+    def test_round_trip(self):
+        digest = sources_digest([self.source])
+        write_snapshot(self.path, self.build(), digest)
+        self.assertEqual(read_snapshot(self.path, digest), self.build())
+
+    def test_rebuild_when_sources_change(self):
+        first = load_snapshot(self.path, [self.source], self.build)
+        second = load_snapshot(self.path, [self.source], self.build)
+        self.assertEqual(first, second)
+        self.assertEqual(self.builds, 1)
+
+        with open(self.source, 'a') as f:
+            f.write('CA,94110,12\n')
+        load_snapshot(self.path, [self.source], self.build)
+        self.assertEqual(self.builds, 2)
+
+        # salt is part of the source digest
+        load_snapshot(self.path, [self.source], self.build, salt='tomorrow')
+        self.assertEqual(self.builds, 3)
+
+    def test_checksum(self):
+        digest = sources_digest([self.source])
+        write_snapshot(self.path, self.build(), digest)
+
+        # flip a byte in the payload
+        with open(self.path, 'r+b') as f:
+            f.seek(SNAPSHOT_HEADER.size + 2)
+            byte = f.read(1)
+            f.seek(SNAPSHOT_HEADER.size + 2)
+            f.write(bytes([byte[0] ^ 0xff]))
+        self.assertIsNone(read_snapshot(self.path, digest))
+
+    def test_missing_or_truncated(self):
+        digest = sources_digest([self.source])
+        self.assertIsNone(read_snapshot(self.path, digest))
+
+        with open(self.path, 'wb') as f:
+            f.write(b'CPDS')
+        self.assertIsNone(read_snapshot(self.path, digest))
+
+    def test_legislators_current_when_loaded(self):
+        # snapshots keep the term end, so they stay fresh from one day to the next
+        legislators = {'us:bioguide:B000002': [{
+            'first_name': 'Re', 'last_name': 'Cent', 'bioguide_id': 'B000002', 'title': 'Senator',
+            'phone': None, 'chamber': 'senate', 'state': 'CA', 'district': None, 'offices': [],
+            'party': 'Democrat', 'term_end': '2027-01-03', 'previous_phone': '202-224-3553',
+        }]}
+        us_data = USDataProvider({}, zipcode_index=False)
+
+        current = us_data._current_legislators(legislators, today='2026-06-01')
+        self.assertTrue(current['us:senate:CA'][0]['current'])
+        self.assertEqual(current['us:bioguide:B000002'][0]['phone'], '202-224-3553')
+        self.assertNotIn('term_end', current['us:bioguide:B000002'][0])
+
+        # out of office without a phone of their own
+        self.assertEqual(us_data._current_legislators(legislators, today='2027-06-01'), {})
+        self.assertEqual(legislators['us:bioguide:B000002'][0]['term_end'], '2027-01-03')
+
+
+class TestZipcodeIndex(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestZipcodeIndex, self).setUp(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'districts.csv')
+        with open(self.source, 'w') as f:
+            f.write('state_abbr,zcta,cd\n'
+                    'CA,94612,13\n'
+                    'MA,02111,8\n'
+                    'KY,42223,1\n'
+                    'TN,42223,7\n'
+                    'AK,99501,0\n')
+        self.path = os.path.join(self.tmp_dir, 'districts.snapshot')
+
+    def tearDown(self):
+        reset_zipcode_index()
+        shutil.rmtree(self.tmp_dir)
+        super(TestZipcodeIndex, self).tearDown()
+
+    def test_lookup(self):
+        self.assertEqual(ZipcodeIndex.build(self.source, self.path), 5)
+        index = ZipcodeIndex.open(self.path)
+
+        self.assertEqual(index.get('94612'), [{'state': 'CA', 'zipcode': '94612', 'house_district': '13'}])
+        self.assertEqual(index.get('02111')[0]['state'], 'MA')
+        self.assertEqual(index.get('99501')[0]['house_district'], '0')
+        self.assertEqual([d['state'] for d in index.get('42223')], ['KY', 'TN'])
+
+        self.assertEqual(index.get('94110'), [])
+        self.assertEqual(index.get('not-a-zip'), [])
+
+    def test_rebuild_when_csv_changes(self):
+        reset_zipcode_index()
+        self.assertEqual(len(get_zipcode_index(self.source, self.path)), 5)
+
+        with open(self.source, 'a') as f:
+            f.write('CA,94110,12\n')
+        reset_zipcode_index()
+        index = get_zipcode_index(self.source, self.path)
+        self.assertEqual(index.get('94110')[0]['house_district'], '12')
+
+    def test_retry_after_failure(self):
+        path = os.path.join(self.tmp_dir, 'index', 'districts.snapshot')
+        missing = os.path.join(self.tmp_dir, 'missing.csv')
+        reset_zipcode_index()
+        self.assertIsNone(get_zipcode_index(missing, path))
+
+        # not retried right away
+        shutil.copy(self.source, missing)
+        self.assertIsNone(get_zipcode_index(missing, path))
+
+        interval = zipcodes.INDEX_RETRY_INTERVAL
+        zipcodes.INDEX_RETRY_INTERVAL = 0
+        try:
+            self.assertEqual(len(get_zipcode_index(missing, path)), 5)
+        finally:
+            zipcodes.INDEX_RETRY_INTERVAL = interval
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['districts.snapshot'])
+
+    def test_matches_cache(self):
+        # index and cached keys are built from the same csv
+        mock_cache = {}
+        us_data = USDataProvider(mock_cache, zipcode_index=False)
+        districts = us_data._load_districts()
+        index = get_zipcode_index()
+        for zipcode in ['94612', '02111', '53811', '42223', '11217']:
+            self.assertEqual(index.get(zipcode), districts[us_data.KEY_ZIPCODE.format(zipcode=zipcode)])
@@ -0,0 +1,57 @@
+import io
+
+import yaml
+
+from .run import BaseTestCase
+
+from call_server.political_data.yaml_stream import iter_yaml_sequence, peak_rss
+from call_server.political_data.countries.us import USDataProvider
+
+LEGISLATORS = '''
+- id: {bioguide: A000001, fec: [H1, S2]}
+  name: {first: Old, last: Timer}
+  terms:
+  - {type: rep, start: '1991-01-03', end: '1993-01-03', state: OH, district: 1}
+  - {type: rep, start: '2013-01-03', end: '2015-01-03', state: OH, district: 1}
+- id: {bioguide: B000002}
+  name: {first: Re, last: Cent, nickname: Rec}
+  other: [[1, 2], {nested: {start: '1900-01-01'}}]
+  terms:
+  - type: sen
+    start: '2015-01-06'
+    end: '2021-01-03'
+    state: CA
+    party: Democrat
+  - type: sen
+    start: '2021-01-03'
+    end: '2027-01-03'
+    state: CA
+    party: Democrat
+- id: {bioguide: C000003}
+  name: {first: No, last: Terms}
+'''
+
+
+class TestYAMLStream(BaseTestCase):
+
+    def recent(self, start):
+        return start is not None and start >= '2015-01-01'
+
+    def test_unfiltered(self):
+        self.assertEqual(list(iter_yaml_sequence(io.StringIO(LEGISLATORS))), yaml.safe_load(LEGISLATORS))
+
+    def test_filtered(self):
+        kept = list(iter_yaml_sequence(io.StringIO(LEGISLATORS), ('terms', '*', 'start'), self.recent))
+        expected = [leg for leg in yaml.safe_load(LEGISLATORS) if 'terms' in leg and self.recent(leg['terms'][-1]['start'])]
+        self.assertEqual(kept, expected)
+        self.assertEqual([leg['id']['bioguide'] for leg in kept], ['B000002'])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_yaml_sequence(io.StringIO('[]'))), [])
+
+    def test_peak_rss(self):
+        self.assertGreater(peak_rss(), 0)
+
+    def test_same_as_document_loader(self):
+        us_data = USDataProvider({}, zipcode_index=False)
+        self.assertEqual(us_data._load_legislators(stream=True), us_data._load_legislators(stream=False))
@@ -1,6 +1,7 @@
 import logging
 
 from tests.run import BaseTestCase
+from tests.mocks import CountingCache
 
 from call_server.political_data.lookup import locate_targets
 from call_server.political_data.countries.us import USDataProvider
@@ -106,6 +107,50 @@ class TestUSData(BaseTestCase):
         self.assertEqual(rep['district'], '0')
         self.assertGreater(len(rep['offices']), 1)
 
+    def test_cache_search_many(self):
+        results = self.us_data.cache_search_many(['us:senate:MA', 'us:senate:VT'])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(set(r['state'] for r in results), set(['MA', 'VT']))
+
+    def test_cache_get_many(self):
+        senators, missing = self.us_data.cache_get_many(['us:senate:MA', 'us:senate:XX'])
+        self.assertEqual(len(senators), 2)
+        self.assertEqual(missing, [])
+
+        (first, second) = self.us_data.cache_get_many(['us:senate:XX', 'us:senate:YY'])
+        first.append('changed')
+        self.assertEqual(second, [])
+
+    def test_search_index(self):
+        results = self.us_data.search(['us:senate:'], [('last_name', 'warr')])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['state'], 'MA')
+
+        # accents are ignored
+        results = self.us_data.search(['us:house:'], [('last_name', 'Velazquez')])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['state'], 'NY')
+
+        # name tokens match within multi-word names
+        results = self.us_data.search(['us:senate:', 'us:house:'], [('name', 'hollen')])
+        self.assertEqual([r['last_name'] for r in results], ['Van Hollen'])
+
+    def test_search_index_intersection(self):
+        results = self.us_data.search(['us:senate:'], [('state', 'ma'), ('party', 'democrat')])
+        self.assertEqual(len(results), 2)
+
+        no_results = self.us_data.search(['us:house:'], [('state', 'ma'), ('last_name', 'warren')])
+        self.assertEqual(no_results, [])
+
+    def test_search_without_index(self):
+        # data loaded before the search index existed
+        index = self.mock_cache.pop(self.us_data.SEARCH_INDEX)
+        try:
+            results = self.us_data.search(['us:senate:'], [('last_name', 'warr')])
+        finally:
+            self.mock_cache[self.us_data.SEARCH_INDEX] = index
+        self.assertEqual([r['state'] for r in results], ['MA'])
+
     def test_locate_targets(self):
         uids = locate_targets(self.mock_location, self.CONGRESS_CAMPAIGN, cache=self.mock_cache)
         # returns a list of target uids
@@ -266,6 +311,23 @@ class TestUSData(BaseTestCase):
         self.assertIn(third['state'], ['TN','KY'])
  
 
+    def test_all_targets_round_trips(self):
+        # districts from the local zipcode index, legislators in one batch
+        counting_cache = CountingCache(self.mock_cache)
+        congress = USDataProvider(counting_cache, 'localmem').get_campaign_type('congress')
+
+        targets = congress.all_targets(self.mock_location_multiple_states)
+        self.assertEqual(counting_cache.round_trips, 1)
+        self.assertEqual(len(targets['lower']['all']), 2)
+        self.assertEqual(len(targets['upper']['all']), 4)
+        self.assertEqual(len(targets['upper']['democrats']) + len(targets['upper']['republicans']), 4)
+
+        # without the index, districts are one more cache read
+        counting_cache = CountingCache(self.mock_cache)
+        congress = USDataProvider(counting_cache, 'localmem', zipcode_index=False).get_campaign_type('congress')
+        self.assertEqual(congress.all_targets(self.mock_location_multiple_states), targets)
+        self.assertEqual(counting_cache.round_trips, 2)
+
     def test_locate_targets_multiple_districts(self):
         self.CONGRESS_CAMPAIGN.campaign_subtype = 'both'
         self.CONGRESS_CAMPAIGN.target_ordering = 'lower-first'
@@ -7,6 +7,7 @@ from call_server.political_data.lookup import locate_targets
 from call_server.political_data.countries.us import USDataProvider
 from call_server.political_data.constants import US_STATES
 from call_server.political_data.geocode import Location
+from call_server.political_data.geohash import geohash_encode
 from call_server.campaign.models import Campaign
 
 class TestUSStateData(BaseTestCase):
@@ -166,3 +167,73 @@ class TestUSStateData(BaseTestCase):
         self.assertEqual(gov[0]['state_name'], 'California')
         self.assertEqual(gov[0]['title'], 'Governor')
 
+
+
+class TestStateLegislatorCache(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestStateLegislatorCache, self).setUp(**kwargs)
+        self.mock_cache = {}
+        self.us_data = USDataProvider(self.mock_cache, zipcode_index=False)
+        self.us_data._geohash_precision = 6
+        self.us_data._geohash_verify = False
+
+        self.queries = []
+        self.us_data._query_state_legislators = self.mock_query
+        self.districts = {'lower': '18', 'upper': '9'}
+
+    def mock_query(self, latitude, longitude):
+        self.queries.append((latitude, longitude))
+        legislators = []
+        for (chamber, district) in self.districts.items():
+            key = self.us_data.KEY_OPENSTATES.format(id='ocd-person/%s-%s' % (chamber, district))
+            division = 'ocd-division/country:us/state:ca/%s:%s' % ('sldu' if chamber == 'upper' else 'sldl', district)
+            leg = {'id': key, 'chamber': chamber, 'state': 'CA', 'district': district,
+                   'division': division, 'cache_key': key}
+            self.mock_cache[key] = leg
+            legislators.append(leg)
+        return legislators
+
+    def test_geohash(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_geohash_bucket(self):
+        first = self.us_data.get_state_legislators(Location('Oakland, CA', (37.80500, -122.27200), {}))
+        # a block away, same cell
+        second = self.us_data.get_state_legislators(Location('Oakland, CA', (37.80600, -122.27100), {}))
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(first, second)
+
+        # across town
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.76500, -122.24200), {}))
+        self.assertEqual(len(self.queries), 2)
+
+    def test_zipcode_bucket(self):
+        location = Location('94612', (None, None), {'state': 'CA', 'zipcode': '94612'})
+        self.us_data.get_location = lambda *args, **kwargs: Location('94612', (37.80500, -122.27200), {})
+
+        self.us_data.get_state_legislators(location)
+        self.us_data.get_state_legislators(location)
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn(self.us_data.KEY_OPENSTATES_ZIPCODE.format(zipcode='94612'), self.mock_cache)
+
+    def test_verify_boundary(self):
+        self.us_data._geohash_verify = True
+        # cell 9q9p1d spans 37.80396-37.80945, -122.27783--122.26685
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.80600, -122.27200), {}))
+
+        # interior hits are served from the bucket
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.80700, -122.27300), {}))
+        self.assertEqual(len(self.queries), 1)
+
+        # edge hits are confirmed
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.80400, -122.27300), {}))
+        self.assertEqual(len(self.queries), 2)
+
+        # and a different district marks the cell split
+        self.districts['lower'] = '15'
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.80940, -122.27300), {}))
+        self.assertEqual(self.mock_cache[self.us_data.KEY_OPENSTATES_GEOHASH.format(precision=6, geohash='9q9p1d')],
+                         self.us_data.OPENSTATES_BUCKET_SPLIT)
+        self.us_data.get_state_legislators(Location('Oakland, CA', (37.80700, -122.27300), {}))
+        self.assertEqual(len(self.queries), 4)